@@ -0,0 +1,190 @@
+"""Benchmarks for in-process data structures.
+
+    python bench.py memory --users 200 --shortcuts 500
+    python bench.py revisions --shortcuts 500 --edits 50
+
+`memory` builds synthetic libraries and reports the memory each cached user
+costs in each representation, measured with tracemalloc. `revisions` replays
+synthetic edits through the revision planner and reports how history storage
+grows compared with keeping a full copy per edit.
+"""
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List
+import gc
+import json
+import time
+import uuid
+import random
+import tracemalloc
+
+import typer
+
+from packed import PackedLibrary
+import revisions
+
+bench = typer.Typer(help="TextGrow backend benchmarks")
+
+@bench.callback()
+def main():
+    """TextGrow backend benchmarks"""
+
+# Triggers many users share; the rest are unique per user
+COMMON_TRIGGERS = ['@sig', '@addr', '@email', '@phone', '@thanks', '@meet', '@intro', '@bye', '@ty', '@brb']
+WORDS = ('regards thanks please meeting schedule attached follow up tomorrow invoice '
+         'project update review call address phone available best kind note').split()
+
+def synthetic_library(rng: random.Random, user_id: str, shortcuts: int, content_length: int) -> List[Dict[str, Any]]:
+    """Rows shaped like the PostgREST response for one user's shortcuts"""
+    started = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    rows = []
+    for index in range(shortcuts):
+        if index < len(COMMON_TRIGGERS):
+            trigger = COMMON_TRIGGERS[index]
+        else:
+            trigger = f'@{rng.choice(WORDS)}{index}'
+        words = []
+        while sum(len(word) + 1 for word in words) < rng.randint(content_length // 4, content_length * 2):
+            words.append(rng.choice(WORDS))
+        created = started + timedelta(seconds=rng.randint(0, 3e7), microseconds=rng.randint(0, 999999))
+        rows.append({
+            'id': str(uuid.UUID(int=rng.getrandbits(128))),
+            'user_id': user_id,
+            'trigger': trigger,
+            'content': ' '.join(words),
+            'created_at': created.isoformat(),
+            'updated_at': (created + timedelta(days=rng.randint(0, 30))).isoformat()
+        })
+    return rows
+
+def _measure(build: Callable[[], Any]) -> int:
+    """Bytes still allocated by what `build()` returns"""
+    gc.collect()
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    result = build()
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    del result
+    return used
+
+@bench.command()
+def memory(
+    users: int = typer.Option(200, help="Libraries to build"),
+    shortcuts: int = typer.Option(500, help="Shortcuts per library"),
+    content_length: int = typer.Option(120, help="Typical content length in characters"),
+    projected_users: int = typer.Option(20000, help="Active users to project totals for"),
+    seed: int = typer.Option(1, help="Random seed"),
+):
+    """Memory per cached user: row dicts vs API models vs PackedLibrary"""
+    from server import Shortcut
+
+    rng = random.Random(seed)
+    payloads = []
+    for _ in range(users):
+        user_id = str(uuid.UUID(int=rng.getrandbits(128)))
+        payloads.append((user_id, json.dumps(synthetic_library(rng, user_id, shortcuts, content_length))))
+    content_bytes = sum(len(row['content'].encode('utf-8')) for row in json.loads(payloads[0][1]))
+
+    def rows():
+        return [json.loads(payload) for _, payload in payloads]
+
+    def models():
+        return [
+            [Shortcut(
+                id=row['id'],
+                user_id=row['user_id'],
+                trigger=row['trigger'],
+                content=row['content'],
+                created_at=datetime.fromisoformat(row['created_at']),
+                updated_at=datetime.fromisoformat(row['updated_at'])
+            ) for row in json.loads(payload)]
+            for _, payload in payloads
+        ]
+
+    def packed():
+        return [PackedLibrary(user_id, json.loads(payload)) for user_id, payload in payloads]
+
+    typer.echo(f"{users} users x {shortcuts} shortcuts, ~{content_bytes // shortcuts} bytes of content each\n")
+    typer.echo(f"{'representation':<16}{'per user':>14}{'per shortcut':>15}{f'{projected_users} users':>16}")
+    for name, build in (('row dicts', rows), ('pydantic models', models), ('packed', packed)):
+        per_user = _measure(build) / users
+        typer.echo(
+            f"{name:<16}{per_user / 1024:>11.1f} KB{per_user / shortcuts:>13.0f} B"
+            f"{per_user * projected_users / 1024 ** 3:>13.2f} GB"
+        )
+
+    libraries = packed()
+    started = time.perf_counter()
+    for library in libraries:
+        for _ in library.rows():
+            pass
+    elapsed = time.perf_counter() - started
+    typer.echo(f"\nRebuilding rows from packed: {elapsed / users * 1e3:.2f} ms per user")
+
+def synthetic_edit(rng: random.Random, content: str) -> str:
+    """A typical small edit: change, insert or delete a word, or append a phrase"""
+    words = content.split(' ')
+    action = rng.random()
+    index = rng.randrange(len(words))
+    if action < 0.5:
+        words[index] = rng.choice(WORDS)
+    elif action < 0.75:
+        words.insert(index, rng.choice(WORDS))
+    elif action < 0.9 and len(words) > 1:
+        del words[index]
+    else:
+        words.extend(rng.choice(WORDS) for _ in range(rng.randint(2, 6)))
+    return ' '.join(words)
+
+@bench.command(name='revisions')
+def revision_storage(
+    shortcuts: int = typer.Option(500, help="Shortcuts to edit"),
+    edits: int = typer.Option(50, help="Edits per shortcut"),
+    content_length: int = typer.Option(120, help="Typical content length in characters"),
+    snapshot_interval: int = typer.Option(revisions.SNAPSHOT_INTERVAL, help="Revisions between full snapshots"),
+    seed: int = typer.Option(1, help="Random seed"),
+):
+    """History storage growth: delta revisions vs a full copy per edit"""
+    revisions.SNAPSHOT_INTERVAL = snapshot_interval
+    rng = random.Random(seed)
+    library = synthetic_library(rng, str(uuid.UUID(int=rng.getrandbits(128))), shortcuts, content_length)
+
+    histories = []
+    full_bytes = 0
+    planning = 0.0
+    for row in library:
+        content = row['content']
+        stored = []
+        for _ in range(edits):
+            edited = synthetic_edit(rng, content)
+            started = time.perf_counter()
+            stored.extend(revisions.plan_revisions(stored[-1] if stored else None, content, edited))
+            planning += time.perf_counter() - started
+            full_bytes += len(edited.encode('utf-8'))
+            content = edited
+        histories.append((stored, content))
+
+    rows = [row for stored, _ in histories for row in stored]
+    body_bytes = sum(len(row['body'].encode('utf-8')) for row in rows)
+    snapshots = sum(1 for row in rows if row['kind'] == revisions.SNAPSHOT)
+    # Per-row overhead besides the body: ids, numbers, checksum and timestamp
+    row_overhead = 16 * 3 + 4 * 2 + 16 + 8
+    typer.echo(f"{shortcuts} shortcuts x {edits} edits, snapshot every {snapshot_interval} revisions\n")
+    typer.echo(f"{'storage':<18}{'rows':>8}{'body bytes':>14}{'per edit':>12}")
+    typer.echo(f"{'full copies':<18}{shortcuts * edits:>8}{full_bytes:>14}{full_bytes / (shortcuts * edits):>10.0f} B")
+    typer.echo(f"{'deltas':<18}{len(rows):>8}{body_bytes:>14}{body_bytes / (shortcuts * edits):>10.0f} B")
+    typer.echo(
+        f"\n{snapshots} snapshots; body bytes are {body_bytes / full_bytes:.1%} of full copies "
+        f"({(body_bytes + len(rows) * row_overhead) / (full_bytes + shortcuts * edits * row_overhead):.1%} with row overhead)"
+    )
+
+    started = time.perf_counter()
+    for stored, content in histories:
+        latest = stored[-1]['revision']
+        assert revisions.rebuild([row for row in stored if row['revision'] >= revisions.chain_start(latest)], latest) == content
+    elapsed = time.perf_counter() - started
+    typer.echo(f"Planning: {planning / (shortcuts * edits) * 1e6:.0f} us per edit; rebuilding the newest revision: {elapsed / shortcuts * 1e6:.0f} us")
+
+if __name__ == "__main__":
+    bench()
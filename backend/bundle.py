@@ -0,0 +1,70 @@
+"""Precompiled per-user expansion bundles.
+
+A bundle is everything a client needs to expand text, compiled once per
+library version: shortcuts sorted by casefolded trigger, with a parallel key
+array so clients can binary-search exact and prefix matches without building
+their own structures.
+
+    {"format": 2,
+     "count": 2,
+     "keys": ["@addr", "@sig"],
+     "shortcuts": [[id, trigger, content, updated_at_ms, template], ...]}
+
+`template` is the compiled form of the content (see templates.py), or null
+for plain text.
+
+Bundles are content-addressed (the version is a hash of the bytes) and kept
+in the cache tier, so serving one is a cache lookup. Clients poll the tiny
+/api/bundle/version endpoint and only download a bundle when it changes.
+"""
+from typing import Any, Dict, Iterable, Optional
+import json
+import hashlib
+
+from cache import get_cache
+from formats import epoch_ms
+from templates import compiled_for
+from triggers import trigger_key
+
+BUNDLE_FORMAT = 2
+BUNDLE_TTL = 7 * 24 * 3600
+
+def compile_bundle(rows: Iterable[Dict[str, Any]]) -> bytes:
+    ordered = sorted(rows, key=lambda row: (trigger_key(row['trigger']), row['id']))
+    payload = {
+        'format': BUNDLE_FORMAT,
+        'count': len(ordered),
+        'keys': [trigger_key(row['trigger']) for row in ordered],
+        'shortcuts': [
+            [row['id'], row['trigger'], row['content'], epoch_ms(row['updated_at']), compiled_for(row)]
+            for row in ordered
+        ],
+    }
+    return json.dumps(payload, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+def _current_key(user_id: str) -> str:
+    return f'bundle:{user_id}:current'
+
+def _blob_key(user_id: str, version: str) -> str:
+    return f'bundle:{user_id}:{version}'
+
+def build_bundle(user_id: str, library_version: str, rows: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """Compile and store the user's bundle; returns its metadata"""
+    body = compile_bundle(rows)
+    version = hashlib.sha256(body).hexdigest()[:20]
+    meta = {
+        'version': version,
+        'library_version': library_version,
+        'size': len(body),
+    }
+    cache = get_cache()
+    # Blob first, so a published version always has its bytes available
+    cache.set(_blob_key(user_id, version), body, BUNDLE_TTL)
+    cache.set(_current_key(user_id), meta, BUNDLE_TTL)
+    return meta
+
+def get_current_bundle(user_id: str) -> Optional[Dict[str, Any]]:
+    return get_cache().get(_current_key(user_id))
+
+def get_bundle_blob(user_id: str, version: str) -> Optional[bytes]:
+    return get_cache().get(_blob_key(user_id, version))
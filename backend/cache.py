@@ -0,0 +1,178 @@
+"""Cache tier shared by the API workers.
+
+Each worker uses an in-process CacheStore by default. When the server is
+started through `cli.py serve` with more than one worker (or with
+`--shared-cache`), a single CacheStore is hosted in a manager process
+listening on a local socket, and every worker talks to that one instead, so
+cached data and counters stay coherent across cores. The CLI refuses to run
+several workers without it, and a worker that cannot reach it fails to start
+rather than fall back to a local cache that other workers would not see.
+"""
+from multiprocessing.managers import BaseManager
+from collections import OrderedDict
+from typing import Any, Optional
+import os
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Set by the CLI for the worker processes when the shared tier is enabled
+SHARED_CACHE_ADDRESS_ENV = 'TEXTGROW_SHARED_CACHE'
+SHARED_CACHE_AUTHKEY_ENV = 'TEXTGROW_SHARED_CACHE_AUTHKEY'
+
+DEFAULT_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', '50000'))
+# Cap on the TTL of entries that writes invalidate, while the cache is local:
+# an invalidation then reaches only the worker that made the write
+LOCAL_INVALIDATION_TTL = float(os.environ.get('LOCAL_INVALIDATION_TTL', '5'))
+SHARED_CACHE_CONNECT_ATTEMPTS = 5
+
+class CacheStore:
+    """Bounded LRU key/value store with per-entry TTLs.
+
+    Every public method is atomic, which is what makes it safe to host behind
+    a manager proxy and call from many workers at once.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self._max_entries = max_entries
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def _get_entry(self, key: str, now: float):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry[0] is not None and entry[0] <= now:
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return entry
+
+    def _put(self, key: str, value: Any, ttl: Optional[float], now: float) -> None:
+        self._data[key] = (now + ttl if ttl else None, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self._max_entries:
+            self._data.popitem(last=False)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._get_entry(key, time.monotonic())
+            return default if entry is None else entry[1]
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        with self._lock:
+            self._put(key, value, ttl, time.monotonic())
+
+    def setdefault(self, key: str, value: Any, ttl: Optional[float] = None) -> Any:
+        """Set `key` only if missing; return the value now stored"""
+        with self._lock:
+            now = time.monotonic()
+            entry = self._get_entry(key, now)
+            if entry is not None:
+                return entry[1]
+            self._put(key, value, ttl, now)
+            return value
+
+    def getset(self, key: str, value: Any, ttl: Optional[float] = None) -> Any:
+        """Set `key` and return its previous value (None if missing)"""
+        with self._lock:
+            now = time.monotonic()
+            entry = self._get_entry(key, now)
+            self._put(key, value, ttl, now)
+            return None if entry is None else entry[1]
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        """Add to an integer counter, creating it if needed, and return the new value"""
+        with self._lock:
+            now = time.monotonic()
+            entry = self._get_entry(key, now)
+            value = (entry[1] if entry else 0) + amount
+            if entry:
+                self._data[key] = (entry[0], value)
+            else:
+                self._put(key, value, ttl, now)
+            return value
+
+    def take_token(self, key: str, rate: float, burst: int, cost: float = 1.0) -> float:
+        """Token-bucket check: consume `cost` tokens from the bucket at `key`.
+        
+        The bucket refills at `rate` tokens per second up to `burst`. Returns 0
+        if the tokens were taken, otherwise the seconds until enough are available.
+        """
+        with self._lock:
+            now = time.monotonic()
+            entry = self._get_entry(key, now)
+            tokens, updated = entry[1] if entry else (float(burst), now)
+            tokens = min(float(burst), tokens + (now - updated) * rate)
+            if tokens >= cost:
+                tokens -= cost
+                retry_after = 0.0
+            else:
+                retry_after = (cost - tokens) / rate
+            # An idle bucket is full again after burst / rate seconds
+            self._put(key, (tokens, now), burst / rate + 1, now)
+            return retry_after
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+class CacheManager(BaseManager):
+    pass
+
+_hosted_store: Optional[CacheStore] = None
+
+def _get_hosted_store() -> CacheStore:
+    global _hosted_store
+    if _hosted_store is None:
+        _hosted_store = CacheStore()
+    return _hosted_store
+
+CacheManager.register('get_store', callable=_get_hosted_store)
+
+def start_shared_cache(address: str, authkey: bytes) -> CacheManager:
+    """Start the manager process hosting the shared store (called by the CLI)"""
+    manager = CacheManager(address=address, authkey=authkey)
+    manager.start()
+    return manager
+
+def _connect_shared_cache(address: str):
+    authkey = bytes.fromhex(os.environ[SHARED_CACHE_AUTHKEY_ENV])
+    for attempt in range(SHARED_CACHE_CONNECT_ATTEMPTS):
+        try:
+            manager = CacheManager(address=address, authkey=authkey)
+            manager.connect()
+            return manager.get_store()
+        except Exception as e:
+            if attempt == SHARED_CACHE_CONNECT_ATTEMPTS - 1:
+                # Idempotency keys, rate limits and coalescing would silently stop working across workers
+                raise RuntimeError(f"Shared cache at {address} unavailable: {e}") from e
+            logger.warning(f"Shared cache at {address} unavailable, retrying: {e}")
+            time.sleep(0.2 * 2 ** attempt)
+
+_cache = None
+
+def get_cache():
+    """Return this process's cache: the shared store if configured, else a local one
+
+    Raises RuntimeError if the shared store is configured but cannot be reached.
+    """
+    global _cache
+    if _cache is not None:
+        return _cache
+
+    address = os.environ.get(SHARED_CACHE_ADDRESS_ENV)
+    _cache = _connect_shared_cache(address) if address else CacheStore()
+    return _cache
+
+def cache_backend() -> str:
+    return 'local' if isinstance(get_cache(), CacheStore) else 'shared'
+
+def coherent_ttl(ttl: float) -> float:
+    """`ttl` for an entry that writes invalidate; capped when other workers could not see the invalidation"""
+    return ttl if cache_backend() == 'shared' else min(ttl, LOCAL_INVALIDATION_TTL)
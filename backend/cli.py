@@ -0,0 +1,92 @@
+"""Production entry point for the TextGrow API.
+
+    python cli.py serve --workers 4
+
+Runs `server:app` under uvicorn with one process per worker. uvloop and
+httptools are used when installed (the `auto` defaults pick them up).
+
+With more than one worker the shared cache tier is always on: library
+versions, access lists and other invalidated entries live in the cache tier,
+and per-worker copies would let a worker keep serving data another worker's
+write replaced.
+"""
+from pathlib import Path
+from typing import Optional
+import os
+import secrets
+import tempfile
+
+import typer
+import uvicorn
+
+from cache import SHARED_CACHE_ADDRESS_ENV, SHARED_CACHE_AUTHKEY_ENV, start_shared_cache
+from logs import setup_logging
+
+ROOT_DIR = Path(__file__).parent
+
+cli = typer.Typer(help="TextGrow API server")
+
+@cli.command()
+def serve(
+    host: str = typer.Option("0.0.0.0", help="Interface to bind"),
+    port: int = typer.Option(8001, help="Port to bind"),
+    workers: Optional[int] = typer.Option(None, help="Worker processes (default: one per CPU)"),
+    loop: str = typer.Option("auto", help="Event loop: auto, uvloop or asyncio"),
+    http: str = typer.Option("auto", help="HTTP parser: auto, httptools or h11"),
+    graceful_timeout: int = typer.Option(30, help="Seconds to let in-flight requests finish on shutdown"),
+    shared_cache: Optional[bool] = typer.Option(
+        None, help="Share caches and rate limits between workers (default: on with more than one worker)"
+    ),
+    forwarded_allow_ips: str = typer.Option(
+        os.environ.get('FORWARDED_ALLOW_IPS', '127.0.0.1'),
+        help="Comma-separated proxy IPs (or *) whose X-Forwarded-For is trusted for the client address"
+    ),
+    log_level: str = typer.Option("info", help="Uvicorn log level"),
+):
+    """Serve the API with multiple workers"""
+    workers = workers or os.cpu_count() or 1
+    if shared_cache is None:
+        shared_cache = workers > 1
+    elif not shared_cache and workers > 1:
+        raise typer.BadParameter("more than one worker needs the shared cache", param_hint="--no-shared-cache")
+    # Uvicorn's own loggers propagate to the queue-backed root handler (see logs.py)
+    setup_logging()
+
+    manager = None
+    if shared_cache:
+        address = os.path.join(tempfile.mkdtemp(prefix='textgrow-'), 'cache.sock')
+        authkey = secrets.token_bytes(32)
+        manager = start_shared_cache(address, authkey)
+        # Workers inherit the environment and connect on startup
+        os.environ[SHARED_CACHE_ADDRESS_ENV] = address
+        os.environ[SHARED_CACHE_AUTHKEY_ENV] = authkey.hex()
+        typer.echo(f"Shared cache listening on {address}")
+
+    try:
+        uvicorn.run(
+            "server:app",
+            app_dir=str(ROOT_DIR),
+            host=host,
+            port=port,
+            workers=workers,
+            loop=loop,
+            http=http,
+            timeout_graceful_shutdown=graceful_timeout,
+            # Behind a load balancer the socket peer is the balancer; the
+            # per-IP rate limit needs the client address it forwards
+            proxy_headers=True,
+            forwarded_allow_ips=forwarded_allow_ips,
+            log_level=log_level,
+            log_config=None,
+        )
+    finally:
+        if manager is not None:
+            manager.shutdown()
+
+@cli.command()
+def dev(host: str = "0.0.0.0", port: int = 8001):
+    """Serve a single auto-reloading worker for local development"""
+    uvicorn.run("server:app", app_dir=str(ROOT_DIR), host=host, port=port, reload=True)
+
+if __name__ == "__main__":
+    cli()
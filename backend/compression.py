@@ -0,0 +1,205 @@
+"""Response compression with Accept-Encoding negotiation.
+
+CompressionMiddleware compresses complete (non-streaming) responses above a
+size threshold with zstd, brotli or gzip, whichever the client accepts and is
+available here. GET responses get a weak ETag computed from the uncompressed
+body; a matching If-None-Match returns 304. Encoded bodies are cached by a
+hash of the uncompressed body and the encoding, so an unchanged export or
+full sync is compressed once. ETags set by the app are not used as the key:
+they only identify a representation within one resource, and two routes may
+share a version token.
+"""
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+import os
+import gzip
+import hashlib
+import threading
+
+try:
+    import brotli
+except ImportError:  # optional
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # optional
+    zstandard = None
+
+MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', '1024'))
+GZIP_LEVEL = int(os.environ.get('COMPRESSION_GZIP_LEVEL', '6'))
+BROTLI_LEVEL = int(os.environ.get('COMPRESSION_BROTLI_LEVEL', '5'))
+ZSTD_LEVEL = int(os.environ.get('COMPRESSION_ZSTD_LEVEL', '3'))
+ENCODED_CACHE_BYTES = int(os.environ.get('COMPRESSION_CACHE_BYTES', str(32 * 1024 * 1024)))
+
+COMPRESSIBLE_TYPES = (
+    'application/json', 'text/', 'application/x-ndjson', 'application/javascript',
+    'application/vnd.textgrow.', 'application/msgpack',
+)
+
+def _gzip(body: bytes) -> bytes:
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+def _brotli(body: bytes) -> bytes:
+    return brotli.compress(body, quality=BROTLI_LEVEL)
+
+def _zstd(body: bytes) -> bytes:
+    return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(body)
+
+# Server preference order; only encoders whose library is installed
+ENCODERS: Dict[str, Callable[[bytes], bytes]] = {}
+if zstandard is not None:
+    ENCODERS['zstd'] = _zstd
+if brotli is not None:
+    ENCODERS['br'] = _brotli
+ENCODERS['gzip'] = _gzip
+
+def parse_accept_encoding(header: str) -> Dict[str, float]:
+    """Map each coding in an Accept-Encoding header to its q-value"""
+    accepted = {}
+    for part in header.split(','):
+        coding, _, params = part.strip().partition(';')
+        if not coding:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[coding.strip().lower()] = q
+    return accepted
+
+def choose_encoding(header: str) -> Optional[str]:
+    """Pick the best available encoding the client accepts, or None for identity"""
+    accepted = parse_accept_encoding(header)
+    wildcard = accepted.get('*', 0.0)
+    best, best_q = None, 0.0
+    for coding in ENCODERS:
+        q = accepted.get(coding, wildcard)
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+class EncodedBodyCache:
+    """LRU of encoded bodies keyed by (body hash, encoding), bounded by total size"""
+
+    def __init__(self, max_bytes: int):
+        self._max_bytes = max_bytes
+        self._size = 0
+        self._data: "OrderedDict[Tuple[str, str], bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple[str, str]) -> Optional[bytes]:
+        with self._lock:
+            body = self._data.get(key)
+            if body is not None:
+                self._data.move_to_end(key)
+            return body
+
+    def put(self, key: Tuple[str, str], body: bytes) -> None:
+        if len(body) > self._max_bytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+            self._data[key] = body
+            self._size += len(body)
+            while self._size > self._max_bytes:
+                _, evicted = self._data.popitem(last=False)
+                self._size -= len(evicted)
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    # Weak comparison (RFC 9110 13.1.2)
+    opaque = etag[2:] if etag.startswith('W/') else etag
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate == '*' or (candidate[2:] if candidate.startswith('W/') else candidate) == opaque:
+            return True
+    return False
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: int = MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.encoded_cache = EncodedBodyCache(ENCODED_CACHE_BYTES)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        request_headers = {k.decode('latin-1'): v.decode('latin-1') for k, v in scope['headers']}
+        encoding = choose_encoding(request_headers.get('accept-encoding', ''))
+        if_none_match = request_headers.get('if-none-match')
+        cacheable = scope['method'] == 'GET'
+
+        start_message = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start_message, passthrough
+            if passthrough:
+                await send(message)
+                return
+            if message['type'] == 'http.response.start':
+                start_message = message
+                return
+            if message['type'] != 'http.response.body':
+                await send(message)
+                return
+            if message.get('more_body', False):
+                # Streaming response: leave it alone
+                passthrough = True
+                await send(start_message)
+                await send(message)
+                return
+            await self._send_complete(start_message, message.get('body', b''), encoding,
+                                      if_none_match, cacheable, send)
+
+        await self.app(scope, receive, send_wrapper)
+
+    async def _send_complete(self, start_message, body: bytes, encoding: Optional[str],
+                             if_none_match: Optional[str], cacheable: bool, send) -> None:
+        headers: List[Tuple[bytes, bytes]] = list(start_message.get('headers', []))
+        header_names = {k.lower() for k, _ in headers}
+        status_code = start_message['status']
+
+        body_hash = None
+        if cacheable and status_code == 200:
+            body_hash = hashlib.blake2b(body, digest_size=12).hexdigest()
+            existing = [v for k, v in headers if k.lower() == b'etag']
+            if existing:
+                etag = existing[0].decode('latin-1')
+            else:
+                etag = f'W/"{body_hash}"'
+                headers.append((b'etag', etag.encode('latin-1')))
+            if if_none_match and etag_matches(if_none_match, etag):
+                kept = [(k, v) for k, v in headers if k.lower() not in (b'content-length', b'content-type')]
+                await send({'type': 'http.response.start', 'status': 304, 'headers': kept})
+                await send({'type': 'http.response.body', 'body': b''})
+                return
+
+        content_type = next((v.decode('latin-1') for k, v in headers if k.lower() == b'content-type'), '')
+        if (encoding is None
+                or len(body) < self.minimum_size
+                or b'content-encoding' in header_names
+                or not content_type.startswith(COMPRESSIBLE_TYPES)):
+            await send({**start_message, 'headers': headers})
+            await send({'type': 'http.response.body', 'body': body})
+            return
+
+        encoded = self.encoded_cache.get((body_hash, encoding)) if body_hash else None
+        if encoded is None:
+            encoded = ENCODERS[encoding](body)
+            if body_hash:
+                self.encoded_cache.put((body_hash, encoding), encoded)
+
+        headers = [(k, v) for k, v in headers if k.lower() != b'content-length']
+        headers.append((b'content-encoding', encoding.encode('latin-1')))
+        headers.append((b'content-length', str(len(encoded)).encode('latin-1')))
+        headers.append((b'vary', b'Accept-Encoding'))
+        await send({**start_message, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': encoded})
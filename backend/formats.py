@@ -0,0 +1,103 @@
+"""Compact wire formats for shortcut lists.
+
+Clients that only need to expand text (the extension, the Android PWA) can ask
+for a columnar representation through the Accept header instead of a list of
+full JSON objects:
+
+- application/vnd.textgrow.columnar+json: columnar JSON
+- application/msgpack: the same structure as MessagePack (if msgpack is installed)
+
+Columnar layout:
+
+    {"count": 2,
+     "strings": ["@sig", "Best regards", ...],   # string table
+     "id": ["...", "..."],
+     "trigger": [0, 2],                          # indexes into strings
+     "content": [1, 3],
+     "updated_at": [1718000000000, ...],         # epoch milliseconds
+     "template": [null, [...]]}                  # compiled templates, when the rows have them
+
+Repeated triggers/content (common in imported and team libraries) are stored
+once in the string table.
+"""
+from datetime import datetime, timezone
+import json
+from typing import Any, Dict, Iterable, List, Optional
+
+from fastapi import Response
+
+try:
+    import msgpack
+except ImportError:  # optional
+    msgpack = None
+
+MEDIA_JSON = 'application/json'
+MEDIA_COLUMNAR = 'application/vnd.textgrow.columnar+json'
+MEDIA_MSGPACK = 'application/msgpack'
+_MSGPACK_ALIASES = (MEDIA_MSGPACK, 'application/x-msgpack', 'application/vnd.msgpack')
+
+COMPACT_FIELDS = ('id', 'trigger', 'content', 'updated_at')
+
+def epoch_ms(value: Any) -> int:
+    """Convert a Supabase timestamp (ISO string or datetime) to epoch milliseconds"""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp() * 1000)
+
+def negotiate(accept: Optional[str]) -> str:
+    """Pick the response media type for a shortcut list from an Accept header"""
+    if not accept:
+        return MEDIA_JSON
+    for part in accept.split(','):
+        media_type = part.split(';')[0].strip().lower()
+        if media_type == MEDIA_COLUMNAR:
+            return MEDIA_COLUMNAR
+        if media_type in _MSGPACK_ALIASES and msgpack is not None:
+            return MEDIA_MSGPACK
+    return MEDIA_JSON
+
+def to_columnar(rows: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """Build the columnar representation from shortcut rows"""
+    strings: List[str] = []
+    string_index: Dict[str, int] = {}
+
+    def intern(value: str) -> int:
+        index = string_index.get(value)
+        if index is None:
+            index = string_index[value] = len(strings)
+            strings.append(value)
+        return index
+
+    ids, triggers, contents, updated, templates = [], [], [], [], []
+    for row in rows:
+        ids.append(row['id'])
+        triggers.append(intern(row['trigger']))
+        contents.append(intern(row['content']))
+        updated.append(epoch_ms(row['updated_at']))
+        if 'template' in row:
+            templates.append(row['template'])
+
+    columns = {
+        'count': len(ids),
+        'strings': strings,
+        'id': ids,
+        'trigger': triggers,
+        'content': contents,
+        'updated_at': updated,
+    }
+    if templates:
+        columns['template'] = templates
+    return columns
+
+def compact_response(rows: Iterable[Dict[str, Any]], media_type: str, extra: Optional[Dict[str, Any]] = None) -> Response:
+    """Encode shortcut rows in a compact media type chosen by negotiate()"""
+    payload = to_columnar(rows)
+    if extra:
+        payload.update(extra)
+    if media_type == MEDIA_MSGPACK:
+        body = msgpack.packb(payload, use_bin_type=True)
+    else:
+        body = json.dumps(payload, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+    return Response(content=body, media_type=media_type, headers={'Vary': 'Accept'})
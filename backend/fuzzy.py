@@ -0,0 +1,160 @@
+"""Typo-tolerant trigger suggestions.
+
+FuzzyIndex is a SymSpell-style deletion dictionary over a user's trigger keys.
+Every string reachable by deleting up to MAX_DISTANCE characters from a
+trigger's first PREFIX_LENGTH characters maps back to that trigger. A lookup
+generates the same deletions of the query and checks only the triggers they
+hit against the true edit distance. Lookup cost therefore depends on the query
+length, not on the number of triggers. Indexing only a prefix keeps the
+dictionary to a few dozen entries per trigger.
+
+Indexes are kept per worker, tagged with the library version they reflect,
+and patched in place by a library change listener (like the trigger index).
+A version mismatch makes the next lookup rebuild the index.
+"""
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+import os
+import threading
+
+from library import LibraryChange, on_library_change
+from triggers import trigger_key
+
+MAX_DISTANCE = 2
+PREFIX_LENGTH = 7
+FUZZY_CACHE_MAX_USERS = int(os.environ.get('FUZZY_CACHE_MAX_USERS', '5000'))
+
+def _deletes(word: str, max_distance: int) -> Set[str]:
+    """`word` and every string made by deleting up to `max_distance` characters"""
+    found = {word}
+    frontier = {word}
+    for _ in range(max_distance):
+        frontier = {variant[:i] + variant[i + 1:] for variant in frontier for i in range(len(variant))}
+        found |= frontier
+    return found
+
+def edit_distance(a: str, b: str, max_distance: int) -> Optional[int]:
+    """Optimal string alignment distance (adjacent transpositions count once), or None if above `max_distance`"""
+    if abs(len(a) - len(b)) > max_distance:
+        return None
+    previous2: List[int] = []
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > max_distance:
+            return None
+        previous2, previous = previous, current
+    return previous[-1] if previous[-1] <= max_distance else None
+
+class FuzzyIndex:
+    __slots__ = ('max_distance', '_deletes', '_triggers')
+
+    def __init__(self, triggers: Iterable[Tuple[str, str]] = (), max_distance: int = MAX_DISTANCE):
+        self.max_distance = max_distance
+        # deletion variant -> trigger keys it was derived from
+        self._deletes: Dict[str, Set[str]] = {}
+        # trigger key -> (trigger, shortcut id) pairs using it
+        self._triggers: Dict[str, List[Tuple[str, str]]] = {}
+        for trigger, shortcut_id in triggers:
+            self.add(trigger, shortcut_id)
+
+    def add(self, trigger: str, shortcut_id: str) -> None:
+        key = trigger_key(trigger)
+        entries = self._triggers.setdefault(key, [])
+        if not entries:
+            for variant in _deletes(key[:PREFIX_LENGTH], self.max_distance):
+                self._deletes.setdefault(variant, set()).add(key)
+        entries.append((trigger, shortcut_id))
+
+    def remove(self, trigger: str, shortcut_id: str) -> None:
+        key = trigger_key(trigger)
+        entries = self._triggers.get(key)
+        if not entries:
+            return
+        entries[:] = [entry for entry in entries if entry[1] != shortcut_id]
+        if entries:
+            return
+        del self._triggers[key]
+        for variant in _deletes(key[:PREFIX_LENGTH], self.max_distance):
+            keys = self._deletes.get(variant)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._deletes[variant]
+
+    def suggest(self, query: str, limit: int = 5, max_distance: Optional[int] = None) -> List[Dict]:
+        """Triggers within `max_distance` edits of `query`, closest first"""
+        max_distance = self.max_distance if max_distance is None else min(max_distance, self.max_distance)
+        key = trigger_key(query)
+        candidates: Set[str] = set()
+        for variant in _deletes(key[:PREFIX_LENGTH], max_distance):
+            candidates |= self._deletes.get(variant, set())
+
+        scored = []
+        for candidate in candidates:
+            distance = edit_distance(key, candidate, max_distance)
+            if distance is not None:
+                scored.append((distance, abs(len(candidate) - len(key)), candidate))
+        scored.sort()
+
+        suggestions = []
+        for distance, _, candidate in scored:
+            for trigger, shortcut_id in self._triggers[candidate]:
+                suggestions.append({'trigger': trigger, 'shortcut_id': shortcut_id, 'distance': distance})
+            if len(suggestions) >= limit:
+                break
+        return suggestions[:limit]
+
+    def __len__(self) -> int:
+        return len(self._triggers)
+
+class FuzzyIndexCache:
+    """Per-worker LRU of fuzzy indexes keyed by user, tagged with library versions"""
+
+    def __init__(self, max_users: int = FUZZY_CACHE_MAX_USERS):
+        self._max_users = max_users
+        self._entries: "OrderedDict[str, Tuple[str, FuzzyIndex]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: str, version: str) -> Optional[FuzzyIndex]:
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[0] != version:
+                return None
+            self._entries.move_to_end(user_id)
+            return entry[1]
+
+    def put(self, user_id: str, version: str, index: FuzzyIndex) -> None:
+        with self._lock:
+            self._entries[user_id] = (version, index)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self._max_users:
+                self._entries.popitem(last=False)
+
+    def apply(self, user_id: str, previous: Optional[str], version: str, changes: List[LibraryChange]) -> None:
+        """Patch the user's index for `changes`, or drop it if it is not at `previous`"""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return
+            if not changes or entry[0] != previous:
+                del self._entries[user_id]
+                return
+            index = entry[1]
+            for change in changes:
+                if change.old is not None:
+                    index.remove(change.old['trigger'], change.shortcut_id)
+                if change.new is not None:
+                    index.add(change.new['trigger'], change.shortcut_id)
+            self._entries[user_id] = (version, index)
+
+fuzzy_indexes = FuzzyIndexCache()
+
+@on_library_change
+def _update_fuzzy_index(user_id: str, previous: Optional[str], version: str, changes: List[LibraryChange]) -> None:
+    fuzzy_indexes.apply(user_id, previous, version, changes)
@@ -0,0 +1,92 @@
+"""Idempotency-Key support for endpoints that create data.
+
+Clients retry creates and imports after timeouts. When such a request carries
+an `Idempotency-Key` header, the first successful response is kept in the
+cache tier for IDEMPOTENCY_TTL seconds, keyed by user, endpoint and key. A
+retry with the same key and body gets that response back without running the
+handler again.
+
+Requests with the same key are serialized. Within a worker they queue on an
+asyncio lock. Across workers, a short-lived pending marker in the shared cache
+makes a duplicate wait for the first request's outcome. Failed requests are
+not recorded, so the client may retry them with the same key.
+"""
+from typing import Any, Awaitable, Callable, Optional
+from weakref import WeakValueDictionary
+import os
+import json
+import time
+import asyncio
+import hashlib
+import secrets
+
+from fastapi import HTTPException, Response, status
+from fastapi.encoders import jsonable_encoder
+
+from cache import get_cache
+
+IDEMPOTENCY_TTL = float(os.environ.get('IDEMPOTENCY_TTL_SECONDS', str(24 * 3600)))
+# How long a duplicate waits for the original request before giving up with a 409
+IDEMPOTENCY_WAIT = float(os.environ.get('IDEMPOTENCY_WAIT_SECONDS', '30'))
+# Pending markers expire so a worker that died mid-request does not block the key
+PENDING_TTL = IDEMPOTENCY_WAIT * 2
+MAX_KEY_LENGTH = 255
+REPLAY_HEADER = 'Idempotent-Replayed'
+
+_PENDING = 'pending'
+_DONE = 'done'
+
+_locks: "WeakValueDictionary[str, asyncio.Lock]" = WeakValueDictionary()
+
+def request_fingerprint(*parts: Any) -> str:
+    """Stable hash of the request body and parameters"""
+    encoded = json.dumps(jsonable_encoder(parts), sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+def _mismatch() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        detail="Idempotency-Key was already used with a different request"
+    )
+
+async def run_idempotent(user_id: str, endpoint: str, key: Optional[str], fingerprint: str,
+                         response: Response, handler: Callable[[], Awaitable[Any]]) -> Any:
+    """Run `handler` once per (user, endpoint, key); replay its result for retries"""
+    if key is None:
+        return await handler()
+    if not key or len(key) > MAX_KEY_LENGTH:
+        raise HTTPException(status_code=400, detail=f"Idempotency-Key must be 1-{MAX_KEY_LENGTH} characters")
+
+    cache = get_cache()
+    cache_key = f'idempotency:{user_id}:{endpoint}:{key}'
+    lock = _locks.get(cache_key)
+    if lock is None:
+        lock = _locks[cache_key] = asyncio.Lock()
+
+    async with lock:
+        owner = secrets.token_hex(8)
+        deadline = time.monotonic() + IDEMPOTENCY_WAIT
+        while True:
+            entry = cache.setdefault(cache_key, (_PENDING, fingerprint, owner), PENDING_TTL)
+            if entry[1] != fingerprint:
+                raise _mismatch()
+            if entry[0] == _DONE:
+                response.headers[REPLAY_HEADER] = 'true'
+                return entry[2]
+            if entry[2] == owner:
+                break
+            # Another worker is running the original request
+            if time.monotonic() >= deadline:
+                raise HTTPException(
+                    status_code=status.HTTP_409_CONFLICT,
+                    detail="A request with this Idempotency-Key is still in progress"
+                )
+            await asyncio.sleep(0.05)
+
+        try:
+            result = jsonable_encoder(await handler())
+        except BaseException:
+            cache.delete(cache_key)
+            raise
+        cache.set(cache_key, (_DONE, fingerprint, result), IDEMPOTENCY_TTL)
+        return result
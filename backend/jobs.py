@@ -0,0 +1,319 @@
+"""Persistent background jobs for long-running imports and exports.
+
+Jobs are stored in a local SQLite database, so they survive restarts and are
+shared by every worker process on the host. Each process runs a small, fixed
+pool of runners that claim queued jobs under an expiring lease and renew it
+while the job runs; if a process dies, its jobs are claimed again once the
+lease lapses.
+
+Handlers run in a worker thread and report progress through JobContext. A
+progress checkpoint can also save whatever state the handler needs to resume,
+so a reclaimed job continues from its last checkpoint instead of starting
+over. Checkpoints are fenced by the claim token: a runner that lost its lease
+gets JobLost instead of overwriting the new owner's progress.
+"""
+from contextlib import closing
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+import os
+import json
+import time
+import uuid
+import sqlite3
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+JOBS_DB_PATH = os.environ.get('TEXTGROW_JOBS_DB', str(Path(__file__).parent / 'jobs.sqlite3'))
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '2'))
+JOB_LEASE_SECONDS = float(os.environ.get('JOB_LEASE_SECONDS', '60'))
+JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', '2'))
+# A job whose runner keeps dying (not one whose handler raised) is given up after this many claims
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', '3'))
+# Finished jobs and their results are kept this long for clients to poll
+JOB_RETENTION_SECONDS = float(os.environ.get('JOB_RETENTION_SECONDS', str(24 * 3600)))
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    state TEXT,
+    result TEXT,
+    error TEXT,
+    done INTEGER NOT NULL DEFAULT 0,
+    total INTEGER,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    claim TEXT,
+    lease_expires REAL,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    finished_at TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_status_idx ON jobs (status, created_at);
+CREATE INDEX IF NOT EXISTS jobs_user_idx ON jobs (user_id, status);
+"""
+
+_UNSET = object()
+
+class JobLost(Exception):
+    """The job's lease expired and another runner claimed it"""
+
+def _now() -> str:
+    return datetime.utcnow().isoformat()
+
+def _decode(row: Optional[sqlite3.Row]) -> Optional[Dict[str, Any]]:
+    if row is None:
+        return None
+    job = dict(row)
+    for column in ('payload', 'state', 'result'):
+        if job[column] is not None:
+            job[column] = json.loads(job[column])
+    return job
+
+class JobStore:
+    """SQLite-backed job table; every method is blocking and opens its own connection"""
+
+    def __init__(self, path: str = JOBS_DB_PATH):
+        self.path = path
+        self._ready = False
+
+    def _connect(self) -> sqlite3.Connection:
+        # Autocommit: every statement below is atomic on its own
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        if not self._ready:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(_SCHEMA)
+            self._ready = True
+        return conn
+
+    def create(self, user_id: str, kind: str, payload: Any) -> Dict[str, Any]:
+        job_id = str(uuid.uuid4())
+        now = _now()
+        with closing(self._connect()) as conn:
+            conn.execute(
+                'INSERT INTO jobs (id, user_id, kind, status, payload, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (job_id, user_id, kind, QUEUED, json.dumps(payload), now, now)
+            )
+            return _decode(conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone())
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with closing(self._connect()) as conn:
+            return _decode(conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone())
+
+    def active_count(self, user_id: str) -> int:
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                'SELECT count(*) FROM jobs WHERE user_id = ? AND status IN (?, ?)',
+                (user_id, QUEUED, RUNNING)
+            ).fetchone()
+            return row[0]
+
+    def claim(self, lease_seconds: float, max_attempts: int = JOB_MAX_ATTEMPTS) -> Optional[Dict[str, Any]]:
+        """Take the oldest queued (or abandoned) job, or None if there is none"""
+        now = time.time()
+        claim = uuid.uuid4().hex
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = 'Job was interrupted too many times', claim = NULL, "
+                "finished_at = ?, updated_at = ? WHERE status = ? AND lease_expires < ? AND attempts >= ?",
+                (FAILED, _now(), _now(), RUNNING, now, max_attempts)
+            )
+            conn.execute(
+                'UPDATE jobs SET status = ?, claim = ?, lease_expires = ?, attempts = attempts + 1, updated_at = ? '
+                'WHERE id = (SELECT id FROM jobs WHERE status = ? OR (status = ? AND lease_expires < ?) '
+                'ORDER BY created_at LIMIT 1)',
+                (RUNNING, claim, now + lease_seconds, _now(), QUEUED, RUNNING, now)
+            )
+            return _decode(conn.execute('SELECT * FROM jobs WHERE claim = ?', (claim,)).fetchone())
+
+    def renew(self, job_id: str, claim: str, lease_seconds: float) -> bool:
+        with closing(self._connect()) as conn:
+            cursor = conn.execute(
+                'UPDATE jobs SET lease_expires = ? WHERE id = ? AND claim = ?',
+                (time.time() + lease_seconds, job_id, claim)
+            )
+            return cursor.rowcount == 1
+
+    def checkpoint(self, job_id: str, claim: str, lease_seconds: float, done: int,
+                   total: Optional[int] = None, state: Any = _UNSET) -> bool:
+        """Record progress (and optionally resume state); also renews the lease"""
+        assignments = 'done = ?, total = coalesce(?, total), lease_expires = ?, updated_at = ?'
+        params: List[Any] = [done, total, time.time() + lease_seconds, _now()]
+        if state is not _UNSET:
+            assignments += ', state = ?'
+            params.append(json.dumps(state))
+        with closing(self._connect()) as conn:
+            cursor = conn.execute(
+                f'UPDATE jobs SET {assignments} WHERE id = ? AND claim = ?',
+                (*params, job_id, claim)
+            )
+            return cursor.rowcount == 1
+
+    def finish(self, job_id: str, claim: str, result: Any = None, error: Optional[str] = None) -> bool:
+        now = _now()
+        with closing(self._connect()) as conn:
+            cursor = conn.execute(
+                'UPDATE jobs SET status = ?, result = ?, error = ?, state = NULL, claim = NULL, '
+                'lease_expires = NULL, finished_at = ?, updated_at = ? WHERE id = ? AND claim = ?',
+                (FAILED if error else SUCCEEDED, None if error else json.dumps(result), error, now, now, job_id, claim)
+            )
+            return cursor.rowcount == 1
+
+    def release(self, job_id: str, claim: str) -> bool:
+        """Hand a running job back to the queue without counting the attempt (graceful shutdown)"""
+        with closing(self._connect()) as conn:
+            cursor = conn.execute(
+                'UPDATE jobs SET status = ?, claim = NULL, lease_expires = NULL, attempts = attempts - 1, '
+                'updated_at = ? WHERE id = ? AND claim = ?',
+                (QUEUED, _now(), job_id, claim)
+            )
+            return cursor.rowcount == 1
+
+    def purge(self, older_than: datetime) -> int:
+        """Delete finished jobs that finished before `older_than`"""
+        with closing(self._connect()) as conn:
+            cursor = conn.execute(
+                'DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?',
+                (SUCCEEDED, FAILED, older_than.isoformat())
+            )
+            return cursor.rowcount
+
+class JobContext:
+    """What a handler sees of its job"""
+
+    def __init__(self, store: JobStore, job: Dict[str, Any], lease_seconds: float):
+        self._store = store
+        self._claim = job['claim']
+        self._lease_seconds = lease_seconds
+        self.id: str = job['id']
+        self.user_id: str = job['user_id']
+        self.payload: Any = job['payload']
+        # Saved by an earlier run of this job; None on the first run
+        self.state: Any = job['state']
+        self.done: int = job['done']
+        self.total: Optional[int] = job['total']
+
+    def progress(self, done: int, total: Optional[int] = None, state: Any = _UNSET) -> None:
+        """Checkpoint progress; raises JobLost if the job now belongs to another runner"""
+        if not self._store.checkpoint(self.id, self._claim, self._lease_seconds, done, total, state):
+            raise JobLost(self.id)
+        self.done = done
+        if total is not None:
+            self.total = total
+        if state is not _UNSET:
+            self.state = state
+
+Handler = Callable[[JobContext], Any]
+
+class JobQueue:
+    def __init__(self, store: Optional[JobStore] = None,
+                 workers: int = JOB_WORKERS,
+                 lease_seconds: float = JOB_LEASE_SECONDS,
+                 poll_interval: float = JOB_POLL_INTERVAL):
+        self.store = store or JobStore()
+        self._workers = workers
+        self._lease_seconds = lease_seconds
+        self._poll_interval = poll_interval
+        self._handlers: Dict[str, Handler] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup = asyncio.Event()
+        self._last_purge = 0.0
+
+    def handler(self, kind: str) -> Callable[[Handler], Handler]:
+        """Register the function that runs jobs of `kind`; usable as a decorator"""
+        def register(func: Handler) -> Handler:
+            self._handlers[kind] = func
+            return func
+        return register
+
+    async def submit(self, user_id: str, kind: str, payload: Any) -> Dict[str, Any]:
+        if kind not in self._handlers:
+            raise ValueError(f"Unknown job kind '{kind}'")
+        job = await asyncio.to_thread(self.store.create, user_id, kind, payload)
+        self._wakeup.set()
+        return job
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self.store.get, job_id)
+
+    async def active_count(self, user_id: str) -> int:
+        return await asyncio.to_thread(self.store.active_count, user_id)
+
+    async def _purge(self) -> None:
+        if time.monotonic() - self._last_purge < 600:
+            return
+        self._last_purge = time.monotonic()
+        try:
+            cutoff = datetime.utcnow() - timedelta(seconds=JOB_RETENTION_SECONDS)
+            await asyncio.to_thread(self.store.purge, cutoff)
+        except Exception as e:
+            logger.warning(f"Purging finished jobs failed: {e}")
+
+    async def _run(self, job: Dict[str, Any]) -> None:
+        handler = self._handlers.get(job['kind'])
+        if handler is None:
+            await asyncio.to_thread(self.store.finish, job['id'], job['claim'], error=f"Unknown job kind '{job['kind']}'")
+            return
+
+        context = JobContext(self.store, job, self._lease_seconds)
+        task = asyncio.ensure_future(asyncio.to_thread(handler, context))
+        try:
+            # Keep the lease alive between the handler's own checkpoints
+            while not task.done():
+                await asyncio.wait({task}, timeout=self._lease_seconds / 3)
+                if not task.done() and not await asyncio.to_thread(self.store.renew, job['id'], job['claim'], self._lease_seconds):
+                    logger.warning(f"Lost the lease on job {job['id']}")
+                    return
+            result = task.result()
+        except JobLost:
+            logger.warning(f"Lost the lease on job {job['id']}")
+            return
+        except asyncio.CancelledError:
+            # Shutting down: queue the job again so the next start resumes it.
+            # The handler thread stops at its next checkpoint.
+            await asyncio.to_thread(self.store.release, job['id'], job['claim'])
+            raise
+        except Exception as e:
+            logger.warning(f"Job {job['id']} ({job['kind']}) failed: {e}")
+            await asyncio.to_thread(self.store.finish, job['id'], job['claim'], error=str(e))
+            return
+        await asyncio.to_thread(self.store.finish, job['id'], job['claim'], result)
+
+    async def _worker(self) -> None:
+        while True:
+            try:
+                job = await asyncio.to_thread(self.store.claim, self._lease_seconds)
+            except Exception as e:
+                logger.warning(f"Claiming a job failed: {e}")
+                job = None
+            if job is not None:
+                await self._run(job)
+                continue
+
+            await self._purge()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self._poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def start(self) -> None:
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self._workers)]
+
+    async def stop(self) -> None:
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
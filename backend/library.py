@@ -0,0 +1,54 @@
+"""Per-user shortcut library versions and change notifications.
+
+Every write to a user's shortcuts calls library_changed(). That replaces the
+user's library version in the cache tier (shared between workers when the
+shared cache is enabled) with a fresh random token and notifies listeners that
+keep derived structures up to date. Derived structures are stored together
+with the version they were built from, so a worker that missed a change (or a
+cache that evicted the version) rebuilds instead of serving stale data.
+"""
+from typing import Callable, List, NamedTuple, Optional
+import secrets
+import logging
+
+from cache import get_cache
+
+logger = logging.getLogger(__name__)
+
+class LibraryChange(NamedTuple):
+    """One shortcut write; `old`/`new` are the row before/after (None for create/delete)"""
+    shortcut_id: str
+    old: Optional[dict]
+    new: Optional[dict]
+
+# listener(user_id, previous_version, new_version, changes)
+Listener = Callable[[str, Optional[str], str, List[LibraryChange]], None]
+
+_listeners: List[Listener] = []
+
+def _version_key(user_id: str) -> str:
+    return f'library:{user_id}:version'
+
+def on_library_change(listener: Listener) -> Listener:
+    """Register a listener; usable as a decorator"""
+    _listeners.append(listener)
+    return listener
+
+def library_version(user_id: str) -> str:
+    """The user's current library version, creating one if none is cached"""
+    return get_cache().setdefault(_version_key(user_id), secrets.token_hex(8))
+
+def library_changed(user_id: str, changes: Optional[List[LibraryChange]] = None) -> str:
+    """Record that the user's shortcuts changed and return the new version.
+
+    `changes` may be omitted for bulk writes; listeners then rebuild rather
+    than patch their structures.
+    """
+    version = secrets.token_hex(8)
+    previous = get_cache().getset(_version_key(user_id), version)
+    for listener in _listeners:
+        try:
+            listener(user_id, previous, version, changes or [])
+        except Exception as e:
+            logger.warning(f"Library change listener {listener.__name__} failed: {e}")
+    return version
@@ -0,0 +1,189 @@
+"""Non-blocking structured logging.
+
+Handlers never write on the calling thread. `setup_logging()` puts one
+QueueHandler on the root logger; a QueueListener thread formats the records
+as JSON lines and writes them to stderr. When the queue is full, records are
+dropped and counted rather than blocking the event loop.
+
+On the calling thread, before a record is queued:
+
+- the current request id (see RequestIdMiddleware) is attached to it;
+- noisy loggers are sampled. LOG_SAMPLING lists `logger=rate` pairs, e.g.
+  `server.auth=0.01` keeps 1% of auth failures. Sampling applies at WARNING
+  and below. Kept records carry `sample_rate` so counts can be scaled back up;
+- every record, kept or not, is counted per logger and level (`log_rates()`).
+"""
+from collections import Counter, deque
+from contextvars import ContextVar
+from typing import Any, Dict, Optional
+import os
+import sys
+import json
+import time
+import uuid
+import queue
+import atexit
+import random
+import logging
+import threading
+import logging.handlers
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+# json, or text for local development
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', '10000'))
+LOG_SAMPLING = os.environ.get('LOG_SAMPLING', 'server.auth=0.01')
+LOG_RATE_WINDOW = 60
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+
+request_id: ContextVar[Optional[str]] = ContextVar('request_id', default=None)
+
+# Attributes every LogRecord has; anything else came from `extra=`
+_RECORD_FIELDS = frozenset(logging.makeLogRecord({}).__dict__) | {'message', 'asctime', 'request_id', 'sample_rate'}
+
+def parse_sampling(spec: str) -> Dict[str, float]:
+    rates = {}
+    for part in spec.split(','):
+        name, _, rate = part.strip().partition('=')
+        if name and rate:
+            rates[name] = min(1.0, max(0.0, float(rate)))
+    return rates
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if getattr(record, 'request_id', None):
+            entry['request_id'] = record.request_id
+        if getattr(record, 'sample_rate', None) is not None:
+            entry['sample_rate'] = record.sample_rate
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_FIELDS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+class LogRates:
+    """Records seen per logger and level: totals, and over the last LOG_RATE_WINDOW seconds"""
+
+    def __init__(self, window: int = LOG_RATE_WINDOW):
+        self._window = window
+        self._totals: Counter = Counter()
+        self._buckets: deque = deque()
+        self._lock = threading.Lock()
+
+    def record(self, key: str) -> None:
+        second = int(time.monotonic())
+        with self._lock:
+            self._totals[key] += 1
+            if not self._buckets or self._buckets[-1][0] != second:
+                self._buckets.append((second, Counter()))
+                while self._buckets[0][0] <= second - self._window:
+                    self._buckets.popleft()
+            self._buckets[-1][1][key] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        cutoff = int(time.monotonic()) - self._window
+        recent: Counter = Counter()
+        with self._lock:
+            for second, counts in self._buckets:
+                if second > cutoff:
+                    recent.update(counts)
+            totals = dict(self._totals)
+        return {'total': totals, f'last_{self._window}s': dict(recent)}
+
+log_rates = LogRates()
+
+class _ContextFilter(logging.Filter):
+    """Count, sample and tag records on the calling thread"""
+
+    def __init__(self, sampling: Dict[str, float]):
+        super().__init__()
+        self._sampling = sampling
+
+    def _rate(self, name: str) -> float:
+        # The most specific configured logger wins, as with logger levels
+        while name:
+            if name in self._sampling:
+                return self._sampling[name]
+            name = name.rpartition('.')[0]
+        return 1.0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        log_rates.record(f'{record.name}:{record.levelname}')
+        if record.levelno <= logging.WARNING:
+            rate = self._rate(record.name)
+            if rate < 1.0:
+                if random.random() >= rate:
+                    log_rates.record(f'{record.name}:{record.levelname}:sampled_out')
+                    return False
+                record.sample_rate = rate
+        record.request_id = request_id.get()
+        return True
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            log_rates.record('logging:dropped')
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+def setup_logging() -> None:
+    """Route every logger through the queue; safe to call more than once"""
+    global _listener
+    if _listener is not None:
+        return
+
+    output = logging.StreamHandler(sys.stderr)
+    if LOG_FORMAT == 'text':
+        output.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s'))
+    else:
+        output.setFormatter(JsonFormatter())
+
+    handler = _DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    handler.addFilter(_ContextFilter(parse_sampling(LOG_SAMPLING)))
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL)
+
+    _listener = logging.handlers.QueueListener(handler.queue, output, respect_handler_level=True)
+    _listener.start()
+    # Flush what is queued on interpreter exit
+    atexit.register(_listener.stop)
+
+class RequestIdMiddleware:
+    """Give each request an id (the client's X-Request-ID if it sent a sane one) for its log records"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        incoming = dict(scope.get('headers', [])).get(REQUEST_ID_HEADER.lower().encode('latin-1'), b'').decode('latin-1')
+        current = incoming if 0 < len(incoming) <= 64 and incoming.isprintable() else uuid.uuid4().hex
+        token = request_id.set(current)
+
+        async def send_with_id(message):
+            if message['type'] == 'http.response.start':
+                headers = list(message.get('headers', []))
+                headers.append((REQUEST_ID_HEADER.lower().encode('latin-1'), current.encode('latin-1')))
+                message = {**message, 'headers': headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            request_id.reset(token)
@@ -0,0 +1,249 @@
+"""Bulk onboarding of users and their starter shortcuts.
+
+An upload is either CSV (`text/csv`) with a header row and the columns
+`email`, `name`, `avatar_url`, `trigger` and `content` (only `email` is
+required), or NDJSON (`application/x-ndjson`) with one user per line:
+
+    {"email": "ann@example.com", "name": "Ann", "shortcuts": [{"trigger": "@sig", "content": "Ann"}]}
+
+Consecutive records with the same email are one user, so a CSV gives a user
+several starter shortcuts with one row each.
+
+The body is parsed as it arrives: chunks are decoded and split into lines
+incrementally and users are written in batches of ONBOARD_BATCH_SIZE, so
+memory is bounded by a batch rather than the upload. Per batch, existing
+users are found with one `email_key IN (...)` lookup (emails compare
+case-insensitively). The rest get a Supabase Auth account first, so their
+rows carry the id they sign in with, then users and shortcuts are written
+with chunked upserts. Emails that already have a user or an auth account are
+skipped, as are later repeats within the upload. Bad records are skipped and
+reported by line number instead of failing the upload.
+"""
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+import csv
+import json
+import uuid
+import codecs
+
+from templates import compile_or_plain
+from triggers import trigger_key
+
+ONBOARD_BATCH_SIZE = 200
+MAX_LINE_LENGTH = 1 << 20
+MAX_REPORTED_ERRORS = 100
+
+CSV = 'csv'
+NDJSON = 'ndjson'
+UPLOAD_FORMATS = {
+    'text/csv': CSV,
+    'application/x-ndjson': NDJSON,
+    'application/jsonl': NDJSON,
+}
+
+def upload_format(content_type: Optional[str]) -> Optional[str]:
+    """CSV or NDJSON from a Content-Type header, or None if it is neither"""
+    return UPLOAD_FORMATS.get((content_type or '').partition(';')[0].strip().lower())
+
+class OnboardReport:
+    """Counts and rejected records of one upload, updated as batches are written"""
+
+    def __init__(self):
+        self.records = 0
+        self.created = 0
+        self.existing = 0
+        self.shortcuts = 0
+        self.rejected = 0
+        self.errors: List[Dict[str, Any]] = []
+
+    def reject(self, line: int, message: str) -> None:
+        self.rejected += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'error': message})
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            'records': self.records,
+            'created_count': self.created,
+            'existing_count': self.existing,
+            'shortcut_count': self.shortcuts,
+            'rejected_count': self.rejected,
+            'errors': list(self.errors)
+        }
+
+def iter_lines(chunks: Iterable[bytes], max_length: int = MAX_LINE_LENGTH) -> Iterator[str]:
+    """Lines (with their newline) of a UTF-8 byte stream, decoded one chunk at a time"""
+    # utf-8-sig drops the byte order mark spreadsheet exports often start with
+    decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    pending = ''
+    for chunk in chunks:
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split('\n')
+        for line in lines:
+            yield line + '\n'
+        if len(pending) > max_length:
+            raise ValueError(f"Line longer than {max_length} characters")
+    pending += decoder.decode(b'', final=True)
+    if pending:
+        yield pending
+
+def _text(value: Any) -> Optional[str]:
+    if value is None:
+        return None
+    if not isinstance(value, str):
+        raise ValueError("expected a string")
+    return value.strip() or None
+
+def _user_record(record: Any) -> Dict[str, Any]:
+    if not isinstance(record, dict):
+        raise ValueError("expected an object")
+    email = _text(record.get('email'))
+    if not email or '@' not in email:
+        raise ValueError("missing or invalid email")
+    shortcuts = record.get('shortcuts') or []
+    if not isinstance(shortcuts, list) or not all(
+        isinstance(shortcut, dict) and isinstance(shortcut.get('trigger'), str) and isinstance(shortcut.get('content'), str)
+        for shortcut in shortcuts
+    ):
+        raise ValueError("shortcuts must be a list of {trigger, content} objects")
+    return {
+        'email': email,
+        'name': _text(record.get('name')),
+        'avatar_url': _text(record.get('avatar_url')),
+        'shortcuts': [{'trigger': shortcut['trigger'], 'content': shortcut['content']} for shortcut in shortcuts]
+    }
+
+def _csv_records(lines: Iterator[str]) -> Iterator[Tuple[int, Any]]:
+    reader = csv.DictReader(lines)
+    if reader.fieldnames is None:
+        return
+    reader.fieldnames = [field.strip().lower() for field in reader.fieldnames]
+    if 'email' not in reader.fieldnames:
+        raise ValueError("The CSV header has no email column")
+    for row in reader:
+        trigger = row.get('trigger')
+        row['shortcuts'] = [{'trigger': trigger, 'content': row.get('content') or ''}] if trigger else []
+        yield reader.line_num, row
+
+def _ndjson_records(lines: Iterator[str]) -> Iterator[Tuple[int, Any]]:
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            yield number, json.loads(line)
+        except ValueError:
+            yield number, None
+
+def read_users(chunks: Iterable[bytes], upload: str, report: OnboardReport) -> Iterator[Dict[str, Any]]:
+    """Users of an upload, consecutive records with the same email merged; bad records go to `report`"""
+    records = (_csv_records if upload == CSV else _ndjson_records)(iter_lines(chunks))
+    current: Optional[Dict[str, Any]] = None
+    for line, record in records:
+        report.records += 1
+        try:
+            user = _user_record(record)
+        except ValueError as e:
+            report.reject(line, "Invalid JSON" if record is None else str(e).capitalize())
+            continue
+        if current is not None and current['email'].lower() == user['email'].lower():
+            current['shortcuts'].extend(user['shortcuts'])
+            continue
+        if current is not None:
+            yield current
+        current = {**user, 'line': line}
+    if current is not None:
+        yield current
+
+def plan_batch(users: List[Dict[str, Any]], existing: Set[str], report: OnboardReport,
+               max_shortcuts: int) -> Tuple[List[Dict[str, Any]], Dict[str, List[Dict[str, Any]]]]:
+    """User rows to create and their shortcut rows, by lowercased email; `existing` holds lowercased emails
+    
+    Neither has a user id yet: it comes from the user's auth account.
+    """
+    now = datetime.utcnow().isoformat()
+    users_rows = []
+    shortcut_rows: Dict[str, List[Dict[str, Any]]] = {}
+    for user in users:
+        email_key = user['email'].lower()
+        if email_key in existing:
+            report.existing += 1
+            continue
+        existing.add(email_key)
+        users_rows.append({
+            'email': user['email'],
+            'name': user['name'],
+            'avatar_url': user['avatar_url'],
+            'preferences': {},
+            'created_at': now,
+            'updated_at': now
+        })
+
+        rows = shortcut_rows[email_key] = []
+        triggers: Set[str] = set()
+        for shortcut in user['shortcuts']:
+            trigger = shortcut['trigger'].strip()
+            if not trigger or trigger_key(trigger) in triggers:
+                report.reject(user['line'], f"Shortcut '{trigger}' for {user['email']} is empty or repeated")
+                continue
+            if len(rows) >= max_shortcuts:
+                report.reject(user['line'], f"{user['email']} has more than {max_shortcuts} shortcuts")
+                break
+            triggers.add(trigger_key(trigger))
+            rows.append({
+                'id': str(uuid.uuid4()),
+                'trigger': trigger,
+                'content': shortcut['content'],
+                'template': compile_or_plain(shortcut['content']),
+                'created_at': now,
+                'updated_at': now
+            })
+    return users_rows, shortcut_rows
+
+def _batches(users: Iterator[Dict[str, Any]], size: int) -> Iterator[List[Dict[str, Any]]]:
+    batch = []
+    for user in users:
+        batch.append(user)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def onboard(
+    chunks: Iterable[bytes],
+    upload: str,
+    find_existing: Callable[[List[str]], Set[str]],
+    create_accounts: Callable[[List[Dict[str, Any]]], Dict[str, str]],
+    insert_users: Callable[[List[Dict[str, Any]]], Set[str]],
+    upsert_shortcuts: Callable[[List[Dict[str, Any]]], None],
+    max_shortcuts: int,
+    chunk_size: int,
+    progress: Callable[[OnboardReport], None] = lambda report: None,
+    batch_size: int = ONBOARD_BATCH_SIZE
+) -> OnboardReport:
+    """Create the users of an upload and their starter shortcuts, batch by batch
+
+    `find_existing(emails)` returns those of the (lowercased) emails that
+    already have a user. `create_accounts(rows)` creates auth accounts and
+    returns {lowercased email: account id}, leaving out emails that already
+    had one. `insert_users(rows)` returns the ids it actually inserted (a
+    concurrent first login may win an email). `progress` is called after each
+    batch.
+    """
+    report = OnboardReport()
+    for batch in _batches(read_users(chunks, upload, report), batch_size):
+        emails = sorted({user['email'].lower() for user in batch})
+        users_rows, shortcut_rows = plan_batch(batch, find_existing(emails), report, max_shortcuts)
+        if users_rows:
+            account_ids = create_accounts(users_rows)
+            new_rows = [{**row, 'id': account_ids[row['email'].lower()]} for row in users_rows if row['email'].lower() in account_ids]
+            email_of = {row['id']: row['email'].lower() for row in new_rows}
+            inserted = insert_users(new_rows) if new_rows else set()
+            report.created += len(inserted)
+            report.existing += len(users_rows) - len(inserted)
+            rows = [{**row, 'user_id': user_id} for user_id in inserted for row in shortcut_rows.get(email_of[user_id], [])]
+            for start in range(0, len(rows), chunk_size):
+                upsert_shortcuts(rows[start:start + chunk_size])
+                report.shortcuts += len(rows[start:start + chunk_size])
+        progress(report)
+    return report
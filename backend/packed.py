@@ -0,0 +1,191 @@
+"""Compact in-process representation of a user's shortcut library.
+
+A library held as PostgREST row dicts costs several kilobytes per shortcut:
+a dict per row, a str object per field and two ISO timestamp strings. That is
+gigabytes per worker across tens of thousands of active users. PackedLibrary
+keeps the same data in a handful of flat objects instead:
+
+- ids: one bytes object of 16-byte UUIDs
+- triggers: a tuple of interned strings (common triggers like `@sig` are
+  stored once per process)
+- created/updated: array('q') of epoch microseconds
+- content: one UTF-8 arena with an array of offsets, decoded on access
+- templates: the stored compiled templates (see templates.py) by index, only
+  for the rows that have one; plain-text content has none
+
+Rows are rebuilt lazily, one at a time, in the same shape PostgREST returns,
+so callers convert them to API models exactly as before.
+
+LibraryCache keeps packed libraries per worker, tagged with the library
+version they were built from (see library.py), and bounded by total size.
+"""
+from array import array
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+import os
+import sys
+import uuid
+import threading
+
+from formats import COMPACT_FIELDS
+
+LIBRARY_CACHE_MAX_BYTES = int(os.environ.get('LIBRARY_CACHE_MAX_BYTES', str(128 * 1024 * 1024)))
+
+ROW_FIELDS = ('id', 'user_id', 'trigger', 'content', 'created_at', 'updated_at')
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+def _epoch_us(value: str) -> int:
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    delta = parsed - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+def _iso(epoch_us: int) -> str:
+    return (_EPOCH + timedelta(microseconds=epoch_us)).isoformat()
+
+def _pack_ids(ids: Sequence[str]) -> Union[bytes, Tuple[str, ...]]:
+    try:
+        return b''.join(uuid.UUID(shortcut_id).bytes for shortcut_id in ids)
+    except ValueError:
+        return tuple(ids)
+
+def _nested_size(value: Any) -> int:
+    if isinstance(value, list):
+        return sys.getsizeof(value) + sum(_nested_size(item) for item in value)
+    return sys.getsizeof(value)
+
+class PackedLibrary:
+    __slots__ = ('user_id', '_ids', 'triggers', 'created', 'updated', '_offsets', '_arena', '_templates')
+
+    def __init__(self, user_id: str, rows: Iterable[Dict[str, Any]]):
+        rows = list(rows)
+        self.user_id = user_id
+        self._ids = _pack_ids([row['id'] for row in rows])
+        self.triggers: Tuple[str, ...] = tuple(sys.intern(row['trigger']) for row in rows)
+        # Rows from the compact sync query have no created_at
+        self.created = array('q', (_epoch_us(row.get('created_at') or row['updated_at']) for row in rows))
+        self.updated = array('q', (_epoch_us(row['updated_at']) for row in rows))
+
+        encoded = [row['content'].encode('utf-8') for row in rows]
+        self._offsets = array('Q', [0])
+        for content in encoded:
+            self._offsets.append(self._offsets[-1] + len(content))
+        self._arena = b''.join(encoded)
+        self._templates: Dict[int, List[Any]] = {
+            index: row['template'] for index, row in enumerate(rows) if row.get('template') is not None
+        }
+
+    def __len__(self) -> int:
+        return len(self.triggers)
+
+    def shortcut_id(self, index: int) -> str:
+        if isinstance(self._ids, tuple):
+            return self._ids[index]
+        return str(uuid.UUID(bytes=self._ids[index * 16:index * 16 + 16]))
+
+    def find(self, shortcut_id: str) -> Optional[int]:
+        """Index of `shortcut_id`, or None if it is not in the library"""
+        if isinstance(self._ids, tuple):
+            return self._ids.index(shortcut_id) if shortcut_id in self._ids else None
+        try:
+            packed = uuid.UUID(shortcut_id).bytes
+        except ValueError:
+            return None
+        position = self._ids.find(packed)
+        while position != -1 and position % 16:
+            position = self._ids.find(packed, position + 1)
+        return None if position == -1 else position // 16
+    
+    def content(self, index: int) -> str:
+        return self._arena[self._offsets[index]:self._offsets[index + 1]].decode('utf-8')
+
+    def row(self, index: int, fields: Sequence[str] = ROW_FIELDS) -> Dict[str, Any]:
+        """Row `index` as PostgREST would return it, limited to `fields`"""
+        row = {}
+        for field in fields:
+            if field == 'id':
+                row['id'] = self.shortcut_id(index)
+            elif field == 'user_id':
+                row['user_id'] = self.user_id
+            elif field == 'trigger':
+                row['trigger'] = self.triggers[index]
+            elif field == 'content':
+                row['content'] = self.content(index)
+            elif field == 'template':
+                row['template'] = self._templates.get(index)
+            elif field == 'created_at':
+                row['created_at'] = _iso(self.created[index])
+            elif field == 'updated_at':
+                row['updated_at'] = _iso(self.updated[index])
+        return row
+
+    def rows(self, fields: Sequence[str] = ROW_FIELDS) -> Iterator[Dict[str, Any]]:
+        for index in range(len(self)):
+            yield self.row(index, fields)
+
+    def compact_rows(self) -> List[Dict[str, Any]]:
+        return list(self.rows(COMPACT_FIELDS))
+
+    def nbytes(self) -> int:
+        """Approximate memory held by this library (shared interned triggers included)"""
+        return (
+            sys.getsizeof(self)
+            + sys.getsizeof(self._ids)
+            + (sum(sys.getsizeof(shortcut_id) for shortcut_id in self._ids) if isinstance(self._ids, tuple) else 0)
+            + sys.getsizeof(self.triggers)
+            + sum(sys.getsizeof(trigger) for trigger in set(self.triggers))
+            + sys.getsizeof(self.created)
+            + sys.getsizeof(self.updated)
+            + sys.getsizeof(self._offsets)
+            + sys.getsizeof(self._arena)
+            + sys.getsizeof(self._templates)
+            + sum(_nested_size(template) for template in self._templates.values())
+        )
+
+class LibraryCache:
+    """Per-worker LRU of packed libraries keyed by user, bounded by total bytes"""
+
+    def __init__(self, max_bytes: int = LIBRARY_CACHE_MAX_BYTES):
+        self._max_bytes = max_bytes
+        self._entries: "OrderedDict[str, Tuple[str, PackedLibrary, int]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, user_id: str, version: str) -> Optional[PackedLibrary]:
+        """The cached library if it was built from `version`"""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[0] != version:
+                return None
+            self._entries.move_to_end(user_id)
+            return entry[1]
+
+    def put(self, user_id: str, version: str, library: PackedLibrary) -> None:
+        size = library.nbytes()
+        if size > self._max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(user_id, None)
+            if previous is not None:
+                self._bytes -= previous[2]
+            self._entries[user_id] = (version, library, size)
+            self._bytes += size
+            while self._bytes > self._max_bytes:
+                _, (_, _, evicted) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+
+    def discard(self, user_id: str) -> None:
+        with self._lock:
+            entry = self._entries.pop(user_id, None)
+            if entry is not None:
+                self._bytes -= entry[2]
+
+    @property
+    def nbytes(self) -> int:
+        return self._bytes
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,101 @@
+"""Routing reads to a read replica without losing read-your-writes.
+
+Successful writes get an X-Consistency-Token response header holding the time
+(epoch ms) the response was produced, which is no earlier than the write's
+commit. Clients echo the newest token they hold on later reads.
+
+ReplicaRouter polls the replica for its position, meaning the time up to which
+every committed transaction is visible there (see `replica_position` in
+DATABASE_SETUP_NEEDED.md). A read goes to the replica when it carries no token
+or the replica's position is past the token plus CONSISTENCY_MARGIN_MS, which
+covers clock skew between the API hosts and the database. Otherwise it is
+pinned to the primary until the replica catches up.
+"""
+from typing import Any, Callable, Dict, Optional
+import os
+import time
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+REPLICA_POLL_INTERVAL = float(os.environ.get('REPLICA_POLL_INTERVAL', '1'))
+CONSISTENCY_MARGIN_MS = float(os.environ.get('CONSISTENCY_MARGIN_MS', '500'))
+
+CONSISTENCY_HEADER = 'X-Consistency-Token'
+
+SAFE_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS'})
+
+def consistency_token() -> int:
+    return int(time.time() * 1000)
+
+class ReplicaRouter:
+    def __init__(self, fetch_position: Callable[[], float], interval: float = REPLICA_POLL_INTERVAL,
+                 margin_ms: float = CONSISTENCY_MARGIN_MS):
+        self._fetch_position = fetch_position
+        self._interval = interval
+        self._margin_ms = margin_ms
+        self._task = None
+        # Replica position in epoch ms; None until known, or after a failed poll
+        self.position_ms: Optional[float] = None
+        self.error: Optional[str] = None
+
+    async def refresh(self) -> None:
+        try:
+            self.position_ms = float(await asyncio.to_thread(self._fetch_position))
+            self.error = None
+        except Exception as e:
+            if self.error is None:
+                logger.warning(f"Replica position check failed, reading from the primary: {e}")
+            self.position_ms = None
+            self.error = str(e) or type(e).__name__
+
+    def can_serve(self, token: Optional[int]) -> bool:
+        """Whether the replica has every write up to `token` (any state if None)"""
+        if self.position_ms is None:
+            return False
+        return token is None or self.position_ms >= token + self._margin_ms
+
+    def snapshot(self) -> Dict[str, Any]:
+        lag_ms = None
+        if self.position_ms is not None:
+            lag_ms = max(0, round(time.time() * 1000 - self.position_ms))
+        return {'available': self.position_ms is not None, 'lag_ms': lag_ms, 'error': self.error}
+
+    async def _run(self) -> None:
+        while True:
+            await self.refresh()
+            await asyncio.sleep(self._interval)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+class ConsistencyTokenMiddleware:
+    """Add a consistency token to every successful response to a write request"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['method'] in SAFE_METHODS:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_token(message):
+            if message['type'] == 'http.response.start' and message['status'] < 400:
+                headers = list(message.get('headers', []))
+                headers.append((CONSISTENCY_HEADER.lower().encode('latin-1'), str(consistency_token()).encode('latin-1')))
+                message = {**message, 'headers': headers}
+            await send(message)
+
+        await self.app(scope, receive, send_with_token)
@@ -0,0 +1,369 @@
+"""Keeping the API responsive while Supabase is slow or down.
+
+CircuitBreaker tracks consecutive failures of one upstream. After
+FAILURE_THRESHOLD of them it opens, and calls fail immediately with
+UpstreamUnavailable (served as a 503) instead of tying up a worker thread
+until they time out. After RESET_TIMEOUT seconds one trial call is let
+through, and its outcome closes the breaker or opens it again.
+
+BreakerTransport applies a breaker to every request of an httpx client (the
+PostgREST session). It also retries idempotent requests on connection errors,
+timeouts and gateway errors, with full-jitter exponential backoff. Retries
+draw on a RetryBudget, so during an outage they add a bounded fraction of
+load instead of multiplying it.
+
+StaleWhileRevalidate keeps the last good result of the reads that opt in
+(the library, sync and export reads) in a per-worker FallbackStore, bounded
+by bytes. When the upstream is unavailable, or slower than STALE_AFTER seconds
+while a previous result exists, the read is answered from it, with the age in
+the STALE_HEADER response header. A slow fresh read keeps running in the
+background and refreshes the stored result when it completes.
+
+HealthProber checks each upstream in the background, so health and readiness
+probes read the last result instead of querying the database themselves.
+"""
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple, Type
+import os
+import time
+import pickle
+import random
+import asyncio
+import logging
+import threading
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+UPSTREAM_TIMEOUT = float(os.environ.get('UPSTREAM_TIMEOUT_SECONDS', '5'))
+FAILURE_THRESHOLD = int(os.environ.get('BREAKER_FAILURE_THRESHOLD', '5'))
+RESET_TIMEOUT = float(os.environ.get('BREAKER_RESET_SECONDS', '15'))
+MAX_RETRIES = int(os.environ.get('UPSTREAM_MAX_RETRIES', '2'))
+# Retries may add at most this fraction of extra requests on top of the normal load
+RETRY_RATIO = float(os.environ.get('UPSTREAM_RETRY_RATIO', '0.2'))
+# Serve the last good result if a fresh read takes longer than this
+STALE_AFTER = float(os.environ.get('STALE_AFTER_SECONDS', '1.5'))
+# How long last-good results are kept to fall back on
+STALE_TTL = float(os.environ.get('STALE_TTL_SECONDS', str(24 * 3600)))
+STALE_MAX_BYTES = int(os.environ.get('STALE_MAX_BYTES', str(64 * 1024 * 1024)))
+HEALTH_PROBE_INTERVAL = float(os.environ.get('HEALTH_PROBE_INTERVAL', '10'))
+
+STALE_HEADER = 'X-Data-Stale-Seconds'
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+RETRYABLE_STATUS = frozenset({502, 503, 504})
+IDEMPOTENT_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS'})
+
+class UpstreamUnavailable(Exception):
+    """An upstream is failing or its breaker is open"""
+
+    def __init__(self, upstream: str, retry_after: float = RESET_TIMEOUT, reason: str = 'unavailable'):
+        super().__init__(f"{upstream} is {reason}, try again shortly")
+        self.upstream = upstream
+        self.retry_after = retry_after
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker; safe to share between threads"""
+
+    def __init__(self, name: str, failure_threshold: int = FAILURE_THRESHOLD, reset_timeout: float = RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        return self._state
+
+    def retry_after(self) -> float:
+        if self._state != OPEN:
+            return 1.0
+        return max(1.0, self._opened_at + self.reset_timeout - time.monotonic())
+
+    def allow(self) -> bool:
+        """Whether a call may go ahead; in the open state lets one trial call through once due"""
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            if self._state == OPEN and time.monotonic() >= self._opened_at + self.reset_timeout:
+                self._state = HALF_OPEN
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._state != CLOSED:
+                logger.info(f"Circuit '{self.name}' closed")
+            self._state = CLOSED
+            self._failures = 0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._state == HALF_OPEN or (self._state == CLOSED and self._failures >= self.failure_threshold):
+                if self._state == CLOSED:
+                    logger.warning(f"Circuit '{self.name}' opened after {self._failures} consecutive failures")
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+
+    def call(self, func: Callable[[], Any], failures: Tuple[Type[BaseException], ...] = (httpx.TransportError,)) -> Any:
+        """Run a blocking call under the breaker; only `failures` count against the upstream"""
+        if not self.allow():
+            raise UpstreamUnavailable(self.name, self.retry_after())
+        try:
+            result = func()
+        except failures as e:
+            self.record_failure()
+            raise UpstreamUnavailable(self.name, self.retry_after()) from e
+        except Exception:
+            # The upstream answered (e.g. rejected the request), so it is up
+            self.record_success()
+            raise
+        self.record_success()
+        return result
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {'state': self._state, 'consecutive_failures': self._failures}
+
+class RetryBudget:
+    """Each request earns `ratio` of a retry token; each retry spends one"""
+
+    def __init__(self, ratio: float = RETRY_RATIO, max_tokens: float = 10.0):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self._tokens = max_tokens
+        self._lock = threading.Lock()
+
+    def deposit(self) -> None:
+        with self._lock:
+            self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        with self._lock:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+def backoff_delay(attempt: int, base: float = 0.05, cap: float = 1.0) -> float:
+    """Full-jitter exponential backoff for retry number `attempt` (0-based)"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+class BreakerTransport(httpx.BaseTransport):
+    """httpx transport that routes every request through a breaker, with budgeted retries"""
+
+    def __init__(self, transport: httpx.BaseTransport, breaker: CircuitBreaker,
+                 budget: Optional[RetryBudget] = None, max_retries: int = MAX_RETRIES):
+        self._transport = transport
+        self.breaker = breaker
+        self.budget = budget or RetryBudget()
+        self.max_retries = max_retries
+
+    def _may_retry(self, request: httpx.Request, attempt: int) -> bool:
+        return (
+            request.method in IDEMPOTENT_METHODS
+            and attempt < self.max_retries
+            and self.breaker.state == CLOSED
+            and self.budget.withdraw()
+        )
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        if not self.breaker.allow():
+            raise UpstreamUnavailable(self.breaker.name, self.breaker.retry_after())
+        self.budget.deposit()
+
+        attempt = 0
+        while True:
+            try:
+                response = self._transport.handle_request(request)
+            except httpx.TransportError as e:
+                self.breaker.record_failure()
+                if not self._may_retry(request, attempt):
+                    reason = 'timing out' if isinstance(e, httpx.TimeoutException) else 'unreachable'
+                    raise UpstreamUnavailable(self.breaker.name, self.breaker.retry_after(), reason) from e
+            else:
+                if response.status_code not in RETRYABLE_STATUS:
+                    self.breaker.record_success()
+                    return response
+                response.close()
+                self.breaker.record_failure()
+                if not self._may_retry(request, attempt):
+                    raise UpstreamUnavailable(self.breaker.name, self.breaker.retry_after())
+            time.sleep(backoff_delay(attempt))
+            attempt += 1
+
+    def close(self) -> None:
+        self._transport.close()
+
+def with_breaker(client: httpx.Client, breaker: CircuitBreaker, timeout: float = UPSTREAM_TIMEOUT) -> None:
+    """Put an existing httpx client behind `breaker` and bound its request time"""
+    client.timeout = httpx.Timeout(timeout)
+    # httpx has no public way to wrap the transport of a client built elsewhere
+    if not isinstance(client._transport, BreakerTransport):
+        client._transport = BreakerTransport(client._transport, breaker)
+
+class FallbackStore:
+    """Per-worker LRU of last good results with their age, bounded by their pickled size
+
+    Kept out of the cache tier: these are the largest values the API reads,
+    and they would crowd out small entries there (and be pickled across
+    processes on every read with the shared tier).
+    """
+
+    def __init__(self, max_bytes: int = STALE_MAX_BYTES, ttl: float = STALE_TTL):
+        self._max_bytes = max_bytes
+        self._ttl = ttl
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any, int]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Tuple[float, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] + self._ttl < time.time():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[0], entry[1]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] == value:
+                # Unchanged: only the age moves
+                self._entries[key] = (now, entry[1], entry[2])
+                self._entries.move_to_end(key)
+                return
+        size = len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+        with self._lock:
+            self._remove(key)
+            if size > self._max_bytes:
+                return
+            self._entries[key] = (now, value, size)
+            self._bytes += size
+            while self._bytes > self._max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: Hashable) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[2]
+
+    @property
+    def nbytes(self) -> int:
+        return self._bytes
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+class StaleWhileRevalidate:
+    def __init__(self, read: Callable[[Hashable, Callable[[], Any]], Awaitable[Any]],
+                 stale_after: float = STALE_AFTER, store: Optional[FallbackStore] = None):
+        self._read = read
+        self._stale_after = stale_after
+        self.store = store or FallbackStore()
+        self._refreshes: set = set()
+
+    async def _fetch(self, key: Hashable, func: Callable[[], Any], fallback: bool) -> Any:
+        value = await self._read(key, func)
+        if fallback:
+            self.store.put(key, value)
+        return value
+
+    def _refresh_done(self, task: asyncio.Task) -> None:
+        self._refreshes.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"Background refresh failed: {task.exception()}")
+
+    async def read(self, key: Hashable, func: Callable[[], Any], response: Any = None, fallback: bool = False) -> Any:
+        """`func()` via the shared read path, or the last good result if the upstream is failing or slow.
+
+        `key` must identify the query (include the user id); `response` gets
+        the staleness header when the stored result is used. Only reads with
+        `fallback` keep a result to fall back on; the others are plain
+        coalesced reads.
+        """
+        stored = self.store.get(key) if fallback else None
+        fresh = asyncio.ensure_future(self._fetch(key, func, fallback))
+        if stored is None:
+            return await fresh
+
+        try:
+            return await asyncio.wait_for(asyncio.shield(fresh), timeout=self._stale_after)
+        except asyncio.TimeoutError:
+            # Let the read finish in the background to refresh the stored result
+            self._refreshes.add(fresh)
+            fresh.add_done_callback(self._refresh_done)
+        except UpstreamUnavailable:
+            pass
+
+        stored_at, value = stored
+        if response is not None:
+            response.headers[STALE_HEADER] = str(max(0, round(time.time() - stored_at)))
+        return value
+
+def copy_staleness(source: Any, target: Any) -> Any:
+    """Copy the staleness header onto a Response built by hand; returns `target`"""
+    if source is not None and STALE_HEADER in source.headers:
+        target.headers[STALE_HEADER] = source.headers[STALE_HEADER]
+    return target
+
+class HealthProber:
+    """Runs each named check every `interval` seconds and keeps the latest outcome"""
+
+    def __init__(self, checks: Dict[str, Callable[[], Any]], interval: float = HEALTH_PROBE_INTERVAL):
+        self._checks = checks
+        self._interval = interval
+        self._task = None
+        self.results: Dict[str, Dict[str, Any]] = {}
+
+    async def _check(self, name: str, check: Callable[[], Any]) -> None:
+        started = time.perf_counter()
+        result: Dict[str, Any] = {'checked_at': time.time()}
+        try:
+            await asyncio.wait_for(asyncio.to_thread(check), timeout=UPSTREAM_TIMEOUT)
+            result['ok'] = True
+        except Exception as e:
+            result['ok'] = False
+            result['error'] = str(e) or type(e).__name__
+        result['latency_ms'] = round((time.perf_counter() - started) * 1000, 2)
+        self.results[name] = result
+
+    async def run_once(self) -> None:
+        await asyncio.gather(*(self._check(name, check) for name, check in self._checks.items()))
+
+    @property
+    def ready(self) -> bool:
+        """Every check passed on its most recent run, and that run is recent"""
+        horizon = time.time() - 3 * self._interval
+        return len(self.results) == len(self._checks) and all(
+            result['ok'] and result['checked_at'] >= horizon for result in self.results.values()
+        )
+
+    async def _run(self) -> None:
+        while True:
+            await self.run_once()
+            await asyncio.sleep(self._interval)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,108 @@
+"""Shortcut revision history stored as compact deltas.
+
+Each edit to a shortcut's content is stored as one row in
+`shortcut_revisions`. Most rows are deltas against the previous revision;
+every SNAPSHOT_INTERVAL-th row (and any edit whose delta would not be
+smaller than the content) is a full snapshot. Rebuilding a revision therefore
+reads at most SNAPSHOT_INTERVAL rows, and history grows with the size of the
+edits rather than the size of the content.
+
+A delta is a JSON list that rebuilds the new text from the old one: `[i, j]`
+copies `old[i:j]` and a string is inserted as is.
+
+    old: "Best regards, John"
+    new: "Kind regards, John Smith"
+    delta: ["Kind",[4,18]," Smith"]
+
+Every row also keeps a short checksum of its content. When the previous
+content of an edit does not match the newest revision (history started after
+the shortcut was created, or a revision failed to save), a snapshot of the
+previous content is written first so deltas always apply to what they were
+computed from.
+"""
+from difflib import SequenceMatcher
+from typing import Any, Dict, List, Optional, Sequence
+import re
+import json
+import hashlib
+
+SNAPSHOT_INTERVAL = 10
+
+_TOKEN = re.compile(r'\w+|\s+|[^\w\s]+')
+
+SNAPSHOT = 'snapshot'
+DELTA = 'delta'
+
+def checksum(content: str) -> str:
+    return hashlib.blake2b(content.encode('utf-8'), digest_size=8).hexdigest()
+
+def _tokens(text: str) -> List[str]:
+    return _TOKEN.findall(text)
+
+def make_delta(old: str, new: str) -> str:
+    # Diff word and whitespace runs rather than characters; much faster on long content
+    old_tokens = _tokens(old)
+    new_tokens = _tokens(new)
+    offsets = [0]
+    for token in old_tokens:
+        offsets.append(offsets[-1] + len(token))
+
+    ops: List[Any] = []
+    for tag, i1, i2, j1, j2 in SequenceMatcher(None, old_tokens, new_tokens, autojunk=False).get_opcodes():
+        if tag == 'equal':
+            ops.append([offsets[i1], offsets[i2]])
+        elif j1 < j2:
+            ops.append(''.join(new_tokens[j1:j2]))
+    return json.dumps(ops, separators=(',', ':'), ensure_ascii=False)
+
+def apply_delta(old: str, delta: str) -> str:
+    return ''.join(old[op[0]:op[1]] if isinstance(op, list) else op for op in json.loads(delta))
+
+def plan_revisions(latest: Optional[Dict[str, Any]], previous: str, content: str) -> List[Dict[str, Any]]:
+    """Rows to append for an edit from `previous` to `content`, given the newest stored revision row
+
+    Rows carry `revision`, `kind`, `depth` (deltas since the last snapshot),
+    `body` and `checksum`; the caller adds ids and ownership.
+    """
+    rows = []
+    if latest is None or latest['checksum'] != checksum(previous):
+        latest = {
+            'revision': latest['revision'] + 1 if latest else 1,
+            'kind': SNAPSHOT,
+            'depth': 0,
+            'body': previous,
+            'checksum': checksum(previous)
+        }
+        rows.append(latest)
+
+    revision = latest['revision'] + 1
+    if latest['depth'] + 1 < SNAPSHOT_INTERVAL:
+        delta = make_delta(previous, content)
+        if len(delta.encode('utf-8')) < len(content.encode('utf-8')):
+            rows.append({
+                'revision': revision,
+                'kind': DELTA,
+                'depth': latest['depth'] + 1,
+                'body': delta,
+                'checksum': checksum(content)
+            })
+            return rows
+    rows.append({'revision': revision, 'kind': SNAPSHOT, 'depth': 0, 'body': content, 'checksum': checksum(content)})
+    return rows
+
+def chain_start(revision: int) -> int:
+    """Lowest revision that can be the snapshot `revision` is rebuilt from"""
+    return max(1, revision - SNAPSHOT_INTERVAL + 1)
+
+def rebuild(rows: Sequence[Dict[str, Any]], revision: int) -> Optional[str]:
+    """Content at `revision` from rows covering chain_start(revision)..revision, or None if missing"""
+    chain = sorted((row for row in rows if row['revision'] <= revision), key=lambda row: row['revision'])
+    if not chain or chain[-1]['revision'] != revision:
+        return None
+    snapshots = [i for i, row in enumerate(chain) if row['kind'] == SNAPSHOT]
+    if not snapshots:
+        return None
+    content = chain[snapshots[-1]]['body']
+    for row in chain[snapshots[-1] + 1:]:
+        content = apply_delta(content, row['body'])
+    return content
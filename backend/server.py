@@ -1,45 +1,194 @@
-from fastapi import FastAPI, APIRouter, Depends, HTTPException, status
+from fastapi import FastAPI, APIRouter, Depends, Header, HTTPException, Request, status
+from fastapi.responses import Response
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from typing import Callable, List, Optional, Dict, Any
 import os
+import time
+import asyncio
 import logging
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 from supabase import create_client, Client
+import httpx
+import jwt
 import json
+import queue
+import secrets
+
+from cache import cache_backend, coherent_ttl, get_cache
+from throttle import IPRateLimitMiddleware, SingleFlight, ip_limiter, user_limiter
+from compression import CompressionMiddleware, etag_matches
+from logs import REQUEST_ID_HEADER, RequestIdMiddleware, log_rates, request_id, setup_logging
+from formats import MEDIA_JSON, COMPACT_FIELDS, compact_response, epoch_ms, negotiate
+from usage import UsageAggregator, UsageBuffer
+from library import LibraryChange, library_changed, library_version, on_library_change
+from bundle import build_bundle, get_bundle_blob, get_current_bundle
+from triggers import find_conflict, get_trigger_index, prefix_conflicts, trigger_key, unique_trigger
+from jobs import JobContext, JobQueue
+from idempotency import REPLAY_HEADER, request_fingerprint, run_idempotent
+from resilience import CircuitBreaker, HealthProber, StaleWhileRevalidate, UpstreamUnavailable, STALE_HEADER, copy_staleness, with_breaker
+from replicas import CONSISTENCY_HEADER, ConsistencyTokenMiddleware, ReplicaRouter
+from packed import LibraryCache, PackedLibrary
+from fuzzy import MAX_DISTANCE, FuzzyIndex, fuzzy_indexes
+from workspaces import EDITOR, OWNER, ROLES, VIEWER, AccessList, invalidate_access_list, load_access_list
+from templates import compile_or_plain, compiled_for, render
+from shared import load_snapshots, merge_subscribed, snapshot_rows
+from revisions import chain_start, plan_revisions, rebuild
+from similarity import DUPLICATE_THRESHOLD, MIN_SIMILARITY, RELATED_LIMIT, SimilarityReport, similarity_reports
+from onboarding import OnboardReport, onboard, upload_format
+from profiles import MAX_PREFERENCES_PATCH_BYTES, PROFILE_FIELDS, CachedProfile, load_profile, store_profile
+
+try:
+    from supabase_auth.errors import AuthApiError, AuthRetryableError
+except ImportError:
+    AuthApiError = AuthRetryableError = None
+
+_import_started = time.perf_counter()
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# Supabase configuration
-supabase_url = os.environ['SUPABASE_URL']
-supabase_anon_key = os.environ['SUPABASE_ANON_KEY'] 
-supabase_service_key = os.environ['SUPABASE_SERVICE_KEY']
-
-# Create Supabase clients
-supabase_client: Client = create_client(supabase_url, supabase_service_key)
-supabase_anon: Client = create_client(supabase_url, supabase_anon_key)
-
-# Configure clients to use text_grow schema
-supabase_client.postgrest.schema = "text_grow"
-supabase_anon.postgrest.schema = "text_grow"
-
-# Also set the session headers for the schema
-supabase_client.postgrest.session.headers.update({
-    'Content-Profile': 'text_grow',
-    'Accept-Profile': 'text_grow'
-})
-supabase_anon.postgrest.session.headers.update({
-    'Content-Profile': 'text_grow', 
-    'Accept-Profile': 'text_grow'
-})
+# Supabase clients are created in the lifespan handler rather than at import
+# time, so importing this module is cheap and does not require the env vars.
+supabase_client: Optional[Client] = None
+supabase_anon: Optional[Client] = None
+# Optional read replica (SUPABASE_REPLICA_URL); reads that may lag use it
+supabase_replica: Optional[Client] = None
+
+# Signing keys fetched from the Supabase JWKS endpoint at startup
+jwks_keys: Dict[str, jwt.PyJWK] = {}
+
+# Timings (ms) of each startup phase, exposed via /api/health/startup
+startup_report: Dict[str, Any] = {}
+
+# One breaker per upstream; while open, calls fail fast with a 503
+database_breaker = CircuitBreaker('database')
+replica_breaker = CircuitBreaker('replica')
+auth_breaker = CircuitBreaker('auth')
+AUTH_UPSTREAM_ERRORS = (httpx.TransportError,) + ((AuthRetryableError,) if AuthRetryableError else ())
+
+def _create_schema_client(url: str, key: str, breaker: CircuitBreaker = database_breaker) -> Client:
+    """Create a Supabase client bound to the text_grow schema"""
+    client = create_client(url, key)
+    client.postgrest.schema = "text_grow"
+    # Also set the session headers for the schema
+    client.postgrest.session.headers.update({
+        'Content-Profile': 'text_grow',
+        'Accept-Profile': 'text_grow'
+    })
+    with_breaker(client.postgrest.session, breaker)
+    return client
+
+def init_clients() -> None:
+    """Create the Supabase clients (idempotent)"""
+    global supabase_client, supabase_anon, supabase_replica
+    if supabase_client is not None:
+        return
+    
+    missing = [name for name in ('SUPABASE_URL', 'SUPABASE_ANON_KEY', 'SUPABASE_SERVICE_KEY') if not os.environ.get(name)]
+    if missing:
+        raise RuntimeError(f"Missing required environment variables: {', '.join(missing)}")
+    
+    supabase_client = _create_schema_client(os.environ['SUPABASE_URL'], os.environ['SUPABASE_SERVICE_KEY'])
+    supabase_anon = _create_schema_client(os.environ['SUPABASE_URL'], os.environ['SUPABASE_ANON_KEY'])
+    if os.environ.get('SUPABASE_REPLICA_URL'):
+        supabase_replica = _create_schema_client(os.environ['SUPABASE_REPLICA_URL'], os.environ['SUPABASE_SERVICE_KEY'], replica_breaker)
+
+def fetch_jwks() -> int:
+    """Prefetch the project's JWT signing keys so tokens can be verified locally"""
+    url = f"{os.environ['SUPABASE_URL'].rstrip('/')}/auth/v1/.well-known/jwks.json"
+    response = httpx.get(url, headers={'apikey': os.environ['SUPABASE_ANON_KEY']}, timeout=5.0)
+    response.raise_for_status()
+    
+    keys = {}
+    for key_data in response.json().get('keys', []):
+        try:
+            key = jwt.PyJWK(key_data)
+        except jwt.PyJWTError:
+            continue
+        keys[key_data.get('kid')] = key
+    jwks_keys.clear()
+    jwks_keys.update(keys)
+    return len(keys)
+
+def fetch_replica_position() -> float:
+    """Epoch ms up to which every committed write is visible on the replica"""
+    return supabase_replica.rpc('replica_position', {}).execute().data
+
+def warm_up_database() -> None:
+    """Issue a cheap query so the PostgREST connection pool is open before the first request"""
+    supabase_client.table('users').select('id').limit(1).execute()
+
+async def _timed(name: str, func) -> None:
+    started = time.perf_counter()
+    try:
+        await asyncio.to_thread(func)
+    except Exception as e:
+        logger.warning(f"Startup step '{name}' failed: {e}")
+        startup_report[f'{name}_error'] = str(e)
+    finally:
+        startup_report[f'{name}_ms'] = round((time.perf_counter() - started) * 1000, 2)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    started = time.perf_counter()
+    startup_report['import_ms'] = round((_import_finished - _import_started) * 1000, 2)
+    
+    clients_started = time.perf_counter()
+    init_clients()
+    startup_report['clients_ms'] = round((time.perf_counter() - clients_started) * 1000, 2)
+    
+    # Connect to the shared cache tier when the CLI started one
+    get_cache()
+    startup_report['cache'] = cache_backend()
+    
+    # Warm up the connection pool and prefetch JWKS concurrently; neither is
+    # fatal, requests fall back to the slow path if they fail.
+    await asyncio.gather(
+        _timed('warmup', warm_up_database),
+        _timed('jwks', fetch_jwks),
+    )
+    startup_report['jwks_keys'] = len(jwks_keys)
+    startup_report['startup_ms'] = round((time.perf_counter() - started) * 1000, 2)
+    logger.info(f"Startup complete: {json.dumps(startup_report)}")
+    
+    usage_buffer.start()
+    usage_aggregator.start()
+    job_queue.start()
+    health_prober.start()
+    if supabase_replica is not None:
+        replica_router.start()
+    
+    yield
+    
+    await replica_router.stop()
+    await health_prober.stop()
+
+    # Running jobs go back to the queue and resume on the next start
+    await job_queue.stop()
+
+    # Write out buffered expansion counts before the process exits
+    await usage_aggregator.stop()
+    await usage_buffer.stop()
+    
+    # Uvicorn has stopped accepting connections and drained in-flight requests
+    logger.info("Shutting down, closing upstream connections")
+    for client in (supabase_client, supabase_anon, supabase_replica):
+        if client is None:
+            continue
+        try:
+            client.postgrest.session.close()
+        except Exception as e:
+            logger.warning(f"Error closing Supabase session: {e}")
 
 # Create the main app
-app = FastAPI(title="TextGrow API", version="1.0.0")
+app = FastAPI(title="TextGrow API", version="1.0.0", lifespan=lifespan)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -47,6 +196,86 @@ api_router = APIRouter(prefix="/api")
 # Security
 security = HTTPBearer()
 
+# Concurrent identical reads (e.g. every extension instance syncing on
+# browser startup) share a single upstream query
+read_coalescer = SingleFlight()
+
+# Reads fall back to the last good result while the database is failing or slow
+stale_reads = StaleWhileRevalidate(read_coalescer.do)
+
+# Tracks how far the read replica has caught up (see replicas.py)
+replica_router = ReplicaRouter(fetch_replica_position)
+
+async def read_route(x_consistency_token: Optional[int] = Header(None)) -> str:
+    """'replica' if the replica can serve this request's reads, else 'primary'"""
+    if supabase_replica is not None and replica_router.can_serve(x_consistency_token):
+        return 'replica'
+    return 'primary'
+
+def run_read(route: str, query: Callable[[Client], Any]) -> Any:
+    """Run a read on the routed database; falls back to the primary if the replica is unavailable"""
+    if route == 'replica':
+        try:
+            return query(supabase_replica)
+        except UpstreamUnavailable:
+            pass
+    return query(supabase_client)
+
+# Health and readiness are answered from the last background probe
+health_prober = HealthProber({'database': warm_up_database})
+
+def write_usage_rows(rows: List[Dict[str, Any]]) -> None:
+    """Upsert aggregated hourly expansion counts (adds to existing counts)"""
+    supabase_client.rpc('record_shortcut_usage', {'rows': rows}).execute()
+
+def roll_up_usage() -> int:
+    """Fold new hourly counts into the daily/monthly/total rollup tables"""
+    result = supabase_client.rpc('roll_up_shortcut_usage', {}).execute()
+    return result.data or 0
+
+# Expansion events are buffered and flushed as per-(user, shortcut, hour) upserts
+usage_buffer = UsageBuffer(write_usage_rows)
+usage_aggregator = UsageAggregator(roll_up_usage)
+
+# Used to turn characters saved into an estimate of time saved (~40 wpm)
+TYPING_CHARS_PER_SECOND = float(os.environ.get('TYPING_CHARS_PER_SECOND', '3.3'))
+
+# Imports and exports too large to run inside a request; persisted in SQLite
+job_queue = JobQueue()
+MAX_ACTIVE_JOBS_PER_USER = int(os.environ.get('MAX_ACTIVE_JOBS_PER_USER', '3'))
+IMPORT_CHUNK_SIZE = 200
+
+# Strong references to fire-and-forget tasks so they are not garbage collected
+background_tasks: set = set()
+
+def spawn_background(coro) -> None:
+    """Run a coroutine in the background if called from the event loop, else drop it"""
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        coro.close()
+        return
+    task = loop.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+def _request_failed(error: Exception) -> HTTPException:
+    """Map an unexpected handler error: upstream outages are 503s, anything else a 400"""
+    if isinstance(error, UpstreamUnavailable):
+        return HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(error),
+            headers={'Retry-After': str(max(1, round(error.retry_after)))}
+        )
+    return HTTPException(status_code=400, detail=str(error))
+
+def _rate_limited(retry_after: float) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail="Too many requests",
+        headers={'Retry-After': str(max(1, round(retry_after)))}
+    )
+
 # Pydantic Models
 class UserProfile(BaseModel):
     id: str
@@ -78,6 +307,13 @@ class ShortcutUpdate(BaseModel):
     trigger: Optional[str] = None
     content: Optional[str] = None
 
+class RenderRequest(BaseModel):
+    shortcut_id: Optional[str] = None
+    content: Optional[str] = None
+    values: Dict[str, str] = {}
+    # The client's local time for {date}/{time}; defaults to now in UTC
+    now: Optional[datetime] = None
+
 class Folder(BaseModel):
     id: str
     user_id: str
@@ -94,6 +330,7 @@ class FolderUpdate(BaseModel):
 class Tag(BaseModel):
     id: str
     name: str
+    usage_count: int = 0
     created_at: datetime
     updated_at: datetime
 
@@ -116,64 +353,176 @@ class SharedFolder(BaseModel):
     share_link: str
     created_at: datetime
     expires_at: Optional[datetime] = None
+    name: Optional[str] = None
+    version: int = 0
+    published_at: Optional[datetime] = None
 
 class SharedFolderCreate(BaseModel):
     folder_id: str
     expires_at: Optional[datetime] = None
 
+class Workspace(BaseModel):
+    id: str
+    name: str
+    role: str
+    created_at: datetime
+
+class WorkspaceCreate(BaseModel):
+    name: str = Field(min_length=1, max_length=100)
+
+class WorkspaceMemberUpdate(BaseModel):
+    email: str
+    role: str = Field(default=VIEWER, pattern='^(' + '|'.join(ROLES) + ')$')
+
+class FolderMembership(BaseModel):
+    shortcut_ids: List[str] = Field(max_length=500)
+
+class TagAssignment(BaseModel):
+    add: List[str] = Field(default=[], max_length=500)
+    remove: List[str] = Field(default=[], max_length=500)
+
+class UsageEvent(BaseModel):
+    shortcut_id: str
+    count: int = Field(default=1, ge=1, le=1000)
+    occurred_at: Optional[datetime] = None
+
+class UsageBatch(BaseModel):
+    events: List[UsageEvent] = Field(max_length=1000)
+
+class Job(BaseModel):
+    id: str
+    kind: str
+    status: str
+    done: int = 0
+    total: Optional[int] = None
+    result: Optional[Any] = None
+    error: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
+    finished_at: Optional[datetime] = None
+
 # Authentication helper
+def decode_token_locally(token: str) -> Optional[Dict[str, Any]]:
+    """Verify a Supabase access token against the prefetched JWKS or the JWT secret.
+    
+    Returns the claims, or None if the token cannot be checked locally and the
+    caller should fall back to asking Supabase Auth.
+    """
+    try:
+        # The algorithm comes from the key, never from the token's own header
+        jwk = jwks_keys.get(jwt.get_unverified_header(token).get('kid'))
+        if jwk is not None:
+            key, algorithms = jwk.key, [jwk.algorithm_name]
+        else:
+            key, algorithms = os.environ.get('JWT_SECRET'), ['HS256']
+        if not key:
+            return None
+        return jwt.decode(token, key, algorithms=algorithms, audience='authenticated')
+    except jwt.ExpiredSignatureError:
+        # Signature was valid but the token is expired: no point asking Supabase
+        raise
+    except jwt.PyJWTError:
+        return None
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> str:
     """Get current user from JWT token"""
     try:
         token = credentials.credentials
-        # Verify token with Supabase
-        user = supabase_client.auth.get_user(token)
-        if not user or not user.user:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Invalid authentication credentials"
-            )
+        claims = decode_token_locally(token)
+        if claims:
+            user_id = claims['sub']
+            email = claims.get('email')
+            user_metadata = claims.get('user_metadata') or {}
+        else:
+            # Verify token with Supabase
+            user = auth_breaker.call(lambda: supabase_client.auth.get_user(token), AUTH_UPSTREAM_ERRORS)
+            if not user or not user.user:
+                raise HTTPException(
+                    status_code=status.HTTP_401_UNAUTHORIZED,
+                    detail="Invalid authentication credentials"
+                )
+            
+            user_id = user.user.id
+            email = user.user.email
+            user_metadata = user.user.user_metadata or {}
         
-        user_id = user.user.id
+        # Throttle before touching the database, so a throttled client costs nothing there
+        retry_after = user_limiter.check(user_id)
+        if retry_after:
+            raise _rate_limited(retry_after)
         
-        # Ensure user exists in our database
-        existing_user = supabase_client.table('users').select('*').eq('id', user_id).execute()
-        if not existing_user.data:
-            user_metadata = user.user.user_metadata or {}
+        # Ensure user exists in our database, checked through the profile
+        # cache; while it is unavailable the verified token is enough and the
+        # row is created on a later request
+        try:
+            missing = load_profile(user_id, _fetch_profile) is None
+        except UpstreamUnavailable:
+            missing = False
+        if missing:
             new_user = {
                 'id': user_id,
-                'email': user.user.email,
+                'email': email,
                 'name': user_metadata.get('full_name') or user_metadata.get('name'),
                 'avatar_url': user_metadata.get('avatar_url'),
                 'created_at': datetime.utcnow().isoformat(),
                 'updated_at': datetime.utcnow().isoformat()
             }
             try:
-                supabase_client.table('users').insert(new_user).execute()
+                inserted = supabase_client.table('users').insert(new_user).execute().data
+                store_profile(user_id, inserted[0] if inserted else new_user)
             except Exception as insert_error:
-                print(f"User might already exist: {insert_error}")
-        
-        return user_id
+                logger.info(f"User might already exist: {insert_error}")
+    except HTTPException:
+        raise
+    except UpstreamUnavailable as e:
+        raise _request_failed(e)
     except Exception as e:
-        print(f"Authentication error: {e}")
+        # Sampled (see LOG_SAMPLING): a wave of expired tokens would flood the log
+        auth_logger.warning(f"Authentication error: {e}", extra={'error_type': type(e).__name__})
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid authentication credentials"
         )
+    
+    return user_id
 
 # Health check endpoints
 @api_router.get("/")
 async def root():
     return {"message": "TextGrow API is running", "version": "1.0.0"}
 
+def _health_report() -> Dict[str, Any]:
+    database = health_prober.results.get('database')
+    report = {
+        "status": "healthy" if health_prober.ready else "unhealthy",
+        "database": "connected" if database and database['ok'] else "unavailable",
+        "checks": health_prober.results,
+        "breakers": {breaker.name: breaker.snapshot() for breaker in (database_breaker, replica_breaker, auth_breaker)},
+        "logs": log_rates.snapshot()
+    }
+    if supabase_replica is not None:
+        report["replica"] = replica_router.snapshot()
+    if database and not database['ok']:
+        report["error"] = database['error']
+    return report
+
 @api_router.get("/health")
 async def health_check():
-    try:
-        # Test Supabase connection
-        result = supabase_client.table('users').select('id').limit(1).execute()
-        return {"status": "healthy", "database": "connected"}
-    except Exception as e:
-        return {"status": "unhealthy", "error": str(e)}
+    """Upstream health from the background prober (does not query the database)"""
+    return _health_report()
+
+@api_router.get("/health/ready")
+async def readiness_check():
+    """200 when the last probes succeeded, else 503 so the instance is taken out of rotation"""
+    report = _health_report()
+    if not health_prober.ready:
+        return Response(content=json.dumps(report), status_code=status.HTTP_503_SERVICE_UNAVAILABLE, media_type=MEDIA_JSON)
+    return report
+
+@api_router.get("/health/startup")
+async def startup_timings():
+    """Report how long each cold-start phase took"""
+    return startup_report
 
 # Authentication endpoints
 @api_router.post("/auth/signup")
@@ -202,39 +551,141 @@ async def signup(user_data: UserCreate):
         result = supabase_client.table('users').insert(new_user).execute()
         return {"message": "User created successfully", "user_id": user_id}
     except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+        raise _request_failed(e)
+
+# Profiles and preferences (see profiles.py)
+def _fetch_profile(user_id: str) -> Optional[Dict[str, Any]]:
+    rows = supabase_client.table('users').select(','.join(PROFILE_FIELDS)).eq('id', user_id).execute().data
+    return rows[0] if rows else None
+
+async def get_profile(user_id: str) -> CachedProfile:
+    profile = await asyncio.to_thread(load_profile, user_id, _fetch_profile)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return profile
+
+def _profile_response(body: bytes, etag: str, if_none_match: Optional[str] = None) -> Response:
+    # no-cache: clients may keep the body but must revalidate it with If-None-Match
+    headers = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+    if if_none_match and etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=body, media_type='application/json', headers=headers)
 
 @api_router.get("/auth/me", response_model=UserProfile)
-async def get_current_user_profile(user_id: str = Depends(get_current_user)):
-    """Get current user profile"""
+async def get_current_user_profile(if_none_match: Optional[str] = Header(None), user_id: str = Depends(get_current_user)):
+    """Get current user profile; a matching If-None-Match gets a 304"""
     try:
-        result = supabase_client.table('users').select('*').eq('id', user_id).single().execute()
-        if not result.data:
+        profile = await get_profile(user_id)
+        return _profile_response(profile.body, profile.etag, if_none_match)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise _request_failed(e)
+
+@api_router.get("/me/preferences")
+async def get_preferences(if_none_match: Optional[str] = Header(None), user_id: str = Depends(get_current_user)):
+    """The user's preferences document; a matching If-None-Match gets a 304"""
+    try:
+        profile = await get_profile(user_id)
+        return _profile_response(profile.preferences_body, profile.preferences_etag, if_none_match)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise _request_failed(e)
+
+@api_router.patch("/me/preferences")
+async def patch_preferences(patch: Dict[str, Any], user_id: str = Depends(get_current_user)):
+    """Apply a JSON merge patch (RFC 7386) to the user's preferences and return them
+    
+    Keys set to null are removed, nested objects are merged and any other
+    value replaces what was there. Send the patch as application/json or
+    application/merge-patch+json.
+    """
+    if len(json.dumps(patch)) > MAX_PREFERENCES_PATCH_BYTES:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=f"Patches are limited to {MAX_PREFERENCES_PATCH_BYTES} bytes")
+    try:
+        rows = supabase_client.rpc('patch_user_preferences', {'target_user_id': user_id, 'patch': patch}).execute().data
+        if not rows:
             raise HTTPException(status_code=404, detail="User not found")
-        
-        user_data = result.data
-        return UserProfile(
-            id=user_data['id'],
-            email=user_data['email'],
-            name=user_data.get('name'),
-            avatar_url=user_data.get('avatar_url'),
-            preferences=user_data.get('preferences', {}),
-            created_at=datetime.fromisoformat(user_data['created_at']),
-            updated_at=datetime.fromisoformat(user_data['updated_at'])
-        )
+        profile = store_profile(user_id, rows[0])
+        return _profile_response(profile.preferences_body, profile.preferences_etag)
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+        raise _request_failed(e)
 
 # Shortcut management endpoints
+MAX_SHORTCUTS_PER_USER = 500
+IMPORT_CONFLICT_POLICIES = ('skip', 'rename', 'overwrite')
+
+def _trigger_rows(user_id: str) -> List[Dict[str, Any]]:
+    return supabase_client.table('shortcuts').select('id,trigger').eq('user_id', user_id).execute().data
+
+async def load_trigger_index(user_id: str) -> Dict[str, str]:
+    """Cached trigger key -> shortcut id map for the user"""
+    return await asyncio.to_thread(get_trigger_index, user_id, lambda: _trigger_rows(user_id))
+
+def _trigger_taken(trigger: str) -> HTTPException:
+    return HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Trigger '{trigger}' is already in use")
+
+def _is_unique_violation(error: Exception) -> bool:
+    message = str(error)
+    return '23505' in message or 'duplicate key' in message
+
+# Packed shortcut libraries cached per worker, valid for one library version
+library_cache = LibraryCache()
+
+@on_library_change
+def _drop_packed_library(user_id: str, previous: Optional[str], version: str, changes: List[LibraryChange]) -> None:
+    library_cache.discard(user_id)
+
+async def load_library(user_id: str, route: str, response: Response) -> PackedLibrary:
+    """The user's shortcuts, from this worker's packed cache when it is current"""
+    version = library_version(user_id)
+    library = library_cache.get(user_id, version)
+    if library is not None:
+        return library
+    
+    rows = await stale_reads.read(
+        ('shortcuts', user_id, route),
+        lambda: run_read(route, lambda db: db.table('shortcuts').select('*').eq('user_id', user_id).execute().data),
+        response,
+        fallback=True
+    )
+    library = PackedLibrary(user_id, rows)
+    # Only a fresh read from the primary is known to include every write up to `version`
+    if route == 'primary' and STALE_HEADER not in response.headers:
+        library_cache.put(user_id, version, library)
+    return library
+
 @api_router.get("/shortcuts", response_model=List[Shortcut])
-async def get_shortcuts(user_id: str = Depends(get_current_user)):
-    """Get all shortcuts for the current user"""
+async def get_shortcuts(request: Request, response: Response, sort: Optional[str] = None, route: str = Depends(read_route), user_id: str = Depends(get_current_user)):
+    """Get all shortcuts for the current user
+    
+    `sort=usage` orders them by all-time expansion count, most used first.
+    Send `Accept: application/vnd.textgrow.columnar+json` or
+    `Accept: application/msgpack` for the compact format (see formats.py).
+    """
     try:
         # Get shortcuts
-        shortcuts_result = supabase_client.table('shortcuts').select('*').eq('user_id', user_id).execute()
+        library = await load_library(user_id, route, response)
+        rows = list(library.rows())
+        
+        if sort == 'usage':
+            usage_rows = await stale_reads.read(
+                ('usage_totals', user_id, route),
+                lambda: run_read(route, lambda db: db.table('shortcut_usage_totals').select('shortcut_id,count').eq('user_id', user_id).execute().data),
+                response
+            )
+            counts = {row['shortcut_id']: row['count'] for row in usage_rows}
+            rows = sorted(rows, key=lambda row: counts.get(row['id'], 0), reverse=True)
+        
+        media_type = negotiate(request.headers.get('accept'))
+        if media_type != MEDIA_JSON:
+            return copy_staleness(response, compact_response(rows, media_type))
         
         shortcuts = []
-        for shortcut in shortcuts_result.data:
+        for shortcut in rows:
             shortcuts.append(Shortcut(
                 id=shortcut['id'],
                 user_id=shortcut['user_id'],
@@ -246,16 +697,81 @@ async def get_shortcuts(user_id: str = Depends(get_current_user)):
         
         return shortcuts
     except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+        raise _request_failed(e)
+
+@api_router.get("/sync")
+async def sync_shortcuts(request: Request, response: Response, since: Optional[int] = None, route: str = Depends(read_route), user_id: str = Depends(get_current_user)):
+    """Minimal shortcut payload for clients that only expand text
+    
+    With `since` (epoch ms, the `cursor` of a previous sync) only shortcuts
+    changed after it are returned, plus the ids of all live shortcuts so the
+    client can drop deleted ones. Honours the same Accept formats as /shortcuts.
+    
+    Shortcuts of the user's workspaces (see workspaces.py) and subscribed
+    shared folders (see shared.py) are merged in. On trigger clashes the
+    user's own shortcuts win, then workspace ones. An id in `ids` the client
+    does not hold (a shortcut no longer shadowed) calls for a full sync.
+    """
+    try:
+        library, folders, workspace_rows = await asyncio.gather(
+            load_library(user_id, route, response),
+            load_subscribed_folders(user_id, route, response),
+            load_workspace_shortcuts(user_id, route, response)
+        )
+        
+        # A stale (or lagging replica) read yields an older cursor, so the next sync catches up
+        own_cursor = max(library.updated) // 1000 if len(library) else 0
+        taken = {trigger_key(trigger) for trigger in library.triggers}
+        workspace_rows = [row for row in workspace_rows if trigger_key(row['trigger']) not in taken]
+        workspace_cursor = max((epoch_ms(row['updated_at']) for row in workspace_rows), default=0)
+        taken.update(trigger_key(row['trigger']) for row in workspace_rows)
+        # An own change can shadow or unshadow merged triggers, so resend them all then
+        merged_since = since if since is not None and own_cursor <= since else None
+        
+        subscribed_rows, subscribed_ids, subscribed_cursor = [], [], 0
+        if folders:
+            snapshots = await asyncio.to_thread(load_snapshots, folders, _fetch_snapshots)
+            subscribed_rows, subscribed_ids, subscribed_cursor = merge_subscribed(taken, folders, snapshots, merged_since)
+        cursor = max(own_cursor, workspace_cursor, subscribed_cursor) or since or 0
+        extra = {'cursor': cursor}
+        indexes = range(len(library))
+        if since is not None:
+            extra['ids'] = [library.shortcut_id(index) for index in indexes] + [row['id'] for row in workspace_rows] + subscribed_ids
+            indexes = [index for index in indexes if library.updated[index] // 1000 > since]
+            if merged_since is not None:
+                workspace_rows = [row for row in workspace_rows if epoch_ms(row['updated_at']) > since]
+        rows = [library.row(index, COMPACT_FIELDS + ('template',)) for index in indexes] + workspace_rows + subscribed_rows
+        rows = [{**{field: row[field] for field in COMPACT_FIELDS}, 'template': compiled_for(row)} for row in rows]
+        
+        media_type = negotiate(request.headers.get('accept'))
+        if media_type != MEDIA_JSON:
+            return copy_staleness(response, compact_response(rows, media_type, extra))
+        
+        return {
+            'shortcuts': rows,
+            **extra
+        }
+    except Exception as e:
+        raise _request_failed(e)
 
 @api_router.post("/shortcuts", response_model=Shortcut)
-async def create_shortcut(shortcut_data: ShortcutCreate, user_id: str = Depends(get_current_user)):
+async def create_shortcut(shortcut_data: ShortcutCreate, response: Response, idempotency_key: Optional[str] = Header(None), user_id: str = Depends(get_current_user)):
+    """Create a new shortcut; retries with the same Idempotency-Key replay the first response"""
+    return await run_idempotent(
+        user_id, 'create_shortcut', idempotency_key, request_fingerprint(shortcut_data), response,
+        lambda: _create_shortcut(shortcut_data, user_id)
+    )
+
+async def _create_shortcut(shortcut_data: ShortcutCreate, user_id: str) -> Shortcut:
     """Create a new shortcut"""
     try:
+        triggers = await load_trigger_index(user_id)
+        
         # Check shortcut limit (500 per user)
-        count_result = supabase_client.table('shortcuts').select('id', count='exact').eq('user_id', user_id).execute()
-        if count_result.count and count_result.count >= 500:
+        if len(triggers) >= MAX_SHORTCUTS_PER_USER:
             raise HTTPException(status_code=400, detail="Maximum shortcut limit (500) reached")
+        if find_conflict(triggers, shortcut_data.trigger):
+            raise _trigger_taken(shortcut_data.trigger)
         
         shortcut_id = str(uuid.uuid4())
         now = datetime.utcnow()
@@ -265,11 +781,20 @@ async def create_shortcut(shortcut_data: ShortcutCreate, user_id: str = Depends(
             'user_id': user_id,
             'trigger': shortcut_data.trigger,
             'content': shortcut_data.content,
+            'template': compile_or_plain(shortcut_data.content),
             'created_at': now.isoformat(),
             'updated_at': now.isoformat()
         }
         
-        result = supabase_client.table('shortcuts').insert(new_shortcut).execute()
+        try:
+            result = supabase_client.table('shortcuts').insert(new_shortcut).execute()
+        except Exception as insert_error:
+            if _is_unique_violation(insert_error):
+                # Created concurrently elsewhere; the unique index caught it
+                library_changed(user_id)
+                raise _trigger_taken(shortcut_data.trigger)
+            raise
+        library_changed(user_id, [LibraryChange(shortcut_id, None, new_shortcut)])
         
         return Shortcut(
             id=shortcut_id,
@@ -279,8 +804,12 @@ async def create_shortcut(shortcut_data: ShortcutCreate, user_id: str = Depends(
             created_at=now,
             updated_at=now
         )
+    except HTTPException as e:
+        if e.status_code == status.HTTP_409_CONFLICT:
+            raise
+        raise _request_failed(e)
     except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+        raise _request_failed(e)
 
 @api_router.put("/shortcuts/{shortcut_id}", response_model=Shortcut)
 async def update_shortcut(shortcut_id: str, shortcut_data: ShortcutUpdate, user_id: str = Depends(get_current_user)):
@@ -296,13 +825,27 @@ async def update_shortcut(shortcut_id: str, shortcut_data: ShortcutUpdate, user_
         }
         
         if shortcut_data.trigger is not None:
+            if trigger_key(shortcut_data.trigger) != trigger_key(existing.data['trigger']):
+                triggers = await load_trigger_index(user_id)
+                if find_conflict(triggers, shortcut_data.trigger, shortcut_id):
+                    raise _trigger_taken(shortcut_data.trigger)
             update_data['trigger'] = shortcut_data.trigger
         if shortcut_data.content is not None:
             update_data['content'] = shortcut_data.content
+            update_data['template'] = compile_or_plain(shortcut_data.content)
         
-        result = supabase_client.table('shortcuts').update(update_data).eq('id', shortcut_id).execute()
+        try:
+            result = supabase_client.table('shortcuts').update(update_data).eq('id', shortcut_id).execute()
+        except Exception as update_error:
+            if _is_unique_violation(update_error):
+                library_changed(user_id)
+                raise _trigger_taken(shortcut_data.trigger)
+            raise
         
         updated_shortcut = result.data[0]
+        library_changed(user_id, [LibraryChange(shortcut_id, existing.data, updated_shortcut)])
+        if updated_shortcut['content'] != existing.data['content']:
+            _record_revision(user_id, existing.data, updated_shortcut)
         return Shortcut(
             id=updated_shortcut['id'],
             user_id=updated_shortcut['user_id'],
@@ -311,8 +854,92 @@ async def update_shortcut(shortcut_id: str, shortcut_data: ShortcutUpdate, user_
             created_at=datetime.fromisoformat(updated_shortcut['created_at']),
             updated_at=datetime.fromisoformat(updated_shortcut['updated_at'])
         )
+    except HTTPException as e:
+        if e.status_code == status.HTTP_409_CONFLICT:
+            raise
+        raise _request_failed(e)
+    except Exception as e:
+        raise _request_failed(e)
+
+# Revision history (see revisions.py)
+def _record_revision(user_id: str, previous: Dict[str, Any], updated: Dict[str, Any]) -> None:
+    """Append the edit from `previous` to `updated` to the shortcut's history; the edit stands if this fails"""
+    shortcut_id = updated['id']
+    try:
+        latest = supabase_client.table('shortcut_revisions').select('revision,kind,depth,checksum').eq('shortcut_id', shortcut_id).order('revision', desc=True).limit(1).execute().data
+        rows = plan_revisions(latest[0] if latest else None, previous['content'], updated['content'])
+        supabase_client.table('shortcut_revisions').insert([
+            {
+                **row,
+                'id': str(uuid.uuid4()),
+                'shortcut_id': shortcut_id,
+                'user_id': user_id,
+                # A snapshot of the previous content dates from the previous edit
+                'created_at': updated['updated_at'] if index == len(rows) - 1 else previous['updated_at']
+            }
+            for index, row in enumerate(rows)
+        ]).execute()
     except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+        logger.warning(f"Could not record revision of shortcut {shortcut_id}: {e}")
+
+def _revision_content(user_id: Optional[str], shortcut_id: str, revision: int) -> Optional[str]:
+    # None for a workspace shortcut, whose revisions have several authors
+    query = supabase_client.table('shortcut_revisions').select('revision,kind,body').eq('shortcut_id', shortcut_id)
+    if user_id is not None:
+        query = query.eq('user_id', user_id)
+    rows = query.gte('revision', chain_start(revision)).lte('revision', revision).execute().data
+    return rebuild(rows, revision)
+
+@api_router.get("/shortcuts/{shortcut_id}/revisions")
+async def get_shortcut_revisions(shortcut_id: str, user_id: str = Depends(get_current_user)):
+    """A shortcut's content history, newest first; history starts with the first edit"""
+    try:
+        existing = supabase_client.table('shortcuts').select('id').eq('id', shortcut_id).eq('user_id', user_id).execute()
+        if not existing.data:
+            raise HTTPException(status_code=404, detail="Shortcut not found")
+        
+        rows = supabase_client.table('shortcut_revisions').select('revision,kind,body,created_at').eq('shortcut_id', shortcut_id).eq('user_id', user_id).order('revision', desc=True).execute().data
+        revisions = [
+            {
+                'revision': row['revision'],
+                'created_at': row['created_at'],
+                'stored_as': row['kind'],
+                'stored_bytes': len(row['body'].encode('utf-8'))
+            }
+            for row in rows
+        ]
+        return {"revisions": revisions, "count": len(revisions)}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise _request_failed(e)
+
+@api_router.get("/shortcuts/{shortcut_id}/revisions/{revision}")
+async def get_shortcut_revision(shortcut_id: str, revision: int, user_id: str = Depends(get_current_user)):
+    """The shortcut's content as of `revision`"""
+    try:
+        content = _revision_content(user_id, shortcut_id, revision)
+        if content is None:
+            raise HTTPException(status_code=404, detail="Revision not found")
+        return {"revision": revision, "content": content}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise _request_failed(e)
+
+@api_router.post("/shortcuts/{shortcut_id}/revisions/{revision}/restore", response_model=Shortcut)
+async def restore_shortcut_revision(shortcut_id: str, revision: int, user_id: str = Depends(get_current_user)):
+    """Set the shortcut's content back to `revision`; the restore is itself a new revision"""
+    try:
+        content = _revision_content(user_id, shortcut_id, revision)
+        if content is None:
+            raise HTTPException(status_code=404, detail="Revision not found")
+        shortcut_data = ShortcutUpdate(content=content)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise _request_failed(e)
+    return await update_shortcut(shortcut_id, shortcut_data, user_id)
 
 @api_router.delete("/shortcuts/{shortcut_id}")
 async def delete_shortcut(shortcut_id: str, user_id: str = Depends(get_current_user)):
@@ -329,20 +956,192 @@ async def delete_shortcut(shortcut_id: str, user_id: str = Depends(get_current_u
         
         # Delete shortcut
         supabase_client.table('shortcuts').delete().eq('id', shortcut_id).execute()
+        library_changed(user_id, [LibraryChange(shortcut_id, existing.data, None)])
         
         return {"message": "Shortcut deleted successfully"}
     except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+        raise _request_failed(e)
+
+@api_router.get("/shortcuts/conflicts")
+async def get_trigger_conflicts(user_id: str = Depends(get_current_user)):
+    """List triggers that are prefixes of other triggers (ambiguous while typing)"""
+    try:
+        result = await read_coalescer.do(
+            ('triggers', user_id),
+            lambda: supabase_client.table('shortcuts').select('id,trigger').eq('user_id', user_id).execute()
+        )
+        conflicts = prefix_conflicts(result.data)
+        return {"conflicts": conflicts, "count": len(conflicts)}
+    except Exception as e:
+        raise _request_failed(e)
+
+@api_router.get("/shortcuts/suggest")
+async def suggest_triggers(q: str, response: Response, limit: int = 5, max_distance: int = MAX_DISTANCE, user_id: str = Depends(get_current_user)):
+    """Triggers within `max_distance` (1-2) edits of `q`, for typos and transpositions; closest first"""
+    if not 1 <= limit <= 20 or not 0 <= max_distance <= MAX_DISTANCE:
+        raise HTTPException(status_code=400, detail=f"limit must be 1-20 and max_distance 0-{MAX_DISTANCE}")
+    try:
+        version = library_version(user_id)
+        index = fuzzy_indexes.get(user_id, version)
+        if index is None:
+            library = await load_library(user_id, 'primary', response)
+            index = FuzzyIndex((library.triggers[i], library.shortcut_id(i)) for i in range(len(library)))
+            if STALE_HEADER not in response.headers:
+                fuzzy_indexes.put(user_id, version, index)
+        
+        return {"suggestions": index.suggest(q, limit, max_distance)}
+    except Exception as e:
+        raise _request_failed(e)
+
+async def load_similarity(user_id: str, response: Response) -> SimilarityReport:
+    """The user's similarity report for the current library version, computing it if needed"""
+    version = library_version(user_id)
+    report = similarity_reports.get(user_id, version)
+    if report is not None:
+        return report
+    
+    library = await load_library(user_id, 'primary', response)
+    report = await read_coalescer.do(
+        ('similarity', user_id, version),
+        lambda: SimilarityReport(
+            [library.shortcut_id(i) for i in range(len(library))],
+            library.triggers,
+            [library.content(i) for i in range(len(library))]
+        )
+    )
+    if STALE_HEADER not in response.headers:
+        similarity_reports.put(user_id, version, report)
+    return report
+
+@api_router.get("/shortcuts/duplicates")
+async def get_duplicate_shortcuts(response: Response, threshold: float = DUPLICATE_THRESHOLD, user_id: str = Depends(get_current_user)):
+    """Pairs of shortcuts whose content is at least `threshold` similar (cosine), most similar first"""
+    if not MIN_SIMILARITY <= threshold <= 1:
+        raise HTTPException(status_code=400, detail=f"threshold must be between {MIN_SIMILARITY} and 1")
+    try:
+        report = await load_similarity(user_id, response)
+        pairs = [
+            {"shortcuts": [report.describe(a), report.describe(b)], "similarity": round(score, 3)}
+            for a, b, score in report.pairs if score >= threshold
+        ]
+        return {"duplicates": pairs, "count": len(pairs)}
+    except Exception as e:
+        raise _request_failed(e)
+
+@api_router.get("/shortcuts/{shortcut_id}/related")
+async def get_related_shortcuts(shortcut_id: str, response: Response, limit: int = 5, user_id: str = Depends(get_current_user)):
+    """Shortcuts with the most similar content to `shortcut_id`, most similar first"""
+    if not 1 <= limit <= RELATED_LIMIT:
+        raise HTTPException(status_code=400, detail=f"limit must be 1-{RELATED_LIMIT}")
+    try:
+        report = await load_similarity(user_id, response)
+        position = report.position(shortcut_id)
+        if position is None:
+            raise HTTPException(status_code=404, detail="Shortcut not found")
+        
+        related = [
+            {**report.describe(other), "similarity": round(score, 3)}
+            for other, score in report.related[position][:limit]
+        ]
+        return {"related": related}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise _request_failed(e)
+
+@api_router.post("/render")
+async def render_template(render_request: RenderRequest, response: Response, user_id: str = Depends(get_current_user)):
+    """Render a shortcut's (or the given) content with `values` substituted for its variables
+    
+    Returns the text, the caret offset marked by {cursor} (or null) and the
+    variables that had no value. Clients holding the compiled template from
+    the bundle or sync can do the same substitution locally.
+    """
+    if (render_request.shortcut_id is None) == (render_request.content is None):
+        raise HTTPException(status_code=400, detail="Provide exactly one of shortcut_id and content")
+    try:
+        if render_request.content is not None:
+            content = render_request.content
+            parts = compile_or_plain(content)
+        else:
+            library = await load_library(user_id, 'primary', response)
+            index = library.find(render_request.shortcut_id)
+            if index is None:
+                raise HTTPException(status_code=404, detail="Shortcut not found")
+            content = library.content(index)
+            parts = compiled_for({'content': content})
+        
+        return render(parts, content, render_request.values, render_request.now)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise _request_failed(e)
+
+# Expansion bundle endpoints
+def _load_library_rows(user_id: str) -> List[Dict[str, Any]]:
+    return supabase_client.table('shortcuts').select(','.join(COMPACT_FIELDS + ('template',))).eq('user_id', user_id).execute().data
+
+async def ensure_bundle(user_id: str) -> Dict[str, Any]:
+    """The user's compiled bundle for the current library version, compiling if needed"""
+    version = library_version(user_id)
+    current = get_current_bundle(user_id)
+    if current and current['library_version'] == version:
+        return current
+    return await read_coalescer.do(
+        ('bundle', user_id),
+        lambda: build_bundle(user_id, version, _load_library_rows(user_id))
+    )
+
+@on_library_change
+def _recompile_bundle(user_id: str, previous: Optional[str], version: str, changes: List[LibraryChange]) -> None:
+    # Compile ahead of the clients' next version check
+    spawn_background(ensure_bundle(user_id))
+
+@api_router.get("/bundle/version")
+async def get_bundle_version(user_id: str = Depends(get_current_user)):
+    """Current bundle version; clients download the bundle only when this changes"""
+    try:
+        meta = await ensure_bundle(user_id)
+        return {"version": meta['version'], "size": meta['size'], "url": f"/api/bundle/{meta['version']}"}
+    except Exception as e:
+        raise _request_failed(e)
+
+@api_router.get("/bundle/{version}")
+async def get_bundle(version: str, user_id: str = Depends(get_current_user)):
+    """A compiled bundle; its content never changes, so it is cached forever"""
+    body = get_bundle_blob(user_id, version)
+    if body is None:
+        raise HTTPException(status_code=404, detail="Bundle not found, check /api/bundle/version")
+    return Response(
+        content=body,
+        media_type='application/json',
+        headers={
+            'Cache-Control': 'private, max-age=31536000, immutable',
+            'ETag': f'"{version}"'
+        }
+    )
 
 # Folder management endpoints
+def _apply_membership(function: str, params: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Run a membership RPC: ownership checks, diff and writes in one transaction and one round trip
+    
+    Returns {added, removed, shortcut_ids (the requested ids the user owns)},
+    or None if the folder or tag is not the user's.
+    """
+    return supabase_client.rpc(function, params).execute().data
+
 @api_router.get("/folders", response_model=List[Folder])
-async def get_folders(user_id: str = Depends(get_current_user)):
+async def get_folders(response: Response, route: str = Depends(read_route), user_id: str = Depends(get_current_user)):
     """Get all folders for the current user"""
     try:
-        result = supabase_client.table('folders').select('*').eq('user_id', user_id).execute()
+        rows = await stale_reads.read(
+            ('folders', user_id, route),
+            lambda: run_read(route, lambda db: db.table('folders').select('*').eq('user_id', user_id).execute().data),
+            response
+        )
         
         folders = []
-        for folder in result.data:
+        for folder in rows:
             folders.append(Folder(
                 id=folder['id'],
                 user_id=folder['user_id'],
@@ -353,7 +1152,7 @@ async def get_folders(user_id: str = Depends(get_current_user)):
         
         return folders
     except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+        raise _request_failed(e)
 
 @api_router.put("/folders/{folder_id}", response_model=Folder)
 async def update_folder(folder_id: str, folder_data: FolderUpdate, user_id: str = Depends(get_current_user)):
@@ -380,7 +1179,7 @@ async def update_folder(folder_id: str, folder_data: FolderUpdate, user_id: str
             updated_at=datetime.fromisoformat(updated_folder['updated_at'])
         )
     except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+        raise _request_failed(e)
 
 @api_router.delete("/folders/{folder_id}")
 async def delete_folder(folder_id: str, user_id: str = Depends(get_current_user)):
@@ -399,10 +1198,17 @@ async def delete_folder(folder_id: str, user_id: str = Depends(get_current_user)
         
         return {"message": "Folder deleted successfully"}
     except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+        raise _request_failed(e)
 
 @api_router.post("/folders", response_model=Folder)
-async def create_folder(folder_data: FolderCreate, user_id: str = Depends(get_current_user)):
+async def create_folder(folder_data: FolderCreate, response: Response, idempotency_key: Optional[str] = Header(None), user_id: str = Depends(get_current_user)):
+    """Create a new folder; retries with the same Idempotency-Key replay the first response"""
+    return await run_idempotent(
+        user_id, 'create_folder', idempotency_key, request_fingerprint(folder_data), response,
+        lambda: _create_folder(folder_data, user_id)
+    )
+
+async def _create_folder(folder_data: FolderCreate, user_id: str) -> Folder:
     """Create a new folder"""
     try:
         folder_id = str(uuid.uuid4())
@@ -426,35 +1232,574 @@ async def create_folder(folder_data: FolderCreate, user_id: str = Depends(get_cu
             updated_at=now
         )
     except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+        raise _request_failed(e)
+
+@api_router.put("/folders/{folder_id}/shortcuts")
+async def set_folder_shortcuts(folder_id: str, membership: FolderMembership, user_id: str = Depends(get_current_user)):
+    """Replace the set of shortcuts in a folder, applying only the difference"""
+    try:
+        result = await asyncio.to_thread(_apply_membership, 'set_folder_shortcuts', {
+            'target_folder_id': folder_id,
+            'owner_id': user_id,
+            'shortcut_ids': sorted(set(membership.shortcut_ids))
+        })
+        if result is None:
+            raise HTTPException(status_code=404, detail="Folder not found")
+        
+        owned = set(result['shortcut_ids'])
+        return {
+            "added": result['added'],
+            "removed": result['removed'],
+            "shortcut_ids": sorted(owned),
+            "ignored": sorted(set(membership.shortcut_ids) - owned)
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise _request_failed(e)
+
+# Shared folders (see shared.py)
+SUBSCRIPTION_CACHE_TTL = 300
+
+def _subscription_cache_key(user_id: str) -> str:
+    return f'subscriptions:{user_id}'
+
+def _shared_folder_from_row(row: Dict[str, Any]) -> SharedFolder:
+    return SharedFolder(
+        id=row['id'],
+        folder_id=row['folder_id'],
+        share_link=row['share_link'],
+        created_at=datetime.fromisoformat(row['created_at']),
+        expires_at=datetime.fromisoformat(row['expires_at']) if row.get('expires_at') else None,
+        name=row.get('name'),
+        version=row.get('version') or 0,
+        published_at=datetime.fromisoformat(row['published_at']) if row.get('published_at') else None
+    )
+
+def _share_expired(row: Dict[str, Any]) -> bool:
+    return bool(row.get('expires_at')) and epoch_ms(row['expires_at']) <= time.time() * 1000
+
+async def load_subscribed_folders(user_id: str, route: str, response: Response) -> List[Dict[str, Any]]:
+    """Current shared_folders rows the user subscribes to, each with its `subscribed_at`"""
+    cache = get_cache()
+    subscriptions = cache.get(_subscription_cache_key(user_id))
+    if subscriptions is None:
+        result = await read_coalescer.do(
+            ('subscriptions', user_id),
+            lambda: supabase_client.table('shared_folder_users').select('shared_folder_id,subscribed_at').eq('user_id', user_id).execute()
+        )
+        subscriptions = result.data
+        cache.set(_subscription_cache_key(user_id), subscriptions, coherent_ttl(SUBSCRIPTION_CACHE_TTL))
+    if not subscriptions:
+        return []
+    
+    subscribed_at = {row['shared_folder_id']: row['subscribed_at'] for row in subscriptions}
+    rows = await stale_reads.read(
+        ('shared_folders', user_id, route),
+        lambda: run_read(route, lambda db: db.table('shared_folders').select('*').in_('id', sorted(subscribed_at)).execute().data),
+        response,
+        fallback=True
+    )
+    return [
+        {**row, 'subscribed_at': subscribed_at[row['id']]}
+        for row in rows if row['version'] and not _share_expired(row)
+    ]
+
+def _fetch_snapshots(keys: List[tuple]) -> Dict[tuple, List[List[Any]]]:
+    # Always the primary: a version seen on a replica is committed there too
+    rows = supabase_client.table('shared_folder_versions').select('shared_folder_id,version,shortcuts').in_(
+        'shared_folder_id', sorted({key[0] for key in keys})
+    ).in_('version', sorted({key[1] for key in keys})).execute().data
+    wanted = set(keys)
+    return {
+        (row['shared_folder_id'], row['version']): row['shortcuts']
+        for row in rows if (row['shared_folder_id'], row['version']) in wanted
+    }
+
+@api_router.post("/shared-folders", response_model=SharedFolder)
+async def publish_folder(share: SharedFolderCreate, user_id: str = Depends(get_current_user)):
+    """Publish the folder's current shortcuts as a new version
+    
+    The first publish creates the share link; later ones bump the version.
+    Subscribers see the new version on their next sync. A publish is two
+    writes however many subscribers the folder has.
+    """
+    try:
+        folder = supabase_client.table('folders').select('id,name').eq('id', share.folder_id).eq('user_id', user_id).execute()
+        if not folder.data:
+            raise HTTPException(status_code=404, detail="Folder not found")
+        
+        members = supabase_client.table('folder_shortcuts').select('shortcut_id').eq('folder_id', share.folder_id).execute().data
+        shortcut_ids = [row['shortcut_id'] for row in members]
+        rows = []
+        if shortcut_ids:
+            rows = supabase_client.table('shortcuts').select('id,trigger,content,template').eq('user_id', user_id).in_('id', shortcut_ids).execute().data
+        
+        now = datetime.utcnow().isoformat()
+        existing = supabase_client.table('shared_folders').select('*').eq('folder_id', share.folder_id).execute().data
+        if existing:
+            shared = existing[0]
+        else:
+            shared = {
+                'id': str(uuid.uuid4()),
+                'folder_id': share.folder_id,
+                'owner_id': user_id,
+                'name': folder.data[0]['name'],
+                'share_link': secrets.token_urlsafe(16),
+                'version': 0,
+                'created_at': now
+            }
+            supabase_client.table('shared_folders').insert(shared).execute()
+        
+        version = shared['version'] + 1
+        try:
+            supabase_client.table('shared_folder_versions').insert({
+                'shared_folder_id': shared['id'],
+                'version': version,
+                'shortcuts': snapshot_rows(rows),
+                'published_at': now
+            }).execute()
+        except Exception as insert_error:
+            if _is_unique_violation(insert_error):
+                raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Folder was published concurrently; retry")
+            raise
+        
+        update_data = {
+            'version': version,
+            'name': folder.data[0]['name'],
+            'published_at': now,
+            'expires_at': share.expires_at.isoformat() if share.expires_at else None
+        }
+        supabase_client.table('shared_folders').update(update_data).eq('id', shared['id']).eq('version', shared['version']).execute()
+        return _shared_folder_from_row({**shared, **update_data})
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise _request_failed(e)
+
+@api_router.get("/shared-folders", response_model=List[SharedFolder])
+async def get_shared_folders(user_id: str = Depends(get_current_user)):
+    """Folders the current user publishes"""
+    try:
+        rows = supabase_client.table('shared_folders').select('*').eq('owner_id', user_id).execute().data
+        return [_shared_folder_from_row(row) for row in rows]
+    except Exception as e:
+        raise _request_failed(e)
+
+@api_router.post("/shared-folders/{share_link}/subscribe", response_model=SharedFolder)
+async def subscribe_shared_folder(share_link: str, user_id: str = Depends(get_current_user)):
+    """Subscribe to a published folder; its shortcuts appear in /sync from then on"""
+    try:
+        result = supabase_client.table('shared_folders').select('*').eq('share_link', share_link).execute()
+        if not result.data or _share_expired(result.data[0]):
+            raise HTTPException(status_code=404, detail="Shared folder not found")
+        shared = result.data[0]
+        if shared.get('owner_id') == user_id:
+            raise HTTPException(status_code=400, detail="Cannot subscribe to your own folder")
+        
+        supabase_client.table('shared_folder_users').upsert({
+            'shared_folder_id': shared['id'],
+            'user_id': user_id,
+            'subscribed_at': datetime.utcnow().isoformat()
+        }, on_conflict='shared_folder_id,user_id', ignore_duplicates=True).execute()
+        get_cache().delete(_subscription_cache_key(user_id))
+        return _shared_folder_from_row(shared)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise _request_failed(e)
+
+@api_router.get("/subscriptions", response_model=List[SharedFolder])
+async def get_subscriptions(response: Response, user_id: str = Depends(get_current_user)):
+    """Shared folders the current user subscribes to, at their current versions"""
+    try:
+        folders = await load_subscribed_folders(user_id, 'primary', response)
+        return [_shared_folder_from_row(folder) for folder in folders]
+    except Exception as e:
+        raise _request_failed(e)
+
+@api_router.delete("/subscriptions/{shared_folder_id}")
+async def unsubscribe_shared_folder(shared_folder_id: str, user_id: str = Depends(get_current_user)):
+    """Stop receiving a shared folder; clients drop its shortcuts on their next sync"""
+    try:
+        supabase_client.table('shared_folder_users').delete().eq('shared_folder_id', shared_folder_id).eq('user_id', user_id).execute()
+        get_cache().delete(_subscription_cache_key(user_id))
+        return {"message": "Unsubscribed successfully"}
+    except Exception as e:
+        raise _request_failed(e)
+
+# Workspaces (see workspaces.py)
+def _fetch_memberships(user_id: str) -> List[Dict[str, str]]:
+    return supabase_client.table('workspace_members').select('workspace_id,role').eq('user_id', user_id).execute().data
+
+async def get_access_list(user_id: str) -> AccessList:
+    return await asyncio.to_thread(load_access_list, user_id, _fetch_memberships)
+
+async def require_workspace_role(user_id: str, workspace_id: str, role: str) -> AccessList:
+    """The user's access list; 404 if they are not a member, 403 if their role is below `role`"""
+    access = await get_access_list(user_id)
+    if access.role(workspace_id) is None:
+        raise HTTPException(status_code=404, detail="Workspace not found")
+    if not access.allows(workspace_id, role):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=f"Requires the {role} role in this workspace")
+    return access
+
+async def load_workspace_shortcuts(user_id: str, route: str, response: Response) -> List[Dict[str, Any]]:
+    """Compact rows of every shortcut in the user's workspaces (one IN query, none without workspaces)"""
+    access = await get_access_list(user_id)
+    if not access:
+        return []
+    return await stale_reads.read(
+        ('workspace_shortcuts', user_id, route),
+        lambda: run_read(route, lambda db: db.table('shortcuts').select(','.join(COMPACT_FIELDS + ('template',))).in_('workspace_id', access.readable).execute().data),
+        response,
+        fallback=True
+    )
+
+WORKSPACE_TABLES = {'shortcuts': 'shortcuts', 'folders': 'folders', 'tags': 'tags'}
+
+def _workspace_table(resource: str) -> str:
+    table = WORKSPACE_TABLES.get(resource)
+    if table is None:
+        raise HTTPException(status_code=404, detail="Not found")
+    return table
+
+@api_router.post("/workspaces", response_model=Workspace)
+async def create_workspace(workspace_data: WorkspaceCreate, user_id: str = Depends(get_current_user)):
+    """Create a workspace owned by the current user"""
+    try:
+        workspace_id = str(uuid.uuid4())
+        now = datetime.utcnow()
+        supabase_client.table('workspaces').insert({
+            'id': workspace_id,
+            'name': workspace_data.name,
+            'owner_id': user_id,
+            'created_at': now.isoformat(),
+            'updated_at': now.isoformat()
+        }).execute()
+        supabase_client.table('workspace_members').insert({
+            'workspace_id': workspace_id,
+            'user_id': user_id,
+            'role': OWNER,
+            'created_at': now.isoformat()
+        }).execute()
+        invalidate_access_list(user_id)
+        return Workspace(id=workspace_id, name=workspace_data.name, role=OWNER, created_at=now)
+    except Exception as e:
+        raise _request_failed(e)
+
+@api_router.get("/workspaces", response_model=List[Workspace])
+async def get_workspaces(user_id: str = Depends(get_current_user)):
+    """Workspaces the current user belongs to, with their role in each"""
+    try:
+        access = await get_access_list(user_id)
+        if not access:
+            return []
+        rows = supabase_client.table('workspaces').select('id,name,created_at').in_('id', access.readable).execute().data
+        return [
+            Workspace(id=row['id'], name=row['name'], role=access.role(row['id']), created_at=datetime.fromisoformat(row['created_at']))
+            for row in rows
+        ]
+    except Exception as e:
+        raise _request_failed(e)
+
+@api_router.get("/workspaces/{workspace_id}/members")
+async def get_workspace_members(workspace_id: str, user_id: str = Depends(get_current_user)):
+    """Members of a workspace and their roles"""
+    try:
+        await require_workspace_role(user_id, workspace_id, VIEWER)
+        rows = supabase_client.table('workspace_members').select('user_id,role,created_at').eq('workspace_id', workspace_id).execute().data
+        return {"members": rows, "count": len(rows)}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise _request_failed(e)
+
+@api_router.put("/workspaces/{workspace_id}/members")
+async def set_workspace_member(workspace_id: str, member: WorkspaceMemberUpdate, user_id: str = Depends(get_current_user)):
+    """Add a user (by email) to the workspace or change their role; owners only"""
+    try:
+        await require_workspace_role(user_id, workspace_id, OWNER)
+        users = supabase_client.table('users').select('id').eq('email', member.email).execute().data
+        if not users:
+            raise HTTPException(status_code=404, detail="User not found")
+        member_id = users[0]['id']
+        if member_id == user_id:
+            raise HTTPException(status_code=400, detail="Cannot change your own role")
+        
+        supabase_client.table('workspace_members').upsert({
+            'workspace_id': workspace_id,
+            'user_id': member_id,
+            'role': member.role,
+            'created_at': datetime.utcnow().isoformat()
+        }, on_conflict='workspace_id,user_id').execute()
+        invalidate_access_list(member_id)
+        return {"user_id": member_id, "role": member.role}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise _request_failed(e)
+
+@api_router.delete("/workspaces/{workspace_id}/members/{member_id}")
+async def remove_workspace_member(workspace_id: str, member_id: str, user_id: str = Depends(get_current_user)):
+    """Remove a member (owners), or leave the workspace (any member but its owner)"""
+    try:
+        access = await require_workspace_role(user_id, workspace_id, VIEWER)
+        if member_id != user_id and not access.allows(workspace_id, OWNER):
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=f"Requires the {OWNER} role in this workspace")
+        workspace = supabase_client.table('workspaces').select('owner_id').eq('id', workspace_id).execute().data
+        if workspace and workspace[0]['owner_id'] == member_id:
+            raise HTTPException(status_code=400, detail="The workspace owner cannot be removed")
+        
+        supabase_client.table('workspace_members').delete().eq('workspace_id', workspace_id).eq('user_id', member_id).execute()
+        invalidate_access_list(member_id)
+        return {"message": "Member removed successfully"}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise _request_failed(e)
+
+@api_router.get("/workspaces/{workspace_id}/{resource}")
+async def get_workspace_items(workspace_id: str, resource: str, user_id: str = Depends(get_current_user)):
+    """Shortcuts, folders or tags of a workspace, or of every workspace the user can read with `all`"""
+    try:
+        table = _workspace_table(resource)
+        if workspace_id == 'all':
+            workspace_ids = (await get_access_list(user_id)).readable
+        else:
+            await require_workspace_role(user_id, workspace_id, VIEWER)
+            workspace_ids = [workspace_id]
+        
+        rows = []
+        if workspace_ids:
+            rows = supabase_client.table(table).select('*').in_('workspace_id', workspace_ids).execute().data
+        return {resource: rows, "count": len(rows)}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise _request_failed(e)
+
+@api_router.post("/workspaces/{workspace_id}/shortcuts")
+async def create_workspace_shortcut(workspace_id: str, shortcut_data: ShortcutCreate, user_id: str = Depends(get_current_user)):
+    """Create a shortcut in a workspace; editors and owners only"""
+    try:
+        await require_workspace_role(user_id, workspace_id, EDITOR)
+        existing = supabase_client.table('shortcuts').select('id,trigger').eq('workspace_id', workspace_id).execute().data
+        if find_conflict({trigger_key(row['trigger']): row['id'] for row in existing}, shortcut_data.trigger):
+            raise _trigger_taken(shortcut_data.trigger)
+        
+        now = datetime.utcnow().isoformat()
+        new_shortcut = {
+            'id': str(uuid.uuid4()),
+            'user_id': None,
+            'workspace_id': workspace_id,
+            'created_by': user_id,
+            'trigger': shortcut_data.trigger,
+            'content': shortcut_data.content,
+            'template': compile_or_plain(shortcut_data.content),
+            'created_at': now,
+            'updated_at': now
+        }
+        try:
+            supabase_client.table('shortcuts').insert(new_shortcut).execute()
+        except Exception as insert_error:
+            if _is_unique_violation(insert_error):
+                raise _trigger_taken(shortcut_data.trigger)
+            raise
+        return new_shortcut
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise _request_failed(e)
+
+@api_router.put("/workspaces/{workspace_id}/shortcuts/{shortcut_id}")
+async def update_workspace_shortcut(workspace_id: str, shortcut_id: str, shortcut_data: ShortcutUpdate, user_id: str = Depends(get_current_user)):
+    """Update a workspace shortcut; editors and owners only"""
+    try:
+        await require_workspace_role(user_id, workspace_id, EDITOR)
+        update_data = {'updated_at': datetime.utcnow().isoformat()}
+        previous = None
+        if shortcut_data.trigger is not None:
+            existing = supabase_client.table('shortcuts').select('id,trigger').eq('workspace_id', workspace_id).execute().data
+            if find_conflict({trigger_key(row['trigger']): row['id'] for row in existing}, shortcut_data.trigger, shortcut_id):
+                raise _trigger_taken(shortcut_data.trigger)
+            update_data['trigger'] = shortcut_data.trigger
+        if shortcut_data.content is not None:
+            update_data['content'] = shortcut_data.content
+            update_data['template'] = compile_or_plain(shortcut_data.content)
+            # The content before the edit, for the revision history
+            rows = supabase_client.table('shortcuts').select('id,content,updated_at').eq('id', shortcut_id).eq('workspace_id', workspace_id).execute().data
+            if not rows:
+                raise HTTPException(status_code=404, detail="Shortcut not found")
+            previous = rows[0]
+        
+        try:
+            result = supabase_client.table('shortcuts').update(update_data).eq('id', shortcut_id).eq('workspace_id', workspace_id).execute()
+        except Exception as update_error:
+            if _is_unique_violation(update_error):
+                raise _trigger_taken(shortcut_data.trigger)
+            raise
+        if not result.data:
+            raise HTTPException(status_code=404, detail="Shortcut not found")
+        updated_shortcut = result.data[0]
+        if previous is not None and updated_shortcut['content'] != previous['content']:
+            # Revisions of workspace shortcuts record the member who made the edit
+            _record_revision(user_id, previous, updated_shortcut)
+        return updated_shortcut
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise _request_failed(e)
+
+@api_router.get("/workspaces/{workspace_id}/shortcuts/{shortcut_id}/revisions")
+async def get_workspace_shortcut_revisions(workspace_id: str, shortcut_id: str, user_id: str = Depends(get_current_user)):
+    """A workspace shortcut's content history, newest first, with the member whose edit recorded each revision"""
+    try:
+        await require_workspace_role(user_id, workspace_id, VIEWER)
+        existing = supabase_client.table('shortcuts').select('id').eq('id', shortcut_id).eq('workspace_id', workspace_id).execute()
+        if not existing.data:
+            raise HTTPException(status_code=404, detail="Shortcut not found")
+        
+        rows = supabase_client.table('shortcut_revisions').select('revision,kind,body,user_id,created_at').eq('shortcut_id', shortcut_id).order('revision', desc=True).execute().data
+        revisions = [
+            {
+                'revision': row['revision'],
+                'created_at': row['created_at'],
+                'edited_by': row['user_id'],
+                'stored_as': row['kind'],
+                'stored_bytes': len(row['body'].encode('utf-8'))
+            }
+            for row in rows
+        ]
+        return {"revisions": revisions, "count": len(revisions)}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise _request_failed(e)
+
+@api_router.get("/workspaces/{workspace_id}/shortcuts/{shortcut_id}/revisions/{revision}")
+async def get_workspace_shortcut_revision(workspace_id: str, shortcut_id: str, revision: int, user_id: str = Depends(get_current_user)):
+    """The workspace shortcut's content as of `revision`"""
+    try:
+        await require_workspace_role(user_id, workspace_id, VIEWER)
+        existing = supabase_client.table('shortcuts').select('id').eq('id', shortcut_id).eq('workspace_id', workspace_id).execute()
+        content = _revision_content(None, shortcut_id, revision) if existing.data else None
+        if content is None:
+            raise HTTPException(status_code=404, detail="Revision not found")
+        return {"revision": revision, "content": content}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise _request_failed(e)
+
+@api_router.delete("/workspaces/{workspace_id}/shortcuts/{shortcut_id}")
+async def delete_workspace_shortcut(workspace_id: str, shortcut_id: str, user_id: str = Depends(get_current_user)):
+    """Delete a workspace shortcut; editors and owners only"""
+    try:
+        await require_workspace_role(user_id, workspace_id, EDITOR)
+        result = supabase_client.table('shortcuts').delete().eq('id', shortcut_id).eq('workspace_id', workspace_id).execute()
+        if not result.data:
+            raise HTTPException(status_code=404, detail="Shortcut not found")
+        return {"message": "Shortcut deleted successfully"}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise _request_failed(e)
+
+@api_router.post("/workspaces/{workspace_id}/folders")
+async def create_workspace_folder(workspace_id: str, folder_data: FolderCreate, user_id: str = Depends(get_current_user)):
+    """Create a folder in a workspace; editors and owners only"""
+    try:
+        await require_workspace_role(user_id, workspace_id, EDITOR)
+        now = datetime.utcnow().isoformat()
+        new_folder = {
+            'id': str(uuid.uuid4()),
+            'user_id': None,
+            'workspace_id': workspace_id,
+            'name': folder_data.name,
+            'created_at': now,
+            'updated_at': now
+        }
+        supabase_client.table('folders').insert(new_folder).execute()
+        return new_folder
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise _request_failed(e)
+
+@api_router.post("/workspaces/{workspace_id}/tags")
+async def create_workspace_tag(workspace_id: str, tag_data: TagCreate, user_id: str = Depends(get_current_user)):
+    """Create a tag in a workspace; editors and owners only"""
+    try:
+        await require_workspace_role(user_id, workspace_id, EDITOR)
+        now = datetime.utcnow().isoformat()
+        new_tag = {
+            'id': str(uuid.uuid4()),
+            'user_id': None,
+            'workspace_id': workspace_id,
+            'name': tag_data.name,
+            'created_at': now,
+            'updated_at': now
+        }
+        try:
+            supabase_client.table('tags').insert(new_tag).execute()
+        except Exception as insert_error:
+            if _is_unique_violation(insert_error):
+                raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Tag '{tag_data.name}' already exists")
+            raise
+        return new_tag
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise _request_failed(e)
 
 # Tag management endpoints
+TAG_CACHE_TTL = 300
+
+def _tag_cache_key(user_id: str) -> str:
+    return f'tags:{user_id}'
+
+def _tag_from_row(tag: Dict[str, Any]) -> Tag:
+    return Tag(
+        id=tag['id'],
+        name=tag['name'],
+        usage_count=tag.get('usage_count') or 0,
+        created_at=datetime.fromisoformat(tag['created_at']),
+        updated_at=datetime.fromisoformat(tag['updated_at'])
+    )
+
+async def get_tag_dictionary(user_id: str) -> Dict[str, Dict[str, Any]]:
+    """The user's tags keyed by name, served from the cache tier when warm"""
+    cache = get_cache()
+    tags = cache.get(_tag_cache_key(user_id))
+    if tags is None:
+        result = await read_coalescer.do(
+            ('tags', user_id),
+            lambda: supabase_client.table('tags').select('*').eq('user_id', user_id).execute()
+        )
+        tags = {tag['name']: tag for tag in result.data}
+        cache.set(_tag_cache_key(user_id), tags, coherent_ttl(TAG_CACHE_TTL))
+    return tags
+
+def invalidate_tag_dictionary(user_id: str) -> None:
+    get_cache().delete(_tag_cache_key(user_id))
+
 @api_router.get("/tags", response_model=List[Tag])
-async def get_tags():
-    """Get all available tags"""
-    try:
-        result = supabase_client.table('tags').select('*').execute()
-        
-        tags = []
-        for tag in result.data:
-            tags.append(Tag(
-                id=tag['id'],
-                name=tag['name'],
-                created_at=datetime.fromisoformat(tag['created_at']),
-                updated_at=datetime.fromisoformat(tag['updated_at'])
-            ))
-        
-        return tags
+async def get_tags(user_id: str = Depends(get_current_user)):
+    """Get all tags for the current user"""
+    try:
+        tags = await get_tag_dictionary(user_id)
+        return [_tag_from_row(tag) for tag in tags.values()]
     except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+        raise _request_failed(e)
 
 @api_router.put("/tags/{tag_id}", response_model=Tag)
-async def update_tag(tag_id: str, tag_data: TagCreate):
+async def update_tag(tag_id: str, tag_data: TagCreate, user_id: str = Depends(get_current_user)):
     """Update a tag"""
     try:
         # Check if tag exists
-        existing = supabase_client.table('tags').select('*').eq('id', tag_id).single().execute()
-        if not existing.data:
+        tags = await get_tag_dictionary(user_id)
+        if not any(tag['id'] == tag_id for tag in tags.values()):
             raise HTTPException(status_code=404, detail="Tag not found")
         
         update_data = {
@@ -462,123 +1807,481 @@ async def update_tag(tag_id: str, tag_data: TagCreate):
             'updated_at': datetime.utcnow().isoformat()
         }
         
-        result = supabase_client.table('tags').update(update_data).eq('id', tag_id).execute()
+        result = supabase_client.table('tags').update(update_data).eq('id', tag_id).eq('user_id', user_id).execute()
+        invalidate_tag_dictionary(user_id)
         
-        updated_tag = result.data[0]
-        return Tag(
-            id=updated_tag['id'],
-            name=updated_tag['name'],
-            created_at=datetime.fromisoformat(updated_tag['created_at']),
-            updated_at=datetime.fromisoformat(updated_tag['updated_at'])
-        )
+        return _tag_from_row(result.data[0])
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+        raise _request_failed(e)
 
 @api_router.delete("/tags/{tag_id}")
-async def delete_tag(tag_id: str):
+async def delete_tag(tag_id: str, user_id: str = Depends(get_current_user)):
     """Delete a tag"""
     try:
         # Check if tag exists
-        existing = supabase_client.table('tags').select('*').eq('id', tag_id).single().execute()
-        if not existing.data:
+        tags = await get_tag_dictionary(user_id)
+        if not any(tag['id'] == tag_id for tag in tags.values()):
             raise HTTPException(status_code=404, detail="Tag not found")
         
         # Delete tag assignments
         supabase_client.table('shortcut_tag_assignments').delete().eq('tag_id', tag_id).execute()
         
         # Delete tag
-        supabase_client.table('tags').delete().eq('id', tag_id).execute()
+        supabase_client.table('tags').delete().eq('id', tag_id).eq('user_id', user_id).execute()
+        invalidate_tag_dictionary(user_id)
         
         return {"message": "Tag deleted successfully"}
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+        raise _request_failed(e)
+
+@api_router.post("/tags/{tag_id}/assign")
+async def assign_tag(tag_id: str, assignment: TagAssignment, user_id: str = Depends(get_current_user)):
+    """Add and remove a tag on many shortcuts, applying only the difference"""
+    try:
+        tags = await get_tag_dictionary(user_id)
+        if not any(tag['id'] == tag_id for tag in tags.values()):
+            raise HTTPException(status_code=404, detail="Tag not found")
+        
+        requested = set(assignment.add) | set(assignment.remove)
+        result = await asyncio.to_thread(_apply_membership, 'assign_tag_shortcuts', {
+            'target_tag_id': tag_id,
+            'owner_id': user_id,
+            'add_ids': sorted(set(assignment.add)),
+            'remove_ids': sorted(set(assignment.remove))
+        })
+        if result is None:
+            raise HTTPException(status_code=404, detail="Tag not found")
+        if result['added'] or result['removed']:
+            # usage_count changed
+            invalidate_tag_dictionary(user_id)
+        
+        return {
+            "added": result['added'],
+            "removed": result['removed'],
+            "ignored": sorted(requested - set(result['shortcut_ids']))
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise _request_failed(e)
 
 # Export/Import endpoints
+def _export_document(shortcuts: List[Dict[str, Any]], folders: List[Dict[str, Any]]) -> Dict[str, Any]:
+    return {
+        'version': '1.0',
+        'exported_at': datetime.utcnow().isoformat(),
+        'shortcuts': shortcuts,
+        'folders': folders
+    }
+
+def _plan_import(user_id: str, shortcuts: List[Dict[str, Any]], on_conflict: str, triggers: Dict[str, str]) -> Dict[str, Any]:
+    """Work out the rows an import inserts and overwrites; `triggers` is updated in place"""
+    now = datetime.utcnow().isoformat()
+    new_shortcuts: Dict[str, Dict[str, Any]] = {}
+    overwrites: Dict[str, Dict[str, Any]] = {}
+    skipped_count = 0
+    renamed_count = 0
+    
+    for shortcut_data in shortcuts:
+        trigger = shortcut_data['trigger']
+        existing_id = triggers.get(trigger_key(trigger))
+        if existing_id:
+            if on_conflict == 'skip':
+                skipped_count += 1
+                continue
+            if on_conflict == 'overwrite':
+                target = new_shortcuts.get(existing_id) or overwrites.setdefault(existing_id, {
+                    'id': existing_id,
+                    'user_id': user_id,
+                    'trigger': trigger
+                })
+                target.update({'content': shortcut_data['content'], 'template': compiled_for(shortcut_data), 'updated_at': now})
+                continue
+            trigger = unique_trigger(trigger, triggers)
+            renamed_count += 1
+        
+        # Create new shortcut with new ID
+        new_shortcut = {
+            'id': str(uuid.uuid4()),
+            'user_id': user_id,
+            'trigger': trigger,
+            'content': shortcut_data['content'],
+            # Imported content that does not parse is kept as plain text
+            'template': compiled_for(shortcut_data),
+            'created_at': now,
+            'updated_at': now
+        }
+        triggers[trigger_key(trigger)] = new_shortcut['id']
+        new_shortcuts[new_shortcut['id']] = new_shortcut
+    
+    return {
+        'insert': list(new_shortcuts.values()),
+        'overwrite': list(overwrites.values()),
+        'renamed_count': renamed_count,
+        'skipped_count': skipped_count
+    }
+
+def _import_summary(plan: Dict[str, Any]) -> Dict[str, int]:
+    return {
+        "imported_count": len(plan['insert']),
+        "overwritten_count": len(plan['overwrite']),
+        "renamed_count": plan['renamed_count'],
+        "skipped_count": plan['skipped_count']
+    }
+
 @api_router.get("/export")
-async def export_shortcuts(user_id: str = Depends(get_current_user)):
+async def export_shortcuts(response: Response, route: str = Depends(read_route), user_id: str = Depends(get_current_user)):
     """Export all user shortcuts"""
     try:
         # Get all user data
-        shortcuts_result = supabase_client.table('shortcuts').select('*').eq('user_id', user_id).execute()
-        folders_result = supabase_client.table('folders').select('*').eq('user_id', user_id).execute()
-        
-        export_data = {
-            'version': '1.0',
-            'exported_at': datetime.utcnow().isoformat(),
-            'shortcuts': shortcuts_result.data,
-            'folders': folders_result.data
-        }
+        library, folders = await asyncio.gather(
+            load_library(user_id, route, response),
+            stale_reads.read(
+                ('folders', user_id, route),
+                lambda: run_read(route, lambda db: db.table('folders').select('*').eq('user_id', user_id).execute().data),
+                response,
+                fallback=True
+            )
+        )
         
-        return export_data
+        return _export_document(list(library.rows()), folders)
     except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+        raise _request_failed(e)
 
 @api_router.post("/import")
-async def import_shortcuts(import_data: Dict[str, Any], user_id: str = Depends(get_current_user)):
-    """Import shortcuts from exported data"""
+async def import_shortcuts(import_data: Dict[str, Any], response: Response, on_conflict: str = 'skip', idempotency_key: Optional[str] = Header(None), user_id: str = Depends(get_current_user)):
+    """Import shortcuts from exported data
+    
+    `on_conflict` decides what happens to a shortcut whose trigger is already
+    used: `skip` it, `rename` it (`@sig` -> `@sig-2`) or `overwrite` the
+    existing shortcut's content. Retries with the same Idempotency-Key replay
+    the first response instead of importing twice.
+    """
+    return await run_idempotent(
+        user_id, 'import', idempotency_key, request_fingerprint(import_data, on_conflict), response,
+        lambda: _import_shortcuts(import_data, on_conflict, user_id)
+    )
+
+async def _import_shortcuts(import_data: Dict[str, Any], on_conflict: str, user_id: str) -> Dict[str, int]:
+    if on_conflict not in IMPORT_CONFLICT_POLICIES:
+        raise HTTPException(status_code=400, detail=f"on_conflict must be one of {', '.join(IMPORT_CONFLICT_POLICIES)}")
     try:
-        imported_count = 0
+        plan = _plan_import(user_id, import_data.get('shortcuts', []), on_conflict, dict(await load_trigger_index(user_id)))
         
-        # Import shortcuts
-        if 'shortcuts' in import_data:
-            for shortcut_data in import_data['shortcuts']:
-                # Create new shortcut with new ID
-                new_shortcut = {
-                    'id': str(uuid.uuid4()),
-                    'user_id': user_id,
-                    'trigger': shortcut_data['trigger'],
-                    'content': shortcut_data['content'],
-                    'created_at': datetime.utcnow().isoformat(),
-                    'updated_at': datetime.utcnow().isoformat()
-                }
-                
-                supabase_client.table('shortcuts').insert(new_shortcut).execute()
-                imported_count += 1
+        # One bulk call each instead of one insert per shortcut
+        if plan['insert']:
+            supabase_client.table('shortcuts').insert(plan['insert']).execute()
+        if plan['overwrite']:
+            supabase_client.table('shortcuts').upsert(plan['overwrite']).execute()
+        if plan['insert'] or plan['overwrite']:
+            library_changed(user_id)
         
-        return {"imported_count": imported_count}
+        return _import_summary(plan)
+    except Exception as e:
+        raise _request_failed(e)
+
+# Background job endpoints
+@job_queue.handler('import')
+def run_import_job(job: JobContext) -> Dict[str, int]:
+    """Apply an import in chunks, checkpointing after each so a restarted job resumes"""
+    plan = job.state
+    if plan is None:
+        triggers = dict(get_trigger_index(job.user_id, lambda: _trigger_rows(job.user_id)))
+        plan = _plan_import(job.user_id, job.payload['data'].get('shortcuts', []), job.payload['on_conflict'], triggers)
+        job.progress(0, len(plan['insert']) + len(plan['overwrite']), state=plan)
+    
+    # Upserts rather than inserts, so re-applying a chunk after a restart is harmless
+    writes = [(True, row) for row in plan['insert']] + [(False, row) for row in plan['overwrite']]
+    try:
+        for start in range(job.done, len(writes), IMPORT_CHUNK_SIZE):
+            chunk = writes[start:start + IMPORT_CHUNK_SIZE]
+            for is_new in (True, False):
+                rows = [row for new, row in chunk if new is is_new]
+                if rows:
+                    supabase_client.table('shortcuts').upsert(rows).execute()
+            job.progress(start + len(chunk))
+    finally:
+        if writes:
+            library_changed(job.user_id)
+    
+    return _import_summary(plan)
+
+@job_queue.handler('export')
+def run_export_job(job: JobContext) -> Dict[str, Any]:
+    job.progress(0, 2)
+    shortcuts = supabase_client.table('shortcuts').select('*').eq('user_id', job.user_id).execute().data
+    job.progress(1)
+    folders = supabase_client.table('folders').select('*').eq('user_id', job.user_id).execute().data
+    job.progress(2)
+    return _export_document(shortcuts, folders)
+
+async def _submit_job(user_id: str, kind: str, payload: Dict[str, Any]) -> Job:
+    if await job_queue.active_count(user_id) >= MAX_ACTIVE_JOBS_PER_USER:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=f"At most {MAX_ACTIVE_JOBS_PER_USER} jobs can be queued or running at once"
+        )
+    return Job(**await job_queue.submit(user_id, kind, payload))
+
+@api_router.post("/jobs/import", response_model=Job, status_code=status.HTTP_202_ACCEPTED)
+async def create_import_job(import_data: Dict[str, Any], response: Response, on_conflict: str = 'skip', idempotency_key: Optional[str] = Header(None), user_id: str = Depends(get_current_user)):
+    """Queue an import (same body and `on_conflict` as /import); poll /jobs/{id} for the result"""
+    if on_conflict not in IMPORT_CONFLICT_POLICIES:
+        raise HTTPException(status_code=400, detail=f"on_conflict must be one of {', '.join(IMPORT_CONFLICT_POLICIES)}")
+    try:
+        return await run_idempotent(
+            user_id, 'jobs/import', idempotency_key, request_fingerprint(import_data, on_conflict), response,
+            lambda: _submit_job(user_id, 'import', {'data': import_data, 'on_conflict': on_conflict})
+        )
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+        raise _request_failed(e)
+
+@api_router.post("/jobs/export", response_model=Job, status_code=status.HTTP_202_ACCEPTED)
+async def create_export_job(user_id: str = Depends(get_current_user)):
+    """Queue an export; the finished job's result is the /export document"""
+    try:
+        return await _submit_job(user_id, 'export', {})
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise _request_failed(e)
+
+@api_router.get("/jobs/{job_id}", response_model=Job)
+async def get_job(job_id: str, user_id: str = Depends(get_current_user)):
+    """Job status and progress; `result` is set once the job has succeeded"""
+    try:
+        job = await job_queue.get(job_id)
+    except Exception as e:
+        raise _request_failed(e)
+    if job is None or job['user_id'] != user_id:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return Job(**job)
+
+# Bulk onboarding (see onboarding.py)
+ADMIN_USER_IDS = frozenset(filter(None, (user_id.strip() for user_id in os.environ.get('ADMIN_USER_IDS', '').split(','))))
+ONBOARD_PROGRESS_TTL = 24 * 3600
+# Upload chunks buffered between the request and the thread parsing them
+ONBOARD_BUFFERED_CHUNKS = 16
+# Auth accounts created at once per batch
+ONBOARD_ACCOUNT_CONCURRENCY = 8
+
+async def get_admin_user(user_id: str = Depends(get_current_user)) -> str:
+    if user_id not in ADMIN_USER_IDS:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admins only")
+    return user_id
+
+def _onboard_key(upload_id: str) -> str:
+    return f'onboard:{upload_id}'
+
+def _existing_emails(emails: List[str]) -> set:
+    rows = supabase_client.table('users').select('email_key').in_('email_key', emails).execute().data
+    return {row['email_key'] for row in rows}
+
+def _invite_user(row: Dict[str, Any]) -> Optional[str]:
+    """Create the auth account for an onboarded user (they get an invitation email); None if one exists"""
+    try:
+        response = auth_breaker.call(lambda: supabase_client.auth.admin.invite_user_by_email(
+            row['email'], {'data': {'full_name': row['name'], 'avatar_url': row['avatar_url']}}
+        ), AUTH_UPSTREAM_ERRORS)
+    except Exception as e:
+        # 422: the email is already registered; its users row is created on first login
+        if AuthApiError is not None and isinstance(e, AuthApiError) and e.status == 422:
+            return None
+        raise
+    return response.user.id
+
+def _create_accounts(rows: List[Dict[str, Any]]) -> Dict[str, str]:
+    with ThreadPoolExecutor(ONBOARD_ACCOUNT_CONCURRENCY) as pool:
+        account_ids = list(pool.map(_invite_user, rows))
+    return {row['email'].lower(): account_id for row, account_id in zip(rows, account_ids) if account_id}
+
+def _insert_users(rows: List[Dict[str, Any]]) -> set:
+    # Skips emails a concurrent signup took since the lookup
+    inserted = supabase_client.table('users').upsert(rows, on_conflict='email_key', ignore_duplicates=True).execute().data
+    return {row['id'] for row in inserted}
+
+def _upsert_shortcuts(rows: List[Dict[str, Any]]) -> None:
+    supabase_client.table('shortcuts').upsert(rows).execute()
+
+def _queued_chunks(buffered: queue.Queue):
+    while True:
+        chunk = buffered.get()
+        if chunk is None:
+            return
+        if isinstance(chunk, Exception):
+            raise chunk
+        yield chunk
+
+async def _consume_body(request: Request, consume: Callable[[Any], Any]) -> Any:
+    """Run `consume(chunks)` in a thread while the body arrives; a bounded queue keeps memory flat"""
+    buffered: queue.Queue = queue.Queue(ONBOARD_BUFFERED_CHUNKS)
+    task = asyncio.ensure_future(asyncio.to_thread(consume, _queued_chunks(buffered)))
+    
+    async def put(chunk: Any) -> bool:
+        # False once the consumer has stopped (it failed), so the rest of the body is not read
+        while not task.done():
+            try:
+                buffered.put_nowait(chunk)
+                return True
+            except queue.Full:
+                await asyncio.wait({task}, timeout=0.05)
+        return False
+    
+    try:
+        async for chunk in request.stream():
+            if chunk and not await put(chunk):
+                break
+    except Exception as e:
+        # The client went away mid-upload: stop the consumer rather than treat the body as complete
+        await put(e)
+        await asyncio.gather(task, return_exceptions=True)
+        raise
+    await put(None)
+    return await task
+
+@api_router.post("/admin/onboard")
+async def onboard_users(request: Request, admin_id: str = Depends(get_admin_user)):
+    """Create users and their starter shortcuts from a CSV or NDJSON upload; admins only
+    
+    The upload is processed while it streams in (see onboarding.py). Progress
+    is kept under the request's X-Request-ID, so a client that sets one can
+    poll /admin/onboard/{request_id}; the response is the final report.
+    """
+    upload = upload_format(request.headers.get('content-type'))
+    if upload is None:
+        raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, detail="Upload text/csv or application/x-ndjson")
+    upload_id = request_id.get() or uuid.uuid4().hex
+    progress: Dict[str, Any] = {'id': upload_id, 'status': 'running'}
+    
+    def save_progress(report: OnboardReport) -> None:
+        progress.update(report.as_dict())
+        get_cache().set(_onboard_key(upload_id), progress, ONBOARD_PROGRESS_TTL)
+    
+    try:
+        # New accounts have no cached library, so nothing needs invalidating
+        report = await _consume_body(request, lambda chunks: onboard(
+            chunks, upload, _existing_emails, _create_accounts, _insert_users, _upsert_shortcuts,
+            MAX_SHORTCUTS_PER_USER, IMPORT_CHUNK_SIZE, save_progress
+        ))
+    except Exception as e:
+        progress.update(status='failed', error=str(e))
+        get_cache().set(_onboard_key(upload_id), progress, ONBOARD_PROGRESS_TTL)
+        raise _request_failed(e)
+    
+    save_progress(report)
+    progress['status'] = 'succeeded'
+    get_cache().set(_onboard_key(upload_id), progress, ONBOARD_PROGRESS_TTL)
+    logger.info("Onboarding upload finished", extra={'admin_id': admin_id, 'upload_id': upload_id, 'created_count': report.created, 'rejected_count': report.rejected})
+    return progress
+
+@api_router.get("/admin/onboard/{upload_id}")
+async def get_onboard_progress(upload_id: str, admin_id: str = Depends(get_admin_user)):
+    """Progress of an onboarding upload, by the X-Request-ID it was sent with"""
+    progress = get_cache().get(_onboard_key(upload_id))
+    if progress is None:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return progress
 
 @api_router.post("/tags", response_model=Tag)
-async def create_tag(tag_data: TagCreate):
-    """Create a new tag"""
+async def create_tag(tag_data: TagCreate, user_id: str = Depends(get_current_user)):
+    """Create a new tag, or return the existing one with the same name"""
     try:
-        # Check if tag already exists
-        existing = supabase_client.table('tags').select('*').eq('name', tag_data.name).execute()
-        if existing.data:
-            return Tag(**existing.data[0])
-        
-        tag_id = str(uuid.uuid4())
-        now = datetime.utcnow()
+        tags = await get_tag_dictionary(user_id)
+        if tag_data.name in tags:
+            return _tag_from_row(tags[tag_data.name])
         
+        # Single upsert on (user_id, name); id and created_at come from column
+        # defaults so a concurrent create of the same name keeps the first row
         new_tag = {
-            'id': tag_id,
+            'user_id': user_id,
             'name': tag_data.name,
-            'created_at': now.isoformat(),
-            'updated_at': now.isoformat()
+            'updated_at': datetime.utcnow().isoformat()
         }
         
-        result = supabase_client.table('tags').insert(new_tag).execute()
+        result = supabase_client.table('tags').upsert(new_tag, on_conflict='user_id,name').execute()
+        invalidate_tag_dictionary(user_id)
         
-        return Tag(
-            id=tag_id,
-            name=tag_data.name,
-            created_at=now,
-            updated_at=now
+        return _tag_from_row(result.data[0])
+    except Exception as e:
+        raise _request_failed(e)
+
+# Usage telemetry endpoints
+@api_router.post("/usage", status_code=status.HTTP_202_ACCEPTED)
+async def record_usage(batch: UsageBatch, user_id: str = Depends(get_current_user)):
+    """Record a batch of shortcut expansions (buffered, written asynchronously)"""
+    now = datetime.now(timezone.utc)
+    accepted = 0
+    for event in batch.events:
+        occurred_at = now
+        if event.occurred_at:
+            occurred_at = event.occurred_at if event.occurred_at.tzinfo else event.occurred_at.replace(tzinfo=timezone.utc)
+            occurred_at = occurred_at.astimezone(timezone.utc)
+        if usage_buffer.add(user_id, event.shortcut_id, occurred_at, event.count):
+            accepted += 1
+    return {"accepted": accepted, "received": len(batch.events)}
+
+def _usage_summary(expansions: int, chars_saved: int) -> Dict[str, Any]:
+    return {
+        "expansions": expansions,
+        "chars_saved": chars_saved,
+        "seconds_saved": round(chars_saved / TYPING_CHARS_PER_SECOND)
+    }
+
+@api_router.get("/stats")
+async def get_stats(top: int = 10, user_id: str = Depends(get_current_user)):
+    """Usage totals, this week's totals and the most used shortcuts (from rollup tables)"""
+    try:
+        top = max(1, min(top, 100))
+        week_start = (datetime.now(timezone.utc).date() - timedelta(days=6)).isoformat()
+        
+        totals_result, week_result, top_result = await asyncio.gather(
+            asyncio.to_thread(lambda: supabase_client.table('user_usage_totals').select('expansions,chars_saved').eq('user_id', user_id).execute()),
+            asyncio.to_thread(lambda: supabase_client.table('user_usage_daily').select('expansions,chars_saved').eq('user_id', user_id).gte('day', week_start).execute()),
+            asyncio.to_thread(lambda: supabase_client.table('shortcut_usage_totals')
+                              .select('shortcut_id,count,chars_saved,last_used_at,shortcuts(trigger)')
+                              .eq('user_id', user_id).order('count', desc=True).limit(top).execute())
         )
+        
+        totals = totals_result.data[0] if totals_result.data else {'expansions': 0, 'chars_saved': 0}
+        return {
+            "all_time": _usage_summary(totals['expansions'], totals['chars_saved']),
+            "this_week": _usage_summary(
+                sum(row['expansions'] for row in week_result.data),
+                sum(row['chars_saved'] for row in week_result.data)
+            ),
+            "top_shortcuts": [
+                {
+                    "shortcut_id": row['shortcut_id'],
+                    "trigger": (row.get('shortcuts') or {}).get('trigger'),
+                    "count": row['count'],
+                    "chars_saved": row['chars_saved'],
+                    "last_used_at": row['last_used_at']
+                }
+                for row in top_result.data
+            ]
+        }
     except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+        raise _request_failed(e)
 
 # Search endpoint
 @api_router.get("/search", response_model=List[Shortcut])
-async def search_shortcuts(q: str, user_id: str = Depends(get_current_user)):
+async def search_shortcuts(q: str, route: str = Depends(read_route), user_id: str = Depends(get_current_user)):
     """Search shortcuts by trigger, content, or tags"""
     try:
         # Search in triggers and content
-        result = supabase_client.table('shortcuts').select('*').eq('user_id', user_id).or_(f'trigger.ilike.%{q}%,content.ilike.%{q}%').execute()
+        rows = await read_coalescer.do(
+            ('search', user_id, q, route),
+            lambda: run_read(route, lambda db: db.table('shortcuts').select('*').eq('user_id', user_id).or_(f'trigger.ilike.%{q}%,content.ilike.%{q}%').execute().data)
+        )
         
         shortcuts = []
-        for shortcut in result.data:
+        for shortcut in rows:
             shortcuts.append(Shortcut(
                 id=shortcut['id'],
                 user_id=shortcut['user_id'],
@@ -590,11 +2293,20 @@ async def search_shortcuts(q: str, user_id: str = Depends(get_current_user)):
         
         return shortcuts
     except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+        raise _request_failed(e)
 
 # Include the router in the main app
 app.include_router(api_router)
 
+# Per-IP token bucket, applied before authentication
+app.add_middleware(IPRateLimitMiddleware, limiter=ip_limiter)
+
+# Compress large responses (exports, full syncs) per Accept-Encoding
+app.add_middleware(CompressionMiddleware)
+
+# Successful writes return a token clients echo to read their own writes
+app.add_middleware(ConsistencyTokenMiddleware)
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -602,15 +2314,20 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[CONSISTENCY_HEADER, STALE_HEADER, REPLAY_HEADER, REQUEST_ID_HEADER, "ETag", "Retry-After"],
 )
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# Outermost, so every log record of a request carries its id
+app.add_middleware(RequestIdMiddleware)
+
+# Configure logging (JSON lines written from a background thread, see logs.py)
+setup_logging()
 logger = logging.getLogger(__name__)
+auth_logger = logging.getLogger(f'{__name__}.auth')
+
+_import_finished = time.perf_counter()
 
 if __name__ == "__main__":
+    # Single process for local use; run `python cli.py serve` in production
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8001)
\ No newline at end of file
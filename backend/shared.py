@@ -0,0 +1,91 @@
+"""Shared-folder publishing and subscriptions.
+
+Publishing a folder writes one immutable snapshot row to
+`shared_folder_versions` and bumps `shared_folders.version`. Subscribers keep
+only a `shared_folder_users` row pointing at the shared folder, never copies
+of its shortcuts, so republishing a team folder costs the same two writes
+whether it has one subscriber or ten thousand.
+
+Subscribed shortcuts are merged into a subscriber's /sync response at read
+time: the current version of each subscribed folder is looked up, and its
+snapshot is read from the cache tier (snapshots never change, so they are
+cached by folder and version). The subscriber's own shortcuts win trigger
+clashes.
+"""
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from cache import get_cache
+from formats import epoch_ms
+from triggers import trigger_key
+
+SNAPSHOT_CACHE_TTL = 24 * 3600
+
+def snapshot_rows(rows: Iterable[Dict[str, Any]]) -> List[List[Any]]:
+    """The compact form stored per published version: [id, trigger, content, template]
+    
+    Versions published before templates were stored have no `template` entry.
+    """
+    return [
+        [row['id'], row['trigger'], row['content'], row.get('template')]
+        for row in sorted(rows, key=lambda row: trigger_key(row['trigger']))
+    ]
+
+def _snapshot_key(shared_folder_id: str, version: int) -> str:
+    return f'shared:{shared_folder_id}:{version}'
+
+def load_snapshots(folders: List[Dict[str, Any]], fetch: Callable[[List[Tuple[str, int]]], Dict[Tuple[str, int], List[List[Any]]]]) -> Dict[Tuple[str, int], List[List[Any]]]:
+    """Snapshots of the current version of each folder, from the cache tier or `fetch` for the misses"""
+    cache = get_cache()
+    snapshots = {}
+    missing = []
+    for folder in folders:
+        key = (folder['id'], folder['version'])
+        snapshot = cache.get(_snapshot_key(*key))
+        if snapshot is None:
+            missing.append(key)
+        else:
+            snapshots[key] = snapshot
+    if missing:
+        for key, snapshot in fetch(missing).items():
+            cache.set(_snapshot_key(*key), snapshot, SNAPSHOT_CACHE_TTL)
+            snapshots[key] = snapshot
+    return snapshots
+
+def merge_subscribed(
+    own_triggers: Iterable[str],
+    folders: List[Dict[str, Any]],
+    snapshots: Dict[Tuple[str, int], List[List[Any]]],
+    since: Optional[int] = None
+) -> Tuple[List[Dict[str, Any]], List[str], int]:
+    """Compact rows, live ids and cursor (epoch ms) for the subscribed folders
+
+    `folders` are shared_folders rows with the subscriber's `subscribed_at`.
+    Every shortcut of a folder counts as changed when the folder was
+    republished or subscribed to after `since`.
+    """
+    taken: Set[str] = {trigger_key(trigger) for trigger in own_triggers}
+    rows = []
+    ids = []
+    cursor = 0
+    for folder in sorted(folders, key=lambda folder: folder['subscribed_at']):
+        snapshot = snapshots.get((folder['id'], folder['version']))
+        if snapshot is None:
+            continue
+        published = epoch_ms(folder['published_at'])
+        changed = max(published, epoch_ms(folder['subscribed_at']))
+        cursor = max(cursor, changed)
+        for shortcut_id, trigger, content, *template in snapshot:
+            key = trigger_key(trigger)
+            if key in taken:
+                continue
+            taken.add(key)
+            ids.append(shortcut_id)
+            if since is None or changed > since:
+                rows.append({
+                    'id': shortcut_id,
+                    'trigger': trigger,
+                    'content': content,
+                    'template': template[0] if template else None,
+                    'updated_at': folder['published_at']
+                })
+    return rows, ids, cursor
@@ -0,0 +1,122 @@
+"""Related shortcuts and near-duplicate detection.
+
+Each shortcut's content becomes a TF-IDF vector over hashed character
+trigrams, which are robust to small edits. The vectors are built in one
+vectorized pass over the whole library: every text is concatenated into one
+byte array, trigrams are hashed with array arithmetic and counted with
+bincount. Normalized rows are multiplied once to get all-pairs cosine
+similarity; for a 500-shortcut library the whole report takes tens of
+milliseconds, once per library version.
+
+A SimilarityReport keeps only what the endpoints need: the top related
+shortcuts per shortcut, and every pair above MIN_SIMILARITY. Reports are
+cached per worker, tagged with the library version, so they are recomputed
+only after the library changes.
+"""
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+import os
+import threading
+
+import numpy as np
+
+FEATURE_BITS = 11
+RELATED_LIMIT = 10
+# Pairs below this are not kept; /duplicates thresholds must be at least this
+MIN_SIMILARITY = 0.5
+DUPLICATE_THRESHOLD = 0.85
+SIMILARITY_CACHE_MAX_USERS = int(os.environ.get('SIMILARITY_CACHE_MAX_USERS', '2000'))
+
+def _normalize(text: str) -> bytes:
+    return ' '.join(text.casefold().split()).encode('utf-8')
+
+def tfidf_matrix(texts: Sequence[str], feature_bits: int = FEATURE_BITS) -> np.ndarray:
+    """L2-normalized TF-IDF rows over hashed character trigrams (float32, len(texts) x 2**feature_bits)"""
+    features = 1 << feature_bits
+    count = len(texts)
+    if count == 0:
+        return np.zeros((0, features), dtype=np.float32)
+
+    encoded = [_normalize(text) for text in texts]
+    # NUL separators keep trigrams from spanning two texts
+    data = np.frombuffer(b'\0'.join(encoded) + b'\0\0', dtype=np.uint8).astype(np.uint32)
+    doc = np.repeat(np.arange(count), [len(text) + 1 for text in encoded])[:len(data) - 2]
+    grams = (data[:-2] << 16) | (data[1:-1] << 8) | data[2:]
+    valid = (data[:-2] != 0) & (data[1:-1] != 0) & (data[2:] != 0)
+    # Multiplicative (Fibonacci) hashing into the top feature_bits bits
+    buckets = ((grams[valid].astype(np.uint64) * 2654435761) & 0xFFFFFFFF) >> (32 - feature_bits)
+    cells = np.bincount(doc[valid] * features + buckets.astype(np.int64), minlength=count * features)
+    # Weight only the non-zero cells, then scatter them into the dense matrix
+    nonzero = np.flatnonzero(cells)
+    rows, columns = np.divmod(nonzero, features)
+    document_frequency = np.bincount(columns, minlength=features)
+    idf = np.log((1 + count) / (1 + document_frequency[columns])) + 1
+    weights = np.log1p(cells[nonzero]) * idf
+    norms = np.sqrt(np.bincount(rows, weights=weights * weights, minlength=count))
+    matrix = np.zeros((count, features), dtype=np.float32)
+    matrix[rows, columns] = weights / norms[rows]
+    return matrix
+
+class SimilarityReport:
+    __slots__ = ('ids', 'triggers', '_positions', 'related', 'pairs')
+
+    def __init__(self, ids: Sequence[str], triggers: Sequence[str], texts: Sequence[str]):
+        self.ids = list(ids)
+        self.triggers = tuple(triggers)
+        self._positions = {shortcut_id: position for position, shortcut_id in enumerate(self.ids)}
+        matrix = tfidf_matrix(texts)
+        scores = matrix @ matrix.T
+        np.fill_diagonal(scores, 0)
+
+        # Top related per shortcut: (position, score), best first
+        self.related: List[List[Tuple[int, float]]] = []
+        limit = min(RELATED_LIMIT, max(len(self.ids) - 1, 0))
+        if limit:
+            top = np.argpartition(-scores, limit - 1, axis=1)[:, :limit]
+            top_scores = np.take_along_axis(scores, top, axis=1)
+            order = np.argsort(-top_scores, axis=1, kind='stable')
+            top = np.take_along_axis(top, order, axis=1).tolist()
+            top_scores = np.take_along_axis(top_scores, order, axis=1).tolist()
+            self.related = [
+                [(column, score) for column, score in zip(columns, values) if score > 0]
+                for columns, values in zip(top, top_scores)
+            ]
+        else:
+            self.related = [[] for _ in self.ids]
+
+        # All pairs above MIN_SIMILARITY, most similar first
+        rows, columns = np.nonzero(np.triu(scores >= MIN_SIMILARITY, k=1))
+        values = scores[rows, columns]
+        order = np.argsort(-values, kind='stable')
+        self.pairs: List[Tuple[int, int, float]] = list(zip(rows[order].tolist(), columns[order].tolist(), values[order].tolist()))
+
+    def position(self, shortcut_id: str) -> Optional[int]:
+        return self._positions.get(shortcut_id)
+
+    def describe(self, position: int) -> Dict[str, str]:
+        return {'id': self.ids[position], 'trigger': self.triggers[position]}
+
+class SimilarityCache:
+    """Per-worker LRU of similarity reports keyed by user, tagged with library versions"""
+
+    def __init__(self, max_users: int = SIMILARITY_CACHE_MAX_USERS):
+        self._max_users = max_users
+        self._entries: "OrderedDict[str, Tuple[str, SimilarityReport]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: str, version: str) -> Optional[SimilarityReport]:
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[0] != version:
+                return None
+            self._entries.move_to_end(user_id)
+            return entry[1]
+
+    def put(self, user_id: str, version: str, report: SimilarityReport) -> None:
+        with self._lock:
+            self._entries[user_id] = (version, report)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self._max_users:
+                self._entries.popitem(last=False)
+
+similarity_reports = SimilarityCache()
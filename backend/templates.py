@@ -0,0 +1,144 @@
+"""Template variables in shortcut content.
+
+Content may contain placeholders that are filled in at expansion time:
+
+    Hi {name}, see you {date:%A}.{cursor}
+
+- `{name}` or `{name:arg}`: a variable; the optional arg is passed to it
+  (a strftime format for the date and time built-ins)
+- `{{` and `}}`: literal braces
+
+Content is parsed when a shortcut is created, updated, imported or onboarded.
+Content that does not parse (code snippets, JSON and other text that merely
+contains braces) is kept as plain text rather than rejected, so no existing
+content stops being accepted. The compiled form is stored in the row's
+`template` column and shipped in bundles and syncs, so clients only
+substitute values. It is a list of literal strings and `[name]` or
+`[name, arg]` placeholders, or null for content with no placeholders or braces.
+
+    ["Hi ", ["name"], ", see you ", ["date", "%A"], ".", ["cursor"]]
+
+Built-in variables: `date`, `time` and `datetime` (from the render time),
+and `cursor`, which renders as nothing and marks where the caret goes. Other
+names are supplied by the caller.
+"""
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+import re
+
+TEMPLATE_CACHE_SIZE = 4096
+MAX_PLACEHOLDERS = 100
+
+CURSOR = 'cursor'
+BUILTIN_FORMATS = {'date': '%Y-%m-%d', 'time': '%H:%M', 'datetime': '%Y-%m-%d %H:%M'}
+
+_NAME = re.compile(r'[A-Za-z_][A-Za-z0-9_.-]*\Z')
+
+class TemplateError(ValueError):
+    def __init__(self, message: str, position: int):
+        super().__init__(f"{message} at character {position}")
+        self.position = position
+
+def compile_template(content: str) -> Optional[List[Any]]:
+    """The compiled form of `content`, or None if it is plain text; raises TemplateError"""
+    if '{' not in content and '}' not in content:
+        return None
+
+    parts: List[Any] = []
+    literal: List[str] = []
+    placeholders = 0
+    cursors = 0
+    i = 0
+    while i < len(content):
+        char = content[i]
+        if char == '}':
+            if content.startswith('}}', i):
+                literal.append('}')
+                i += 2
+                continue
+            raise TemplateError("Unmatched '}' (write '}}' for a literal brace)", i)
+        if char != '{':
+            literal.append(char)
+            i += 1
+            continue
+        if content.startswith('{{', i):
+            literal.append('{')
+            i += 2
+            continue
+
+        end = content.find('}', i + 1)
+        nested = content.find('{', i + 1)
+        if end == -1 or (nested != -1 and nested < end):
+            raise TemplateError("Unclosed '{' (write '{{' for a literal brace)", i)
+        name, colon, arg = content[i + 1:end].partition(':')
+        if not _NAME.match(name):
+            raise TemplateError(f"Invalid variable name '{name}'", i + 1)
+        if name == CURSOR:
+            cursors += 1
+            if cursors > 1:
+                raise TemplateError("Only one {cursor} is allowed", i)
+        placeholders += 1
+        if placeholders > MAX_PLACEHOLDERS:
+            raise TemplateError(f"More than {MAX_PLACEHOLDERS} variables", i)
+
+        if literal:
+            parts.append(''.join(literal))
+            literal = []
+        parts.append([name, arg] if colon else [name])
+        i = end + 1
+
+    if literal:
+        parts.append(''.join(literal))
+    return parts
+
+@lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def _compile_cached(content: str) -> Optional[List[Any]]:
+    try:
+        return compile_template(content)
+    except TemplateError:
+        return None
+
+def compile_or_plain(content: str) -> Optional[List[Any]]:
+    """The compiled form of `content`, or None if it is plain text or does not parse as a template
+    
+    Callers must not modify the result.
+    """
+    return _compile_cached(content)
+
+def compiled_for(row: Dict[str, Any]) -> Optional[List[Any]]:
+    """A row's compiled template: its stored `template`, else compiled (and cached) from its content"""
+    if row.get('template') is not None:
+        return row['template']
+    return compile_or_plain(row['content'])
+
+def render(parts: Optional[List[Any]], content: str, values: Dict[str, str], now: Optional[datetime] = None) -> Dict[str, Any]:
+    """Text of a compiled template with `values` substituted
+
+    Returns the text, the caret offset from {cursor} (None without one) and
+    the names that had no value (rendered as empty).
+    """
+    if parts is None:
+        return {'text': content, 'cursor': None, 'missing': []}
+
+    now = now or datetime.now(timezone.utc)
+    output: List[str] = []
+    length = 0
+    cursor = None
+    missing: List[str] = []
+    for part in parts:
+        if isinstance(part, str):
+            value = part
+        elif part[0] == CURSOR:
+            cursor = length
+            value = ''
+        elif part[0] in values:
+            value = values[part[0]]
+        elif part[0] in BUILTIN_FORMATS:
+            value = now.strftime(part[1] if len(part) > 1 else BUILTIN_FORMATS[part[0]])
+        else:
+            missing.append(part[0])
+            value = ''
+        output.append(value)
+        length += len(value)
+    return {'text': ''.join(output), 'cursor': cursor, 'missing': missing}
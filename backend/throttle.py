@@ -0,0 +1,91 @@
+"""Rate limiting and request coalescing for the API.
+
+RateLimiter keeps token buckets in the cache tier, so limits hold across
+workers when the shared cache is enabled. SingleFlight makes concurrent
+identical reads within a worker share one upstream call.
+"""
+from typing import Any, Callable, Dict, Hashable
+import os
+import asyncio
+
+from starlette.responses import JSONResponse
+
+from cache import get_cache
+
+class RateLimiter:
+    """Token bucket per key: `per_minute` sustained requests, bursts up to `burst`"""
+
+    def __init__(self, name: str, per_minute: float, burst: int):
+        self.name = name
+        self.rate = per_minute / 60.0
+        self.burst = burst
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def check(self, key: str) -> float:
+        """Take one token for `key`; returns 0 if allowed, else seconds to wait"""
+        if not self.enabled:
+            return 0.0
+        return get_cache().take_token(f'ratelimit:{self.name}:{key}', self.rate, self.burst)
+
+# Defaults are generous enough that a browser full of extension instances
+# syncing at startup stays well within them. Set the rate to 0 to disable.
+user_limiter = RateLimiter(
+    'user',
+    float(os.environ.get('RATE_LIMIT_USER_PER_MINUTE', '300')),
+    int(os.environ.get('RATE_LIMIT_USER_BURST', '60')),
+)
+ip_limiter = RateLimiter(
+    'ip',
+    float(os.environ.get('RATE_LIMIT_IP_PER_MINUTE', '600')),
+    int(os.environ.get('RATE_LIMIT_IP_BURST', '120')),
+)
+
+class IPRateLimitMiddleware:
+    """Reject requests from a client IP that has exhausted its bucket with a 429
+    
+    The client IP is `scope['client']`, which uvicorn sets from X-Forwarded-For
+    when the request comes through a proxy in its `forwarded_allow_ips` (see
+    cli.py). Untrusted peers cannot spoof it.
+    """
+
+    def __init__(self, app, limiter: RateLimiter):
+        self.app = app
+        self.limiter = limiter
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and scope.get('client'):
+            retry_after = self.limiter.check(scope['client'][0])
+            if retry_after:
+                response = JSONResponse(
+                    {'detail': 'Too many requests'},
+                    status_code=429,
+                    headers={'Retry-After': str(max(1, round(retry_after)))}
+                )
+                await response(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+class SingleFlight:
+    """Coalesce concurrent calls that share a key into one execution.
+
+    The first caller for a key runs the blocking function in a worker thread;
+    callers arriving while it is in flight await the same result (or error).
+    """
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+
+    async def do(self, key: Hashable, func: Callable[[], Any]) -> Any:
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(asyncio.to_thread(func))
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # Shield so one cancelled waiter does not cancel the shared call
+        return await asyncio.shield(future)
+
+    def __len__(self) -> int:
+        return len(self._inflight)
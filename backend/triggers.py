@@ -0,0 +1,113 @@
+"""Trigger uniqueness and prefix-ambiguity checks.
+
+The extension matches triggers case-insensitively, so triggers are compared by
+their casefolded key everywhere here (and by the lower(trigger) unique index
+in the database).
+
+TriggerIndex is a per-user trigger key -> shortcut id map kept in the cache
+tier, tagged with the library version it reflects. Conflict checks and the
+per-user shortcut count are answered from it without a query. Writes patch it
+in place; a version mismatch makes the next read rebuild it.
+"""
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from cache import get_cache
+from library import LibraryChange, library_version, on_library_change
+
+INDEX_TTL = 3600
+
+def trigger_key(trigger: str) -> str:
+    return trigger.casefold()
+
+def _cache_key(user_id: str) -> str:
+    return f'triggers:{user_id}'
+
+def get_trigger_index(user_id: str, load_rows: Callable[[], List[Dict]]) -> Dict[str, str]:
+    """The user's trigger key -> shortcut id map, rebuilt with `load_rows` if stale"""
+    cache = get_cache()
+    version = library_version(user_id)
+    entry = cache.get(_cache_key(user_id))
+    if entry is not None and entry[0] == version:
+        return entry[1]
+    index = {trigger_key(row['trigger']): row['id'] for row in load_rows()}
+    cache.set(_cache_key(user_id), (version, index), INDEX_TTL)
+    return index
+
+def find_conflict(index: Dict[str, str], trigger: str, shortcut_id: Optional[str] = None) -> Optional[str]:
+    """Id of another shortcut already using `trigger`, if any"""
+    existing = index.get(trigger_key(trigger))
+    return existing if existing is not None and existing != shortcut_id else None
+
+@on_library_change
+def _update_trigger_index(user_id: str, previous: Optional[str], version: str, changes: List[LibraryChange]) -> None:
+    cache = get_cache()
+    entry = cache.get(_cache_key(user_id))
+    if entry is None:
+        return
+    if not changes or entry[0] != previous:
+        cache.delete(_cache_key(user_id))
+        return
+    index = dict(entry[1])
+    for change in changes:
+        if change.old is not None:
+            index.pop(trigger_key(change.old['trigger']), None)
+        if change.new is not None:
+            index[trigger_key(change.new['trigger'])] = change.shortcut_id
+    cache.set(_cache_key(user_id), (version, index), INDEX_TTL)
+
+def unique_trigger(trigger: str, taken: Iterable[str]) -> str:
+    """`trigger` with the smallest numeric suffix (-2, -3, ...) not in `taken` (keys)"""
+    taken = set(taken)
+    suffix = 2
+    candidate = trigger
+    while trigger_key(candidate) in taken:
+        candidate = f'{trigger}-{suffix}'
+        suffix += 1
+    return candidate
+
+class TriggerTrie:
+    """Character trie over trigger keys; terminal nodes hold the shortcut ids"""
+
+    __slots__ = ('root',)
+
+    def __init__(self, triggers: Iterable[Tuple[str, str]] = ()):
+        self.root: dict = {}
+        for trigger, shortcut_id in triggers:
+            self.insert(trigger, shortcut_id)
+
+    def insert(self, trigger: str, shortcut_id: str) -> None:
+        node = self.root
+        for char in trigger_key(trigger):
+            node = node.setdefault(char, {})
+        node.setdefault(None, []).append((trigger, shortcut_id))
+
+    def prefixes_of(self, trigger: str) -> List[Tuple[str, str]]:
+        """Triggers that are strict prefixes of `trigger`"""
+        found = []
+        node = self.root
+        key = trigger_key(trigger)
+        for depth, char in enumerate(key):
+            if depth and None in node:
+                found.extend(node[None])
+            node = node.get(char)
+            if node is None:
+                break
+        return found
+
+def prefix_conflicts(rows: Iterable[Dict]) -> List[Dict]:
+    """Report triggers that are prefixes of other triggers.
+
+    While typing a longer trigger the extension will match the shorter one
+    first, so each entry lists the shortcut that shadows and the ones shadowed.
+    Runs in O(total trigger length).
+    """
+    rows = list(rows)
+    trie = TriggerTrie((row['trigger'], row['id']) for row in rows)
+    shadowed: Dict[Tuple[str, str], List[Dict]] = {}
+    for row in rows:
+        for prefix in trie.prefixes_of(row['trigger']):
+            shadowed.setdefault(prefix, []).append({'trigger': row['trigger'], 'shortcut_id': row['id']})
+    return [
+        {'trigger': trigger, 'shortcut_id': shortcut_id, 'prefix_of': sorted(longer, key=lambda item: item['trigger'])}
+        for (trigger, shortcut_id), longer in sorted(shadowed.items())
+    ]
@@ -0,0 +1,142 @@
+"""Write-behind buffer and rollup aggregator for shortcut expansion telemetry.
+
+POST /api/usage only adds events to an in-memory buffer, aggregated by
+(user, shortcut, hour). A background task flushes the aggregated counts in one
+upsert every FLUSH_INTERVAL seconds, or sooner once FLUSH_THRESHOLD distinct
+keys are pending. Database writes therefore scale with the number of active
+(user, shortcut, hour) keys, not with how much people type.
+
+UsageAggregator periodically runs the rollup function, which folds new hourly
+counts into the daily, monthly and per-user total tables that /api/stats reads.
+"""
+from datetime import datetime
+from typing import Callable, Dict, List, Tuple
+import os
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = float(os.environ.get('USAGE_FLUSH_INTERVAL', '10'))
+FLUSH_THRESHOLD = int(os.environ.get('USAGE_FLUSH_THRESHOLD', '1000'))
+# Hard bound on pending keys; beyond it new keys are dropped (telemetry is lossy)
+MAX_PENDING = int(os.environ.get('USAGE_MAX_PENDING', '50000'))
+
+UsageKey = Tuple[str, str, datetime]  # (user_id, shortcut_id, hour)
+
+class UsageBuffer:
+    def __init__(self, writer: Callable[[List[Dict]], None],
+                 flush_interval: float = FLUSH_INTERVAL,
+                 flush_threshold: int = FLUSH_THRESHOLD,
+                 max_pending: int = MAX_PENDING):
+        self._writer = writer
+        self._flush_interval = flush_interval
+        self._flush_threshold = flush_threshold
+        self._max_pending = max_pending
+        self._pending: Dict[UsageKey, int] = {}
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self.dropped = 0
+        self.flushed_rows = 0
+
+    def add(self, user_id: str, shortcut_id: str, hour: datetime, count: int = 1) -> bool:
+        """Record expansions in an hour bucket; returns False if dropped because the buffer is full"""
+        key = (user_id, shortcut_id, hour.replace(minute=0, second=0, microsecond=0))
+        if key not in self._pending and len(self._pending) >= self._max_pending:
+            self.dropped += count
+            return False
+        self._pending[key] = self._pending.get(key, 0) + count
+        if len(self._pending) >= self._flush_threshold:
+            self._wakeup.set()
+        return True
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    async def flush(self) -> int:
+        """Write all pending counts; on failure they are merged back for the next flush"""
+        if not self._pending:
+            return 0
+        batch, self._pending = self._pending, {}
+        rows = [
+            {'user_id': user_id, 'shortcut_id': shortcut_id, 'hour': hour.isoformat(), 'count': count}
+            for (user_id, shortcut_id, hour), count in batch.items()
+        ]
+        try:
+            await asyncio.to_thread(self._writer, rows)
+        except Exception as e:
+            logger.warning(f"Usage flush of {len(rows)} rows failed, will retry: {e}")
+            for key, count in batch.items():
+                if key in self._pending or len(self._pending) < self._max_pending:
+                    self._pending[key] = self._pending.get(key, 0) + count
+                else:
+                    self.dropped += count
+            return 0
+        self.flushed_rows += len(rows)
+        return len(rows)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self._flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the timer and write whatever is still pending"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+ROLLUP_INTERVAL = float(os.environ.get('USAGE_ROLLUP_INTERVAL', '60'))
+
+class UsageAggregator:
+    """Runs the incremental rollup on a timer.
+
+    The rollup itself is idempotent and guarded by an advisory lock in the
+    database, so running one aggregator per worker is safe.
+    """
+
+    def __init__(self, rollup: Callable[[], int], interval: float = ROLLUP_INTERVAL):
+        self._rollup = rollup
+        self._interval = interval
+        self._task = None
+        self.last_rolled_rows = 0
+
+    async def run_once(self) -> int:
+        try:
+            self.last_rolled_rows = await asyncio.to_thread(self._rollup)
+        except Exception as e:
+            logger.warning(f"Usage rollup failed: {e}")
+            return 0
+        return self.last_rolled_rows
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self._interval)
+            await self.run_once()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
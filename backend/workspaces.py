@@ -0,0 +1,72 @@
+"""Team workspaces and per-user access lists.
+
+A workspace owns shortcuts, folders and tags through their `workspace_id`
+column (with `user_id` NULL), so personal queries keyed on `user_id` never
+see workspace rows. Members have one of three roles:
+
+- viewer: read the workspace's content
+- editor: also create, change and delete it
+- owner: also manage members
+
+Permission checks read the user's access list, {workspace_id: role}, kept in
+the cache tier and rebuilt when their memberships change. Workspace reads
+then filter with one `workspace_id IN (...)` on an indexed column instead of
+joining memberships on every request.
+
+A membership change drops the access list from the cache tier, which reaches
+every worker with the shared tier. With per-worker caches it reaches only the
+worker that made the change, so there access lists are cached for at most
+LOCAL_INVALIDATION_TTL seconds and a removed member loses access within that.
+"""
+from typing import Callable, Dict, List, Optional
+
+from cache import coherent_ttl, get_cache
+
+ACCESS_LIST_TTL = 600
+
+VIEWER = 'viewer'
+EDITOR = 'editor'
+OWNER = 'owner'
+ROLES = (VIEWER, EDITOR, OWNER)
+
+_RANK = {role: rank for rank, role in enumerate(ROLES)}
+
+class AccessList:
+    __slots__ = ('roles',)
+
+    def __init__(self, roles: Dict[str, str]):
+        self.roles = roles
+
+    def role(self, workspace_id: str) -> Optional[str]:
+        return self.roles.get(workspace_id)
+
+    def allows(self, workspace_id: str, role: str) -> bool:
+        """Whether the user holds at least `role` in the workspace"""
+        held = self.roles.get(workspace_id)
+        return held is not None and _RANK[held] >= _RANK[role]
+
+    @property
+    def readable(self) -> List[str]:
+        return sorted(self.roles)
+
+    @property
+    def writable(self) -> List[str]:
+        return sorted(workspace_id for workspace_id in self.roles if self.allows(workspace_id, EDITOR))
+
+    def __len__(self) -> int:
+        return len(self.roles)
+
+def _access_key(user_id: str) -> str:
+    return f'access:{user_id}'
+
+def load_access_list(user_id: str, fetch: Callable[[str], List[Dict[str, str]]]) -> AccessList:
+    """The user's access list from the cache tier, or built from `fetch(user_id)` membership rows"""
+    cache = get_cache()
+    roles = cache.get(_access_key(user_id))
+    if roles is None:
+        roles = {row['workspace_id']: row['role'] for row in fetch(user_id)}
+        cache.set(_access_key(user_id), roles, coherent_ttl(ACCESS_LIST_TTL))
+    return AccessList(roles)
+
+def invalidate_access_list(user_id: str) -> None:
+    get_cache().delete(_access_key(user_id))
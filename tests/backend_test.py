@@ -146,22 +146,25 @@ class TextGrowAPITester:
         
         return success and success_invalid
 
-    def run_test(self, name, method, endpoint, expected_status, data=None, check_response=None):
+    def run_test(self, name, method, endpoint, expected_status, data=None, check_response=None, headers=None):
         """Run a single API test"""
         url = f"{self.base_url}/{endpoint}"
+        headers = {**self.headers, **(headers or {})}
         self.tests_run += 1
         print(f"\n🔍 Testing {name}...")
         print(f"   URL: {url}")
         
         try:
             if method == 'GET':
-                response = requests.get(url, headers=self.headers)
+                response = requests.get(url, headers=headers)
             elif method == 'POST':
-                response = requests.post(url, json=data, headers=self.headers)
+                response = requests.post(url, json=data, headers=headers)
             elif method == 'PUT':
-                response = requests.put(url, json=data, headers=self.headers)
+                response = requests.put(url, json=data, headers=headers)
+            elif method == 'PATCH':
+                response = requests.patch(url, json=data, headers=headers)
             elif method == 'DELETE':
-                response = requests.delete(url, headers=self.headers)
+                response = requests.delete(url, headers=headers)
 
             success = response.status_code == expected_status
             if success:
@@ -212,7 +215,25 @@ class TextGrowAPITester:
             check_response=lambda r: 'status' in r and r['status'] == 'healthy'
         )
         
-        return success
+        # Test readiness endpoint (answered from the background prober)
+        success_ready, _ = self.run_test(
+            "Readiness Check",
+            "GET",
+            "health/ready",
+            200,
+            check_response=lambda r: r.get('breakers', {}).get('database', {}).get('state') == 'closed'
+        )
+        
+        # Test log rate counters in the health report
+        success_logs, _ = self.run_test(
+            "Log Rates",
+            "GET",
+            "health",
+            200,
+            check_response=lambda r: 'total' in r.get('logs', {})
+        )
+        
+        return success and success_ready and success_logs
 
     def test_auth_endpoints(self):
         """Test authentication endpoints"""
@@ -229,6 +250,53 @@ class TextGrowAPITester:
             check_response=lambda r: 'id' in r and 'email' in r
         )
         
+        if not success:
+            return False
+        
+        # Test preferences merge patch: null removes a key, objects are merged
+        success, _ = self.run_test(
+            "Patch Preferences",
+            "PATCH",
+            "me/preferences",
+            200,
+            data={"test_theme": "dark", "test_keys": {"a": 1, "b": 2}}
+        )
+        
+        if not success:
+            return False
+        
+        success, _ = self.run_test(
+            "Patch Preferences (Merge)",
+            "PATCH",
+            "me/preferences",
+            200,
+            data={"test_theme": None, "test_keys": {"a": None}},
+            check_response=lambda r: 'test_theme' not in r and r.get('test_keys') == {"b": 2}
+        )
+        
+        if not success:
+            return False
+        
+        success, _ = self.run_test(
+            "Get Preferences",
+            "GET",
+            "me/preferences",
+            200,
+            check_response=lambda r: r.get('test_keys') == {"b": 2}
+        )
+        
+        if not success:
+            return False
+        
+        # Bulk onboarding is limited to ADMIN_USER_IDS, which the test user is not in
+        success, _ = self.run_test(
+            "Onboard Users Requires Admin",
+            "POST",
+            "admin/onboard",
+            403,
+            data={"email": "new@example.com"}
+        )
+        
         return success
 
     def test_shortcut_endpoints(self):
@@ -301,6 +369,114 @@ class TextGrowAPITester:
             
             if not success:
                 return False
+            
+            # Test revision history (the update above changed the content)
+            success, _ = self.run_test(
+                "Shortcut Revisions",
+                "GET",
+                f"shortcuts/{shortcut_id}/revisions",
+                200,
+                check_response=lambda r: r.get('count', 0) >= 2
+            )
+            
+            if not success:
+                return False
+            
+            success, _ = self.run_test(
+                "Restore Shortcut Revision",
+                "POST",
+                f"shortcuts/{shortcut_id}/revisions/2/restore",
+                200,
+                check_response=lambda r: r.get('content') == 'john.doe@company.com'
+            )
+            
+            if not success:
+                return False
+        
+        # Test minimal sync payload
+        success, sync_data = self.run_test(
+            "Sync Shortcuts",
+            "GET",
+            "sync",
+            200,
+            check_response=lambda r: 'cursor' in r and isinstance(r.get('shortcuts'), list)
+        )
+        
+        if not success:
+            return False
+        
+        # Test duplicate trigger is rejected
+        success, _ = self.run_test(
+            "Create Duplicate Trigger",
+            "POST",
+            "shortcuts",
+            409,
+            data={"trigger": "@WORK-EMAIL", "content": "duplicate"}
+        )
+        
+        if not success:
+            return False
+        
+        # Test prefix conflict report
+        success, conflicts = self.run_test(
+            "Trigger Conflicts",
+            "GET",
+            "shortcuts/conflicts",
+            200,
+            check_response=lambda r: isinstance(r.get('conflicts'), list)
+        )
+        
+        if not success:
+            return False
+        
+        # Test typo-tolerant suggestions (transposed letters of the updated trigger)
+        success, suggestions = self.run_test(
+            "Suggest Triggers",
+            "GET",
+            "shortcuts/suggest?q=@wrok-email",
+            200,
+            check_response=lambda r: any(s["trigger"] == "@work-email" for s in r.get("suggestions", []))
+        )
+        
+        if not success:
+            return False
+        
+        # Test template rendering
+        success, _ = self.run_test(
+            "Render Template",
+            "POST",
+            "render",
+            200,
+            data={"content": "Hi {name}!{cursor}", "values": {"name": "Ann"}},
+            check_response=lambda r: r.get('text') == 'Hi Ann!' and r.get('cursor') == 7
+        )
+        
+        if not success:
+            return False
+        
+        # Test near-duplicate report and related shortcuts
+        success, _ = self.run_test(
+            "Duplicate Shortcuts",
+            "GET",
+            "shortcuts/duplicates",
+            200,
+            check_response=lambda r: isinstance(r.get('duplicates'), list) and r.get('count') == len(r['duplicates'])
+        )
+        
+        if not success:
+            return False
+        
+        if shortcut_id:
+            success, _ = self.run_test(
+                "Related Shortcuts",
+                "GET",
+                f"shortcuts/{shortcut_id}/related",
+                200,
+                check_response=lambda r: isinstance(r.get('related'), list)
+            )
+            
+            if not success:
+                return False
         
         # Test search shortcuts
         success, search_results = self.run_test(
@@ -335,6 +511,7 @@ class TextGrowAPITester:
         folder_data = {
             "name": "Work Templates"
         }
+        idempotency_headers = {"Idempotency-Key": f"test-folder-{datetime.now().timestamp()}"}
         
         success, created_folder = self.run_test(
             "Create Folder",
@@ -342,7 +519,8 @@ class TextGrowAPITester:
             "folders",
             200,
             data=folder_data,
-            check_response=lambda r: 'id' in r and r['name'] == 'Work Templates'
+            check_response=lambda r: 'id' in r and r['name'] == 'Work Templates',
+            headers=idempotency_headers
         )
         
         if not success:
@@ -352,6 +530,20 @@ class TextGrowAPITester:
         if folder_id:
             self.created_resources['folders'].append(folder_id)
         
+        # Retrying with the same Idempotency-Key must not create a second folder
+        success, _ = self.run_test(
+            "Retry Create Folder (Idempotent)",
+            "POST",
+            "folders",
+            200,
+            data=folder_data,
+            check_response=lambda r: r.get('id') == folder_id,
+            headers=idempotency_headers
+        )
+        
+        if not success:
+            return False
+        
         # Test get folders (should have one now)
         success, folders = self.run_test(
             "Get Folders (With Data)",
@@ -381,6 +573,54 @@ class TextGrowAPITester:
             
             if not success:
                 return False
+            
+            # Test publishing the folder (republishing bumps the version)
+            success, _ = self.run_test(
+                "Publish Folder",
+                "POST",
+                "shared-folders",
+                200,
+                data={"folder_id": folder_id},
+                check_response=lambda r: r.get('version', 0) >= 1 and bool(r.get('share_link'))
+            )
+            
+            if not success:
+                return False
+        
+        # Test workspaces
+        success, workspace = self.run_test(
+            "Create Workspace",
+            "POST",
+            "workspaces",
+            200,
+            data={"name": "Test Team"},
+            check_response=lambda r: r.get('role') == 'owner'
+        )
+        
+        if not success:
+            return False
+        
+        success, _ = self.run_test(
+            "Create Workspace Shortcut",
+            "POST",
+            f"workspaces/{workspace.get('id')}/shortcuts",
+            200,
+            data={"trigger": "@team-hello", "content": "Hello from the team"}
+        )
+        
+        if not success:
+            return False
+        
+        success, _ = self.run_test(
+            "Get Workspace Shortcuts",
+            "GET",
+            "workspaces/all/shortcuts",
+            200,
+            check_response=lambda r: any(s.get('trigger') == '@team-hello' for s in r.get('shortcuts', []))
+        )
+        
+        if not success:
+            return False
         
         return success
 
@@ -390,7 +630,7 @@ class TextGrowAPITester:
         print("TESTING TAG ENDPOINTS")
         print("="*50)
         
-        # Test get tags (initially empty) - Note: tags endpoint doesn't require auth
+        # Test get tags (initially empty) - tags are scoped to the current user
         success, tags = self.run_test(
             "Get Tags (Empty)",
             "GET",
@@ -402,7 +642,7 @@ class TextGrowAPITester:
         if not success:
             return False
         
-        # Test create tag - Note: tags endpoint doesn't require auth
+        # Test create tag
         tag_data = {
             "name": "productivity"
         }
@@ -455,6 +695,37 @@ class TextGrowAPITester:
         
         return success
 
+    def test_usage_endpoints(self):
+        """Test usage telemetry ingestion and stats"""
+        print("\n" + "="*50)
+        print("TESTING USAGE ENDPOINTS")
+        print("="*50)
+        
+        shortcut_id = self.created_resources['shortcuts'][0] if self.created_resources['shortcuts'] else None
+        if shortcut_id:
+            success, usage_result = self.run_test(
+                "Record Usage",
+                "POST",
+                "usage",
+                202,
+                data={"events": [{"shortcut_id": shortcut_id}, {"shortcut_id": shortcut_id, "count": 2}]},
+                check_response=lambda r: r.get('accepted') == 2
+            )
+            
+            if not success:
+                return False
+        
+        # Stats come from rollup tables, so new usage may not show up yet
+        success, stats = self.run_test(
+            "Get Stats",
+            "GET",
+            "stats",
+            200,
+            check_response=lambda r: 'all_time' in r and 'this_week' in r and isinstance(r.get('top_shortcuts'), list)
+        )
+        
+        return success
+
     def test_export_import(self):
         """Test export/import functionality"""
         print("\n" + "="*50)
@@ -483,6 +754,29 @@ class TextGrowAPITester:
             check_response=lambda r: 'imported_count' in r
         )
         
+        if not success:
+            return False
+        
+        # Test background export job
+        success, job = self.run_test(
+            "Queue Export Job",
+            "POST",
+            "jobs/export",
+            202,
+            check_response=lambda r: 'id' in r and r.get('kind') == 'export'
+        )
+        
+        if not success:
+            return False
+        
+        success, _ = self.run_test(
+            "Get Export Job",
+            "GET",
+            f"jobs/{job['id']}",
+            200,
+            check_response=lambda r: r.get('status') in ('queued', 'running', 'succeeded')
+        )
+        
         return success
 
     def cleanup_resources(self):
@@ -517,7 +811,16 @@ class TextGrowAPITester:
                 f"tags/{tag_id}",
                 200
             )
-
+        
+        # Remove test preferences
+        self.run_test(
+            "Remove Test Preferences",
+            "PATCH",
+            "me/preferences",
+            200,
+            data={"test_keys": None}
+        )
+    
     def run_all_tests(self):
         """Run all API tests"""
         print("🚀 Starting TextGrow API Tests")
@@ -550,6 +853,11 @@ class TextGrowAPITester:
                 print("❌ Shortcut tests failed")
                 return False
             
+            # Test usage endpoints
+            if not self.test_usage_endpoints():
+                print("❌ Usage tests failed")
+                return False
+            
             # Test folder endpoints
             if not self.test_folder_endpoints():
                 print("❌ Folder tests failed")
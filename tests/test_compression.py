@@ -0,0 +1,40 @@
+import os
+import sys
+
+from fastapi import FastAPI
+from fastapi.responses import Response
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+from compression import CompressionMiddleware
+
+def _app() -> FastAPI:
+    app = FastAPI()
+    app.add_middleware(CompressionMiddleware, minimum_size=16)
+
+    # Two resources that reuse one version token as their ETag
+    @app.get("/profile")
+    async def profile():
+        return Response(b'{"profile":' + b'1' * 64 + b'}', media_type='application/json', headers={'ETag': '"v1"'})
+
+    @app.get("/preferences")
+    async def preferences():
+        return Response(b'{"preferences":' + b'2' * 64 + b'}', media_type='application/json', headers={'ETag': '"v1"'})
+
+    return app
+
+def test_shared_etag_does_not_share_encoded_bodies():
+    client = TestClient(_app())
+    profile = client.get("/profile", headers={'Accept-Encoding': 'gzip'})
+    preferences = client.get("/preferences", headers={'Accept-Encoding': 'gzip'})
+    assert profile.headers['content-encoding'] == 'gzip'
+    assert preferences.headers['content-encoding'] == 'gzip'
+    assert profile.content.startswith(b'{"profile":')
+    assert preferences.content.startswith(b'{"preferences":')
+
+def test_app_etag_is_kept_and_revalidated():
+    client = TestClient(_app())
+    response = client.get("/profile", headers={'Accept-Encoding': 'gzip', 'If-None-Match': '"v1"'})
+    assert response.status_code == 304
+    assert response.headers['etag'] == '"v1"'